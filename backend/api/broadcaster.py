@@ -0,0 +1,125 @@
+"""拼单进度推送合并
+
+热门拼单开团时每秒可能有上百次参团，如果每次都向 groupbuy_<id> 房间推送一帧，
+出站帧数随参团速度线性增长。GroupBuyBroadcaster 在进程内按拼单合并进度推送：
+- publish(id) 只登记该拼单有变化，窗口（GROUPBUY_BROADCAST_WINDOW_MS）结束时
+  一次查询读出所有待推送拼单的最新快照，每个拼单只推送一帧；
+- 成团、失败等终态事件调用 publish_now，立即推送并丢弃该拼单尚未发出的进度。
+每个进程每个房间每个窗口最多一帧；窗口为 0 时不合并，直接推送。
+
+合并推送由定时线程发出。在 ASGI 服务中登记时记下服务的事件循环，定时线程把发送
+协程交回该循环执行（进程内的 InMemoryChannelLayer 只能在同一个事件循环中投递）；
+Celery worker 等没有事件循环的场景在定时线程内直接发送。
+"""
+import asyncio
+import logging
+import os
+import threading
+
+from asgiref.sync import SyncToAsync
+
+from django.conf import settings
+from django.db import connection
+
+from api.models import GroupBuy
+from api.websocket_streams import stamp
+from api.websocket_utils import groupbuy_update_message, push, send_groupbuy_success, transmit
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FIELDS = ('id', 'current_participants', 'target_participants', 'status')
+MAX_TRACKED = 10000
+
+
+def _server_loop():
+    """当前线程由 ASGI 服务经 sync_to_async 调用时，返回服务的事件循环"""
+    threadlocal = SyncToAsync.threadlocal
+    if getattr(threadlocal, 'main_event_loop_pid', None) != os.getpid():
+        return None
+    loop = getattr(threadlocal, 'main_event_loop', None)
+    return loop if loop is not None and loop.is_running() else None
+
+
+def _snapshots(group_buy_ids):
+    return list(GroupBuy.objects.filter(id__in=list(group_buy_ids)).values(*SNAPSHOT_FIELDS))
+
+
+class GroupBuyBroadcaster:
+    def __init__(self, window_ms=None):
+        self._window_ms = window_ms
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._timer = None
+        self._loop = None
+        self._last_sent = {}  # 拼单最近一次推送的快照，内容未变时不重复推送
+        self.published = 0  # 登记的进度变化次数
+        self.sent = 0  # 实际推送的进度帧数
+
+    @property
+    def window(self) -> float:
+        window_ms = self._window_ms
+        if window_ms is None:
+            window_ms = getattr(settings, 'GROUPBUY_BROADCAST_WINDOW_MS', 250)
+        return max(window_ms, 0) / 1000
+
+    def publish(self, group_buy_id):
+        """登记拼单进度变化，窗口结束时合并推送"""
+        window = self.window
+        with self._lock:
+            self.published += 1
+            coalesce = window > 0
+            if coalesce:
+                self._loop = _server_loop() or self._loop
+                self._pending.add(group_buy_id)
+                if self._timer is None:
+                    self._timer = threading.Timer(window, self._flush_in_background)
+                    self._timer.daemon = True
+                    self._timer.start()
+        if not coalesce:
+            self._send(_snapshots([group_buy_id]), skip_unchanged=True)
+
+    def publish_now(self, group_buy_ids, success_ids=()):
+        """终态事件：立即推送快照（以及成团消息），不等待窗口"""
+        group_buy_ids = set(group_buy_ids) | set(success_ids)
+        if not group_buy_ids:
+            return
+        with self._lock:
+            self._pending -= group_buy_ids
+        self._send(_snapshots(group_buy_ids))
+        for group_buy_id in success_ids:
+            send_groupbuy_success(group_buy_id, {'message': '拼单成功！'})
+
+    def _flush_in_background(self):
+        with self._lock:
+            pending, self._pending = self._pending, set()
+            self._timer = None
+            loop = self._loop
+        try:
+            if pending:
+                self._send(_snapshots(pending), skip_unchanged=True, loop=loop)
+        except Exception:
+            logger.warning('拼单进度推送失败', exc_info=True)
+        finally:
+            # 定时线程使用独立的数据库连接，用完即关闭
+            connection.close()
+
+    def _send(self, snapshots, skip_unchanged=False, loop=None):
+        updates = []
+        with self._lock:
+            if len(self._last_sent) > MAX_TRACKED:
+                self._last_sent.clear()
+            for row in snapshots:
+                data = {field: row[field] for field in SNAPSHOT_FIELDS if field != 'id'}
+                if skip_unchanged and self._last_sent.get(row['id']) == data:
+                    continue
+                self._last_sent[row['id']] = data
+                updates.append((row['id'], data))
+            self.sent += len(updates)
+        messages = [groupbuy_update_message(group_buy_id, data) for group_buy_id, data in updates]
+        if loop is not None and loop.is_running():
+            asyncio.run_coroutine_threadsafe(transmit(stamp(messages)), loop)
+        else:
+            push(messages)
+
+
+broadcaster = GroupBuyBroadcaster()
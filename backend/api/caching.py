@@ -0,0 +1,135 @@
+"""接口响应缓存
+
+只读为主的公开接口用 cache_response 装饰，按完整 URL 缓存序列化后的数据：
+- 每个接口的过期时间在 settings.API_CACHE_TTLS 中配置；
+- 缓存键包含所依赖标签的版本号，invalidate_tags 递增版本即令旧键全部失效，无需逐个删除；
+- Product / GroupBuy / Order / MembershipTier / User 的保存和删除由信号触发失效，
+  绕过信号的批量 .update() 需在调用处显式 invalidate_tags；
+- 视图出错时返回的兜底数据用 skip_cache 标记，不写入缓存；
+- 每个接口的命中/未命中次数记录在缓存中，多进程共享，可在管理端查看。
+
+缓存后端由 settings.CACHES 决定：生产环境用 Redis，测试和单机部署用进程内 LRU（LocMemCache）。
+"""
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework import status
+from rest_framework.response import Response
+
+PRODUCTS = 'products'
+GROUPBUYS = 'groupbuys'
+ORDERS = 'orders'
+MEMBERSHIP_TIERS = 'membership_tiers'
+LEADERS = 'leaders'
+
+DEFAULT_TTL = 60
+
+# 已注册的接口，用于统计
+_endpoints = set()
+
+
+def _tag_key(tag):
+    return f'api_cache:tag:{tag}'
+
+
+def _stat_key(endpoint, kind):
+    return f'api_cache:stats:{endpoint}:{kind}'
+
+
+def _incr(key):
+    # 计数器不存在时先创建；incr 在 Redis 上是原子操作
+    cache.add(key, 0, timeout=None)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # 并发下刚被 LRU 淘汰
+        cache.set(key, 1, timeout=None)
+        return 1
+
+
+def tag_versions(tags):
+    """一次读取多个标签的当前版本号"""
+    keys = {tag: _tag_key(tag) for tag in tags}
+    found = cache.get_many(keys.values())
+    versions = []
+    for tag, key in keys.items():
+        version = found.get(key)
+        if version is None:
+            # 初始版本取当前时间，避免标签被淘汰后版本号回退到旧值而命中过期数据
+            cache.add(key, int(time.time() * 1000), timeout=None)
+            version = cache.get(key)
+        versions.append(str(version))
+    return versions
+
+
+def _bump(tags):
+    for tag in tags:
+        _incr(_tag_key(tag))
+
+
+def invalidate_tags(*tags):
+    """令依赖这些标签的缓存失效；在事务中调用时于提交后生效，避免读到未提交前的数据重新填充缓存"""
+    transaction.on_commit(lambda: _bump(tags))
+
+
+def endpoint_ttl(endpoint):
+    return getattr(settings, 'API_CACHE_TTLS', {}).get(endpoint, DEFAULT_TTL)
+
+
+def skip_cache(response):
+    """标记不应缓存的响应（如查询出错时的兜底数据）"""
+    response.skip_cache = True
+    return response
+
+
+def cache_response(endpoint, tags=()):
+    """缓存视图 GET 方法返回的 200 响应数据（skip_cache 标记的除外）"""
+    _endpoints.add(endpoint)
+
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            digest = hashlib.md5(request.build_absolute_uri().encode('utf-8')).hexdigest()
+            key = f"api_cache:{endpoint}:{'.'.join(tag_versions(tags))}:{digest}"
+
+            data = cache.get(key)
+            if data is not None:
+                _incr(_stat_key(endpoint, 'hits'))
+                response = Response(data)
+                response['X-Cache'] = 'HIT'
+                return response
+
+            _incr(_stat_key(endpoint, 'misses'))
+            response = method(self, request, *args, **kwargs)
+            if response.status_code == status.HTTP_200_OK and not getattr(response, 'skip_cache', False):
+                cache.set(key, response.data, timeout=endpoint_ttl(endpoint))
+            response['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
+
+
+def cache_stats():
+    """各接口的命中/未命中次数与命中率"""
+    endpoints = sorted(_endpoints)
+    keys = [_stat_key(e, kind) for e in endpoints for kind in ('hits', 'misses')]
+    found = cache.get_many(keys)
+    stats = {}
+    for endpoint in endpoints:
+        hits = found.get(_stat_key(endpoint, 'hits'), 0)
+        misses = found.get(_stat_key(endpoint, 'misses'), 0)
+        stats[endpoint] = {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / (hits + misses), 4) if hits + misses else 0,
+            'ttl': endpoint_ttl(endpoint),
+        }
+    return stats
+
+
+def reset_cache_stats():
+    cache.delete_many([_stat_key(e, kind) for e in _endpoints for kind in ('hits', 'misses')])
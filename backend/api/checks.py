@@ -0,0 +1,27 @@
+"""部署检查（python manage.py check --deploy）"""
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+# 只在当前进程内有效的缓存后端：多进程部署时各进程看到的是不同的缓存
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def cache_is_process_local(alias='default') -> bool:
+    return settings.CACHES.get(alias, {}).get('BACKEND') in PROCESS_LOCAL_CACHES
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    if not cache_is_process_local():
+        return []
+    return [
+        Warning(
+            '默认缓存只在单个进程内有效，多进程部署时 Idempotency-Key 无法跨进程去重，'
+            '同一个键的请求可能被执行多次；beat 刷新的首页统计也无法被 Web 进程读到。',
+            hint='多进程/多节点部署请设置 CACHE_BACKEND=redis（见 settings.CACHES）。',
+            id='api.W001',
+        ),
+    ]
@@ -0,0 +1,106 @@
+"""幂等键
+
+客户端在 POST 请求头中携带 Idempotency-Key，网络重试时复用同一个键：
+- 首个请求用 cache.add 原子地占用该键（Redis 上为 SET NX），执行视图后把响应保存
+  IDEMPOTENCY_TTL_SECONDS 秒；
+- 之后同键的请求直接返回保存的响应，不再执行视图，也不触碰拼单、商品等热点行；
+- 同键请求并发到达时只有一个能占用成功，其余在首个请求完成前返回 409；
+- 同一个键用于不同的请求内容返回 422，避免误把另一笔操作的结果当作重放。
+
+键按用户和接口隔离；服务端错误（5xx）不保存，客户端可用同一个键重试。
+占用依赖所有 Web 进程共享同一个缓存（Redis）；默认的进程内缓存只适用于单进程部署，
+check --deploy 会对此给出 api.W001 警告。
+"""
+import hashlib
+import json
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+MAX_KEY_LENGTH = 255
+
+PROCESSING = 'processing'
+COMPLETED = 'completed'
+
+
+def _ttl():
+    return getattr(settings, 'IDEMPOTENCY_TTL_SECONDS', 24 * 3600)
+
+
+def _lock_timeout():
+    # 占用中的键在此时间后自动释放，防止进程崩溃后永久锁死
+    return getattr(settings, 'IDEMPOTENCY_LOCK_SECONDS', 60)
+
+
+def _fingerprint(request, args, kwargs):
+    payload = json.dumps(
+        {'path': request.path, 'kwargs': kwargs, 'data': request.data},
+        sort_keys=True, default=str, ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _replay(record, fingerprint):
+    if record['fingerprint'] != fingerprint:
+        return Response(
+            {'error': '幂等键已用于不同的请求'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
+    if record['state'] == PROCESSING:
+        response = Response(
+            {'error': '相同的请求正在处理中，请稍后重试'},
+            status=status.HTTP_409_CONFLICT,
+        )
+        response['Retry-After'] = '1'
+        return response
+    response = Response(record['data'], status=record['status'])
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(scope):
+    """为视图的 POST 方法启用 Idempotency-Key；未携带该请求头时照常执行"""
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            key = request.META.get(HEADER)
+            if not key:
+                return method(self, request, *args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return Response({'error': 'Idempotency-Key 过长'}, status=status.HTTP_400_BAD_REQUEST)
+
+            user_id = getattr(request.user, 'pk', None) or 'anonymous'
+            cache_key = 'idempotency:{}:{}:{}'.format(scope, user_id, hashlib.sha256(key.encode('utf-8')).hexdigest())
+            fingerprint = _fingerprint(request, args, kwargs)
+
+            claim = {'state': PROCESSING, 'fingerprint': fingerprint}
+            if not cache.add(cache_key, claim, timeout=_lock_timeout()):
+                record = cache.get(cache_key)
+                if record is not None:
+                    return _replay(record, fingerprint)
+                # 记录恰好过期，重新占用
+                if not cache.add(cache_key, claim, timeout=_lock_timeout()):
+                    return _replay(cache.get(cache_key) or claim, fingerprint)
+
+            try:
+                response = method(self, request, *args, **kwargs)
+            except Exception:
+                cache.delete(cache_key)
+                raise
+
+            if response.status_code >= 500:
+                cache.delete(cache_key)
+            else:
+                cache.set(cache_key, {
+                    'state': COMPLETED,
+                    'fingerprint': fingerprint,
+                    'status': response.status_code,
+                    'data': response.data,
+                }, timeout=_ttl())
+            return response
+        return wrapper
+    return decorator
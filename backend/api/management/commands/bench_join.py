@@ -0,0 +1,112 @@
+"""
+Django Management命令：参团并发压测
+使用方法：python manage.py bench_join --clients 50 200 1000
+
+对同一个拼单模拟 N 个并发客户端同时参团，输出每档并发下的 joins/sec 与延迟分位数。
+注意：每个客户端线程占用一个数据库连接，MySQL 需保证 max_connections 足够。
+"""
+
+import statistics
+import threading
+import time
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from api.models import GroupBuy, Order, OrderItem, Product, User
+from api.services.join import join_group_buy
+
+
+class Command(BaseCommand):
+    help = '对单个拼单进行并发参团压测'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, nargs='+', default=[50, 200, 1000],
+                            help='并发客户端数，可指定多档（默认 50 200 1000）')
+        parser.add_argument('--joins-per-client', type=int, default=5,
+                            help='每个客户端连续参团次数（默认 5）')
+        parser.add_argument('--keep', action='store_true',
+                            help='保留压测产生的数据，默认压测结束后清理')
+
+    def handle(self, *args, **options):
+        tag = f"bench_{uuid.uuid4().hex[:8]}"
+        joins_per_client = options['joins_per_client']
+        max_clients = max(options['clients'])
+
+        User.objects.bulk_create([
+            User(username=f'{tag}_u{i}', password='!') for i in range(max_clients)
+        ])
+        users = list(User.objects.filter(username__startswith=f'{tag}_u').order_by('id'))
+        leader = User.objects.create(username=f'{tag}_leader', password='!', role='leader', leader_status='approved')
+        total_joins = sum(options['clients']) * joins_per_client
+        product = Product.objects.create(name=f'{tag}_product', price=Decimal('9.90'), stock_quantity=total_joins * 2)
+
+        self.stdout.write(self.style.SUCCESS(f'\n参团压测开始（{tag}）\n'))
+        self.stdout.write(f"{'clients':>8} {'ok':>7} {'failed':>7} {'joins/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        try:
+            for clients in options['clients']:
+                now = timezone.now()
+                group_buy = GroupBuy.objects.create(
+                    product=product,
+                    leader=leader,
+                    target_participants=clients * joins_per_client * 2,
+                    start_time=now - timedelta(minutes=1),
+                    end_time=now + timedelta(hours=1),
+                    status='active',
+                )
+                self.run_round(clients, joins_per_client, group_buy, users[:clients])
+        finally:
+            if not options['keep']:
+                OrderItem.objects.filter(product=product).delete()
+                Order.objects.filter(group_buy__product=product).delete()
+                GroupBuy.objects.filter(product=product).delete()
+                product.delete()
+                User.objects.filter(username__startswith=tag).delete()
+
+    def run_round(self, clients, joins_per_client, group_buy, users):
+        barrier = threading.Barrier(clients)
+        latencies = []
+        failures = []
+        lock = threading.Lock()
+
+        def client(user):
+            local_latencies = []
+            local_failures = 0
+            try:
+                barrier.wait()
+                for _ in range(joins_per_client):
+                    started = time.perf_counter()
+                    try:
+                        join_group_buy(user, group_buy.id, 1)
+                        local_latencies.append(time.perf_counter() - started)
+                    except Exception:
+                        local_failures += 1
+            finally:
+                connection.close()
+                with lock:
+                    latencies.extend(local_latencies)
+                    failures.append(local_failures)
+
+        threads = [threading.Thread(target=client, args=(u,)) for u in users]
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - started
+
+        ok = len(latencies)
+        failed = sum(failures)
+        if latencies:
+            ms = sorted(x * 1000 for x in latencies)
+            quantiles = statistics.quantiles(ms, n=100) if len(ms) > 1 else [ms[0]] * 99
+            p50, p95, p99 = quantiles[49], quantiles[94], quantiles[98]
+        else:
+            p50 = p95 = p99 = 0.0
+        self.stdout.write(
+            f'{clients:>8} {ok:>7} {failed:>7} {ok / elapsed:>9.1f} {p50:>8.1f} {p95:>8.1f} {p99:>8.1f}'
+        )
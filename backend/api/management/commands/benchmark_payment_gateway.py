@@ -0,0 +1,108 @@
+"""
+Django Management命令：支付网关客户端压测
+使用方法：python manage.py benchmark_payment_gateway [--requests 200] [--concurrency 20] [--compare]
+
+在后台启动模拟网关（见 payment_gateway_stub），依次模拟正常、部分超时、大量 5xx、完全无响应
+四种网关状态，用 PaymentGatewayClient（连接池 + 超时 + 重试 + 熔断）发起统一下单，
+输出成功/失败/熔断拒绝数与延迟分位数。--compare 同时测试每次新建连接、无熔断的裸 requests 调用。
+"""
+
+import statistics
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.core.management.base import BaseCommand
+
+from api.management.commands.payment_gateway_stub import StubProfile, start_in_background
+from api.payment_gateway import CircuitBreaker, CircuitOpenError, GatewayError, build_client
+
+SCENARIOS = [
+    ('healthy', dict(latency_ms=20, jitter_ms=5)),
+    ('slow', dict(latency_ms=20, jitter_ms=5, hang_rate=0.3)),
+    ('erroring', dict(latency_ms=20, jitter_ms=5, error_rate=0.5)),
+    ('down', dict(hang_rate=1.0)),
+]
+
+
+class Command(BaseCommand):
+    help = '在模拟网关的各种故障状态下压测支付网关客户端'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='每个场景的请求数（默认 200）')
+        parser.add_argument('--concurrency', type=int, default=20, help='并发线程数（默认 20）')
+        parser.add_argument('--read-timeout', type=float, default=0.5, help='客户端读取超时（秒，默认 0.5）')
+        parser.add_argument('--hang-seconds', type=float, default=2.0, help='模拟网关不响应的时长（秒，默认 2）')
+        parser.add_argument('--compare', action='store_true', help='同时测试裸 requests 调用作为对照')
+
+    def handle(self, *args, **options):
+        profile = StubProfile(hang_seconds=options['hang_seconds'])
+        server, base_url = start_in_background(profile)
+        self.stdout.write(self.style.SUCCESS(f'\n支付网关压测开始（模拟网关 {base_url}）\n'))
+        self.stdout.write(
+            f"{'scenario':>10} {'mode':>7} {'ok':>6} {'failed':>7} {'open':>6} "
+            f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'elapsed s':>10}"
+        )
+        try:
+            for name, settings in SCENARIOS:
+                for field, value in StubProfile(hang_seconds=options['hang_seconds']).__dict__.items():
+                    setattr(profile, field, settings.get(field, value))
+                client = build_client(
+                    base_url,
+                    read_timeout=options['read_timeout'],
+                    breaker=CircuitBreaker(failure_threshold=5, reset_timeout=1.0),
+                )
+                try:
+                    self.run_round(name, 'pooled', options, lambda: self.pooled_call(client))
+                finally:
+                    client.close()
+                if options['compare']:
+                    self.run_round(name, 'naive', options, lambda: self.naive_call(base_url, options['hang_seconds'] * 2))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def pooled_call(self, client):
+        client.wechat_unified_order(f'GB0_{uuid.uuid4().hex[:12]}', 100, '压测', 'bench_openid', 'http://localhost/notify/')
+
+    def naive_call(self, base_url, timeout):
+        response = requests.post(
+            f'{base_url}/v3/pay/transactions/jsapi',
+            json={'out_trade_no': f'GB0_{uuid.uuid4().hex[:12]}'},
+            timeout=timeout,
+        )
+        if response.status_code >= 500:
+            raise GatewayError(f'HTTP {response.status_code}')
+
+    def run_round(self, scenario, mode, options, call):
+        latencies = []
+        counts = {'ok': 0, 'failed': 0, 'open': 0}
+        lock = threading.Lock()
+
+        def one(_):
+            started = time.perf_counter()
+            outcome = 'ok'
+            try:
+                call()
+            except CircuitOpenError:
+                outcome = 'open'
+            except (GatewayError, requests.RequestException):
+                outcome = 'failed'
+            elapsed = time.perf_counter() - started
+            with lock:
+                counts[outcome] += 1
+                latencies.append(elapsed)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            list(pool.map(one, range(options['requests'])))
+        elapsed = time.perf_counter() - started
+
+        ms = sorted(x * 1000 for x in latencies)
+        quantiles = statistics.quantiles(ms, n=100) if len(ms) > 1 else [ms[0]] * 99
+        self.stdout.write(
+            f"{scenario:>10} {mode:>7} {counts['ok']:>6} {counts['failed']:>7} {counts['open']:>6} "
+            f'{quantiles[49]:>8.1f} {quantiles[94]:>8.1f} {quantiles[98]:>8.1f} {elapsed:>10.2f}'
+        )
@@ -0,0 +1,129 @@
+"""
+Django Management命令：索引顾问
+使用方法：python manage.py explain_queries [--fail-on-scan] [--verbose]
+
+对应用中真实使用的查询集逐一执行 EXPLAIN，标记出全表扫描。
+新增视图时请把其主要查询登记到 QUERY_CATALOGUE，以便 CI 中及时发现缺失的索引。
+"""
+
+import json
+import re
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from api.models import GroupBuy, Order, StockReservation, User
+
+COMMISSION_STATUSES = ['successful', 'completed']
+SALES_STATUSES = ['successful', 'ready_for_pickup', 'completed']
+
+
+def _month_start(now):
+    return now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+# (名称, 来源视图/任务, 构造查询集的函数)
+QUERY_CATALOGUE = [
+    ('leader_monthly_orders', 'LeaderStatsView', lambda ctx: Order.objects.filter(
+        group_buy__leader_id=ctx['leader_id'], status__in=COMMISSION_STATUSES,
+        created_at__gte=_month_start(ctx['now']))),
+    ('leader_pending_pickups', 'LeaderStatsView', lambda ctx: Order.objects.filter(
+        group_buy__leader_id=ctx['leader_id'], status='successful')),
+    ('leader_groupbuys', 'LeaderGroupBuyListCreateView', lambda ctx: GroupBuy.objects.filter(
+        leader_id=ctx['leader_id']).order_by('-id')),
+    ('my_orders', 'MyOrdersView', lambda ctx: Order.objects.filter(
+        user_id=ctx['user_id']).order_by('-id')),
+    ('my_orders_by_status', 'RecommendationsView', lambda ctx: Order.objects.filter(
+        user_id=ctx['user_id'], status__in=COMMISSION_STATUSES)),
+    ('admin_sales_daily', 'AdminSalesDailyView', lambda ctx: Order.objects.filter(
+        created_at__gte=ctx['now'] - timedelta(days=7), status__in=SALES_STATUSES)
+        .annotate(day=TruncDate('created_at')).values('day')
+        .annotate(total=Sum('total_price'), count=Count('id')).order_by('day')),
+    ('daily_stats_orders', 'DailyStatsView', lambda ctx: Order.objects.filter(
+        created_at__gte=ctx['now'] - timedelta(days=366))
+        .annotate(day=TruncDate('created_at')).order_by().values('day')
+        .annotate(count=Count('id'), revenue=Sum('total_price'))),
+    ('admin_analytics_paid', 'AdminAnalyticsView', lambda ctx: Order.objects.filter(
+        created_at__gte=ctx['now'] - timedelta(days=30), payment_status='paid')),
+    ('admin_order_list', 'AdminOrderListView', lambda ctx: Order.objects.order_by('-created_at')[:20]),
+    ('public_groupbuys', 'GroupBuyPublicListView', lambda ctx: GroupBuy.objects.filter(
+        status__in=['active', 'pending']).order_by('-created_at')),
+    ('activate_due', 'activate_pending_groupbuys', lambda ctx: GroupBuy.objects.filter(
+        status='pending', start_time__lte=ctx['now'])),
+    ('finalize_due', 'finalize_groupbuys', lambda ctx: GroupBuy.objects.filter(
+        status__in=['active', 'pending'], end_time__lte=ctx['now'])),
+    ('finalize_pending_orders', 'finalize_groupbuys', lambda ctx: Order.objects.filter(
+        group_buy_id__in=[ctx['group_buy_id']], status='awaiting_group_success')),
+    ('expired_reservations', 'release_expired_reservations', lambda ctx: StockReservation.objects.filter(
+        status='held', expires_at__lte=ctx['now']).order_by('id')),
+]
+
+
+def find_full_scans(plan: str, vendor: str):
+    """从执行计划中找出被全表扫描的表名"""
+    if vendor == 'sqlite':
+        # "SCAN api_order" 为全表扫描；"SCAN api_order USING INDEX ..." 为索引扫描
+        return re.findall(r'\bSCAN (\w+)(?! USING)(?:\s|$)', plan + '\n')
+    if vendor == 'mysql':
+        tables = []
+
+        def walk(node):
+            if isinstance(node, dict):
+                table = node.get('table')
+                if isinstance(table, dict) and table.get('access_type') == 'ALL':
+                    tables.append(table.get('table_name'))
+                for value in node.values():
+                    walk(value)
+            elif isinstance(node, list):
+                for value in node:
+                    walk(value)
+
+        walk(json.loads(plan))
+        return tables
+    if vendor == 'postgresql':
+        return re.findall(r'Seq Scan on (\w+)', plan)
+    return []
+
+
+class Command(BaseCommand):
+    help = '对应用的核心查询执行 EXPLAIN 并标记全表扫描'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fail-on-scan', action='store_true',
+                            help='发现全表扫描时以非零状态退出（用于 CI）')
+        parser.add_argument('--verbose', action='store_true', help='打印完整执行计划')
+        parser.add_argument('--ignore-table', action='append', default=[],
+                            help='忽略指定表上的全表扫描（如数据量很小的字典表），可多次指定')
+
+    def handle(self, *args, **options):
+        vendor = connection.vendor
+        leader = User.objects.filter(role='leader').only('id').first()
+        user = User.objects.filter(role='user').only('id').first()
+        group_buy = GroupBuy.objects.only('id').first()
+        ctx = {
+            'now': timezone.now(),
+            'leader_id': leader.id if leader else 0,
+            'user_id': user.id if user else 0,
+            'group_buy_id': group_buy.id if group_buy else 0,
+        }
+        explain_options = {'format': 'json'} if vendor == 'mysql' else {}
+
+        flagged = []
+        for name, source, build in QUERY_CATALOGUE:
+            plan = build(ctx).explain(**explain_options)
+            scans = [t for t in find_full_scans(plan, vendor) if t not in options['ignore_table']]
+            if scans:
+                flagged.append(name)
+                self.stdout.write(self.style.ERROR(f'✗ {name:<26} {source:<30} 全表扫描: {", ".join(scans)}'))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'✓ {name:<26} {source}'))
+            if options['verbose']:
+                self.stdout.write(plan + '\n')
+
+        self.stdout.write(f'\n共检查 {len(QUERY_CATALOGUE)} 个查询，{len(flagged)} 个存在全表扫描')
+        if flagged and options['fail_on_scan']:
+            raise CommandError(f'以下查询存在全表扫描: {", ".join(flagged)}')
@@ -0,0 +1,132 @@
+"""
+Django Management命令：本地模拟支付网关
+使用方法：python manage.py payment_gateway_stub [--port 8900] [--latency-ms 50] [--jitter-ms 20]
+                                             [--error-rate 0.1] [--hang-rate 0.05] [--hang-seconds 10]
+
+模拟微信 JSAPI 统一下单、微信退款、支付宝下单、支付宝退款四个接口（JSON），
+可配置响应延迟、5xx 比例和长时间不响应的比例，用于联调及 benchmark_payment_gateway 压测。
+将 PAYMENT_GATEWAY_URL 设为 http://127.0.0.1:<port> 即可让支付视图调用该模拟网关。
+"""
+
+import json
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+
+
+@dataclass
+class StubProfile:
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    error_rate: float = 0.0
+    hang_rate: float = 0.0
+    hang_seconds: float = 10.0
+
+
+def _respond(path, payload):
+    if path == '/v3/pay/transactions/jsapi':
+        return {'prepay_id': f'wx{uuid.uuid4().hex[:28]}'}
+    if path == '/v3/refund/domestic/refunds':
+        return {'refund_id': uuid.uuid4().hex, 'out_refund_no': payload.get('out_refund_no'), 'status': 'PROCESSING'}
+    if path == '/alipay/trade/create':
+        return {'code': '10000', 'trade_no': uuid.uuid4().hex, 'out_trade_no': payload.get('out_trade_no')}
+    if path == '/alipay/trade/refund':
+        return {'code': '10000', 'fund_change': 'Y', 'refund_fee': payload.get('refund_amount')}
+    return None
+
+
+def make_handler(profile):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # 支持 keep-alive
+        # 响应头与响应体分两次写出，keep-alive 连接上需关闭 Nagle 以免被延迟确认拖慢
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, data):
+            body = json.dumps(data).encode('utf-8')
+            try:
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                # 客户端已超时断开
+                self.close_connection = True
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            try:
+                payload = json.loads(self.rfile.read(length) or b'{}')
+            except ValueError:
+                return self._send(400, {'code': 'PARAM_ERROR', 'message': '请求体不是合法的 JSON'})
+
+            roll = random.random()
+            if roll < profile.hang_rate:
+                time.sleep(profile.hang_seconds)
+            elif profile.latency_ms or profile.jitter_ms:
+                time.sleep(max(profile.latency_ms + random.uniform(-profile.jitter_ms, profile.jitter_ms), 0) / 1000)
+
+            if roll >= profile.hang_rate and random.random() < profile.error_rate:
+                return self._send(503, {'code': 'SYSTEM_ERROR', 'message': '系统繁忙'})
+            data = _respond(self.path, payload)
+            if data is None:
+                return self._send(404, {'code': 'NOT_FOUND', 'message': '接口不存在'})
+            self._send(200, data)
+
+    return Handler
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def make_server(host, port, profile):
+    return StubServer((host, port), make_handler(profile))
+
+
+def start_in_background(profile, host='127.0.0.1', port=0):
+    """在后台线程启动模拟网关，返回 (server, base_url)"""
+    server = make_server(host, port, profile)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://{host}:{server.server_address[1]}'
+
+
+class Command(BaseCommand):
+    help = '启动本地模拟支付网关'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8900)
+        parser.add_argument('--latency-ms', type=float, default=0.0, help='平均响应延迟（毫秒）')
+        parser.add_argument('--jitter-ms', type=float, default=0.0, help='延迟抖动（毫秒）')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='返回 503 的比例（0~1）')
+        parser.add_argument('--hang-rate', type=float, default=0.0, help='长时间不响应的比例（0~1）')
+        parser.add_argument('--hang-seconds', type=float, default=10.0, help='不响应的时长（秒）')
+
+    def handle(self, *args, **options):
+        profile = StubProfile(
+            latency_ms=options['latency_ms'],
+            jitter_ms=options['jitter_ms'],
+            error_rate=options['error_rate'],
+            hang_rate=options['hang_rate'],
+            hang_seconds=options['hang_seconds'],
+        )
+        server = make_server(options['host'], options['port'], profile)
+        self.stdout.write(self.style.SUCCESS(
+            f"模拟支付网关已启动：http://{options['host']}:{options['port']} {profile}"
+        ))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
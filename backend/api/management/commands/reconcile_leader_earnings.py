@@ -0,0 +1,78 @@
+"""
+Django Management命令：团长收益台账对账
+使用方法：python manage.py reconcile_leader_earnings [--dry-run]
+
+从订单重新汇总每个团长每月的收益，与 LeaderMonthlyEarnings 台账逐行比对并报告差异；
+默认按订单结果重建有差异的台账行，--dry-run 时只报告不修改。
+"""
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.models import LeaderMonthlyEarnings, Order
+from api.services.commission import COMMISSION_STATUSES
+from api.services.ledger import SETTLED_STATUSES, group_orders_by_leader_month, sync_total_commission
+
+FIELDS = ('order_count', 'sales_amount', 'settled_count', 'settled_amount')
+
+
+class Command(BaseCommand):
+    help = '从订单重建团长收益台账并报告差异'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='只报告差异，不修改台账')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+
+        with transaction.atomic():
+            expected = defaultdict(lambda: [0, Decimal('0'), 0, Decimal('0')])
+            for row in group_orders_by_leader_month(Order.objects.filter(status__in=COMMISSION_STATUSES)):
+                bucket = expected[(row['leader_id'], row['month'])]
+                bucket[0] += row['orders']
+                bucket[1] += row['amount']
+                if row['status'] in SETTLED_STATUSES:
+                    bucket[2] += row['orders']
+                    bucket[3] += row['amount']
+
+            actual = {
+                (row.leader_id, row.month): row
+                for row in LeaderMonthlyEarnings.objects.select_for_update()
+            }
+
+            drifted_leaders = set()
+            to_create = []
+            for key in sorted(set(expected) | set(actual), key=lambda k: (k[0], k[1])):
+                want = expected.get(key, [0, Decimal('0'), 0, Decimal('0')])
+                row = actual.get(key)
+                have = [getattr(row, f) for f in FIELDS] if row else [0, Decimal('0'), 0, Decimal('0')]
+                if list(want) == have:
+                    continue
+
+                leader_id, month = key
+                drifted_leaders.add(leader_id)
+                diffs = ', '.join(
+                    f'{name}: {old} -> {new}' for name, old, new in zip(FIELDS, have, want) if old != new
+                )
+                self.stdout.write(self.style.WARNING(f'团长 {leader_id} {month:%Y-%m} 差异 {diffs}'))
+
+                if dry_run:
+                    continue
+                if row:
+                    LeaderMonthlyEarnings.objects.filter(pk=row.pk).update(**dict(zip(FIELDS, want)))
+                else:
+                    to_create.append(LeaderMonthlyEarnings(leader_id=leader_id, month=month, **dict(zip(FIELDS, want))))
+
+            if not dry_run:
+                LeaderMonthlyEarnings.objects.bulk_create(to_create)
+                sync_total_commission(drifted_leaders)
+
+        if not drifted_leaders:
+            self.stdout.write(self.style.SUCCESS('台账与订单一致'))
+        elif dry_run:
+            self.stdout.write(self.style.WARNING(f'{len(drifted_leaders)} 个团长的台账存在差异（未修改）'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'已重建 {len(drifted_leaders)} 个团长的台账'))
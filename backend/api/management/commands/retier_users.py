@@ -0,0 +1,35 @@
+"""
+Django Management命令：重新评定会员等级
+使用方法：python manage.py retier_users [--dry-run] [--chunk-size 5000]
+
+修改会员等级的积分门槛后，按当前门槛把所有用户调整到与积分相符的等级。
+按用户 id 区间分块，每块每个积分区间一条 UPDATE；--dry-run 只统计各等级之间将要变动的人数。
+"""
+
+from django.core.management.base import BaseCommand
+
+from api.models import MembershipTier
+from api.services import membership
+
+
+class Command(BaseCommand):
+    help = '按当前积分门槛批量重新评定所有用户的会员等级'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='只统计将要变动的人数，不修改数据')
+        parser.add_argument('--chunk-size', type=int, default=None, help='每块的用户 id 区间长度')
+
+    def handle(self, *args, **options):
+        report = membership.retier_users(chunk_size=options['chunk_size'], dry_run=options['dry_run'])
+        names = dict(MembershipTier.objects.values_list('id', 'tier_name'))
+
+        for (from_id, to_id), users in sorted(report.transitions.items(), key=lambda item: -item[1]):
+            self.stdout.write(
+                f"{names.get(from_id, '无等级'):>12} -> {names.get(to_id, '无等级'):<12} {users:>8} 人"
+            )
+
+        summary = f'共 {report.users} 名用户，{report.chunks} 块，耗时 {report.elapsed_ms:.0f} ms'
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(f'[dry-run] 将调整 {report.changed} 名用户的等级（{summary}）'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'已调整 {report.changed} 名用户的等级（{summary}）'))
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.6 on 2026-10-18 16:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_add_default_categories'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='groupbuy',
+            index=models.Index(fields=['status', 'end_time'], name='groupbuy_status_end_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='groupbuy',
+            index=models.Index(fields=['status', 'start_time'], name='groupbuy_status_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='groupbuy',
+            index=models.Index(fields=['leader', 'status'], name='groupbuy_leader_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['group_buy', 'status', 'created_at', 'total_price'], name='order_gb_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'status'], name='order_user_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['payment_status', 'created_at'], name='order_payment_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', 'created_at', 'total_price'], name='order_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['created_at'], name='order_created_idx'),
+        ),
+    ]
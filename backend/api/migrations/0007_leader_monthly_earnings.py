@@ -0,0 +1,70 @@
+# Generated by Django 5.2.6 on 2026-10-18 16:25
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncMonth
+
+
+def backfill_leader_earnings(apps, schema_editor):
+    Order = apps.get_model('api', 'Order')
+    User = apps.get_model('api', 'User')
+    LeaderMonthlyEarnings = apps.get_model('api', 'LeaderMonthlyEarnings')
+
+    # 用现有订单一次性生成台账
+    rows = (
+        Order.objects
+        .filter(status__in=['successful', 'completed'])
+        .order_by()
+        .values(leader_id=F('group_buy__leader_id'), month=TruncMonth('created_at', output_field=models.DateField()))
+        .annotate(
+            order_count=Count('id'),
+            sales_amount=Sum('total_price'),
+            settled_count=Count('id', filter=Q(status='completed')),
+            settled_amount=Sum('total_price', filter=Q(status='completed')),
+        )
+    )
+    totals = {}
+    ledger = []
+    for row in rows:
+        ledger.append(LeaderMonthlyEarnings(
+            leader_id=row['leader_id'],
+            month=row['month'],
+            order_count=row['order_count'],
+            sales_amount=row['sales_amount'] or 0,
+            settled_count=row['settled_count'],
+            settled_amount=row['settled_amount'] or 0,
+        ))
+        totals[row['leader_id']] = totals.get(row['leader_id'], Decimal('0')) + (row['sales_amount'] or 0)
+    LeaderMonthlyEarnings.objects.bulk_create(ledger, batch_size=1000)
+    for leader_id, sales in totals.items():
+        User.objects.filter(id=leader_id).update(total_commission=sales * Decimal('0.1'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_order_groupbuy_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderMonthlyEarnings',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('order_count', models.IntegerField(default=0)),
+                ('sales_amount', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('settled_count', models.IntegerField(default=0)),
+                ('settled_amount', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('leader', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_earnings', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('leader', 'month'), name='unique_leader_month_earnings')],
+            },
+        ),
+        migrations.RunPython(backfill_leader_earnings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.6 on 2026-10-18 16:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_stock_reservation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentCallback',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider', models.CharField(choices=[('wechat', 'WeChat Pay'), ('alipay', 'Alipay')], max_length=16)),
+                ('out_trade_no', models.CharField(max_length=64)),
+                ('order_id', models.BigIntegerField(blank=True, null=True)),
+                ('success', models.BooleanField(default=False)),
+                ('payload', models.JSONField(default=dict)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processed', 'Processed'), ('ignored', 'Ignored'), ('failed', 'Failed')], default='pending', max_length=16)),
+                ('error', models.CharField(blank=True, default='', max_length=255)),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'id'], name='callback_status_idx'), models.Index(fields=['processed_at'], name='callback_processed_idx')],
+                'constraints': [models.UniqueConstraint(fields=('provider', 'out_trade_no'), name='unique_payment_callback')],
+            },
+        ),
+    ]
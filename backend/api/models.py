@@ -35,6 +35,8 @@ class User(AbstractUser):
     total_commission = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     membership_tier = models.ForeignKey(MembershipTier, on_delete=models.SET_NULL, null=True, blank=True)
     loyalty_points = models.IntegerField(default=0)
+    # 未读站内通知数，与 Notification 的写入/已读在同一事务中增减，角标读取无需 COUNT
+    unread_notifications = models.IntegerField(default=0)
 
 
 class Category(models.Model):
@@ -80,6 +82,15 @@ class GroupBuy(models.Model):
     status = models.CharField(max_length=12, choices=STATUS_CHOICES, default='pending')
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # 到期结算 / 定时激活
+            models.Index(fields=['status', 'end_time'], name='groupbuy_status_end_idx'),
+            models.Index(fields=['status', 'start_time'], name='groupbuy_status_start_idx'),
+            # 团长拼单列表与统计
+            models.Index(fields=['leader', 'status'], name='groupbuy_leader_status_idx'),
+        ]
+
     def __str__(self) -> str:
         return f"{self.product.name} - {self.status}"
 
@@ -115,6 +126,20 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # 团长收益/提货（经 group_buy 关联 leader），带 total_price 以便聚合只读索引
+            models.Index(fields=['group_buy', 'status', 'created_at', 'total_price'], name='order_gb_status_created_idx'),
+            # 我的订单
+            models.Index(fields=['user', 'status'], name='order_user_status_idx'),
+            # 收入分析
+            models.Index(fields=['payment_status', 'created_at'], name='order_payment_created_idx'),
+            # 按日销售统计
+            models.Index(fields=['status', 'created_at', 'total_price'], name='order_status_created_idx'),
+            # 订单列表排序 / 按日统计
+            models.Index(fields=['created_at'], name='order_created_idx'),
+        ]
+
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
@@ -140,3 +165,93 @@ class Alert(models.Model):
 from django.db import models
 
 # Create your models here.
+
+
+class LeaderMonthlyEarnings(models.Model):
+    """团长按月收益台账：订单进入/离开 successful、completed 时增量维护"""
+    leader = models.ForeignKey(User, on_delete=models.CASCADE, related_name='monthly_earnings')
+    month = models.DateField()  # 当月第一天（本地时区，按订单创建时间归属）
+    order_count = models.IntegerField(default=0)
+    sales_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    settled_count = models.IntegerField(default=0)  # 其中已完成（completed）的订单
+    settled_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['leader', 'month'], name='unique_leader_month_earnings'),
+        ]
+
+
+class StockReservation(models.Model):
+    """参团时预留的库存：有效期内未支付则由定时任务释放，支付后转为销售"""
+    STATUS_CHOICES = (
+        ('held', 'Held'),
+        ('converted', 'Converted'),
+        ('released', 'Released'),
+    )
+
+    order = models.OneToOneField(Order, on_delete=models.CASCADE, related_name='stock_reservation')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.IntegerField()
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default='held')
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # 定时释放：按状态与到期时间取出过期预留
+            models.Index(fields=['status', 'expires_at'], name='reservation_status_expires_idx'),
+        ]
+
+
+class PaymentCallback(models.Model):
+    """支付网关回调收件箱：回调先落库并立即应答，由定时任务批量处理"""
+    PROVIDER_CHOICES = (
+        ('wechat', 'WeChat Pay'),
+        ('alipay', 'Alipay'),
+    )
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('processed', 'Processed'),
+        ('ignored', 'Ignored'),
+        ('failed', 'Failed'),
+    )
+
+    provider = models.CharField(max_length=16, choices=PROVIDER_CHOICES)
+    out_trade_no = models.CharField(max_length=64)
+    order_id = models.BigIntegerField(blank=True, null=True)
+    success = models.BooleanField(default=False)  # 网关报告的支付结果
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default='pending')
+    error = models.CharField(max_length=255, blank=True, default='')
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        constraints = [
+            # 网关重试同一笔回调时直接去重
+            models.UniqueConstraint(fields=['provider', 'out_trade_no'], name='unique_payment_callback'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'id'], name='callback_status_idx'),
+            models.Index(fields=['processed_at'], name='callback_processed_idx'),
+        ]
+
+
+class Notification(models.Model):
+    """站内通知收件箱：推送给用户的通知同时落库，离线期间的通知可在通知列表中查看"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications')
+    notification_type = models.CharField(max_length=32)
+    data = models.JSONField(default=dict)
+    is_read = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    read_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            # 通知列表按 id 倒序翻页；全部已读按用户与已读状态筛选
+            models.Index(fields=['user', '-id'], name='notification_user_idx'),
+            models.Index(fields=['user', 'is_read', 'id'], name='notification_unread_idx'),
+        ]
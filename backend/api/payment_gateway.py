@@ -0,0 +1,206 @@
+"""支付网关客户端
+
+统一下单、退款等对微信/支付宝的 HTTP 调用都经由 PaymentGatewayClient：
+- 进程内共享一个 requests.Session，连接池复用 keep-alive 连接；
+- 连接与读取分别设置超时（PAYMENT_GATEWAY_CONNECT_TIMEOUT / PAYMENT_GATEWAY_READ_TIMEOUT）；
+- 连接失败和 502/503/504 按指数退避重试（下单与退款都带商户单号，网关侧幂等）；
+- 熔断器：连续失败达到阈值后在冷却期内直接拒绝调用，不再占用请求线程等待超时，
+  冷却期后放行一个探测请求，成功则恢复。
+
+PAYMENT_GATEWAY_URL 为空时不发起真实调用，支付视图返回演示参数。
+本地联调与压测可用 payment_gateway_stub 命令启动模拟网关。
+"""
+import threading
+import time
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class GatewayError(Exception):
+    """支付网关调用失败"""
+
+
+class CircuitOpenError(GatewayError):
+    """熔断中，未发起调用"""
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return self.CLOSED
+        if self._clock() - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def before_call(self):
+        """调用前检查，熔断中抛出 CircuitOpenError；半开状态只放行一个探测请求"""
+        with self._lock:
+            state = self._state()
+            if state == self.OPEN or (state == self.HALF_OPEN and self._probing):
+                raise CircuitOpenError('支付网关暂不可用，请稍后重试')
+            if state == self.HALF_OPEN:
+                self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def end_call(self):
+        """调用结束（无论结果如何）时释放半开探测名额，未记录成败的异常不会让熔断器一直拒绝调用"""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                self._opened_at = self._clock()
+            self._probing = False
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {'state': self._state(), 'consecutive_failures': self._failures}
+
+
+class PaymentGatewayClient:
+    WECHAT_JSAPI_PATH = '/v3/pay/transactions/jsapi'
+    WECHAT_REFUND_PATH = '/v3/refund/domestic/refunds'
+    ALIPAY_CREATE_PATH = '/alipay/trade/create'
+    ALIPAY_REFUND_PATH = '/alipay/trade/refund'
+
+    def __init__(self, base_url, connect_timeout=1.0, read_timeout=3.0, retries=2, backoff_factor=0.2,
+                 pool_size=20, breaker=None):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.breaker = breaker or CircuitBreaker()
+        self.session = requests.Session()
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=0,  # 读超时说明网关已收到请求，不再重试以免放大负载
+            status=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({'GET', 'POST'}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _post(self, path, payload) -> dict:
+        self.breaker.before_call()
+        try:
+            return self._send(path, payload)
+        finally:
+            self.breaker.end_call()
+
+    def _send(self, path, payload) -> dict:
+        try:
+            response = self.session.post(f'{self.base_url}{path}', json=payload, timeout=self.timeout)
+        except requests.RequestException as e:
+            self.breaker.record_failure()
+            raise GatewayError(f'支付网关请求失败: {e.__class__.__name__}') from e
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+            raise GatewayError(f'支付网关返回错误: HTTP {response.status_code}')
+        # 4xx 为业务错误，网关本身可用
+        self.breaker.record_success()
+        try:
+            data = response.json()
+        except ValueError:
+            raise GatewayError('支付网关返回了无法解析的响应')
+        if response.status_code >= 400:
+            raise GatewayError(data.get('message') or f'支付网关拒绝请求: HTTP {response.status_code}')
+        return data
+
+    def wechat_unified_order(self, out_trade_no, total_fee, description, openid, notify_url) -> dict:
+        return self._post(self.WECHAT_JSAPI_PATH, {
+            'out_trade_no': out_trade_no,
+            'description': description,
+            'notify_url': notify_url,
+            'amount': {'total': total_fee, 'currency': 'CNY'},
+            'payer': {'openid': openid},
+        })
+
+    def wechat_refund(self, out_trade_no, out_refund_no, refund_fee, total_fee) -> dict:
+        return self._post(self.WECHAT_REFUND_PATH, {
+            'out_trade_no': out_trade_no,
+            'out_refund_no': out_refund_no,
+            'amount': {'refund': refund_fee, 'total': total_fee, 'currency': 'CNY'},
+        })
+
+    def alipay_create(self, out_trade_no, total_amount, subject) -> dict:
+        return self._post(self.ALIPAY_CREATE_PATH, {
+            'out_trade_no': out_trade_no,
+            'total_amount': str(total_amount),
+            'subject': subject,
+        })
+
+    def alipay_refund(self, out_trade_no, out_request_no, refund_amount) -> dict:
+        return self._post(self.ALIPAY_REFUND_PATH, {
+            'out_trade_no': out_trade_no,
+            'out_request_no': out_request_no,
+            'refund_amount': str(refund_amount),
+        })
+
+    def close(self):
+        self.session.close()
+
+
+def build_client(base_url=None, **overrides) -> PaymentGatewayClient:
+    """按配置创建客户端，overrides 覆盖单项配置"""
+    options = {
+        'connect_timeout': getattr(settings, 'PAYMENT_GATEWAY_CONNECT_TIMEOUT', 1.0),
+        'read_timeout': getattr(settings, 'PAYMENT_GATEWAY_READ_TIMEOUT', 3.0),
+        'retries': getattr(settings, 'PAYMENT_GATEWAY_RETRIES', 2),
+        'backoff_factor': getattr(settings, 'PAYMENT_GATEWAY_BACKOFF', 0.2),
+        'pool_size': getattr(settings, 'PAYMENT_GATEWAY_POOL_SIZE', 20),
+    }
+    breaker = overrides.pop('breaker', None) or CircuitBreaker(
+        failure_threshold=getattr(settings, 'PAYMENT_GATEWAY_BREAKER_THRESHOLD', 5),
+        reset_timeout=getattr(settings, 'PAYMENT_GATEWAY_BREAKER_RESET_SECONDS', 30.0),
+    )
+    options.update(overrides)
+    return PaymentGatewayClient(base_url or getattr(settings, 'PAYMENT_GATEWAY_URL', ''), breaker=breaker, **options)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def enabled() -> bool:
+    return bool(getattr(settings, 'PAYMENT_GATEWAY_URL', ''))
+
+
+def get_client() -> PaymentGatewayClient:
+    """进程内共享的客户端（连接池与熔断状态在同一进程的请求间共享）"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = build_client()
+    return _client
@@ -1,6 +1,6 @@
 from rest_framework import serializers
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
-from .models import User, Product, Category, GroupBuy, Order, OrderItem, Review, MembershipTier, Alert
+from .models import User, Product, Category, GroupBuy, Order, OrderItem, Review, MembershipTier, Alert, Notification
 
 
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
@@ -180,3 +180,9 @@ class AlertSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+class NotificationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Notification
+        fields = ['id', 'notification_type', 'data', 'is_read', 'created_at', 'read_at']
+
+
@@ -0,0 +1,205 @@
+"""购物车结算：一次请求参加多个拼单
+
+与单个参团不同，结算在一个事务内完成所有行：
+先按 id 顺序锁住涉及的拼单，再按 id 顺序锁住商品（固定加锁顺序避免死锁），
+在锁内逐行校验，然后用 CASE UPDATE 一次写回名额和库存，
+订单、订单明细和库存预留都用 bulk_create 批量插入。
+某一行校验失败只影响该行，其余行照常下单。
+"""
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass, field
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from api.caching import GROUPBUYS, ORDERS, PRODUCTS, invalidate_tags
+from api.models import GroupBuy, Order, OrderItem, Product
+from api.services.join import JoinError, check_joinable, mark_successful_if_full, member_unit_price, publish_progress
+from api.services import stock_counters
+from api.services.reservations import hold_stock_many
+
+DEFAULT_MAX_LINES = 20
+
+
+@dataclass
+class CheckoutLine:
+    group_buy_id: int
+    quantity: int
+    order: Order = None
+    price_per_unit: Decimal = None
+    error: JoinError = None
+    group_buy_successful: bool = False
+
+    def as_dict(self) -> dict:
+        data = {'group_buy_id': self.group_buy_id, 'quantity': self.quantity, 'success': self.error is None}
+        if self.error is not None:
+            data.update(self.error.as_response_data())
+        else:
+            data.update({
+                'order_id': self.order.id,
+                'total_price': str(self.order.total_price),
+                'group_buy_successful': self.group_buy_successful,
+            })
+        return data
+
+
+@dataclass
+class CheckoutResult:
+    lines: list = field(default_factory=list)
+
+    @property
+    def succeeded(self) -> int:
+        return sum(1 for line in self.lines if line.error is None)
+
+
+def max_lines() -> int:
+    return getattr(settings, 'CHECKOUT_MAX_LINES', DEFAULT_MAX_LINES)
+
+
+def parse_lines(items):
+    """把请求中的 [{group_buy_id, quantity}] 合并为 {group_buy_id: 数量}，格式错误时抛出 JoinError"""
+    if not isinstance(items, list) or not items:
+        raise JoinError('请选择要参加的拼单')
+    lines = OrderedDict()
+    for item in items:
+        try:
+            group_buy_id = int(item.get('group_buy_id'))
+            quantity = int(item.get('quantity', 1))
+        except (AttributeError, TypeError, ValueError):
+            raise JoinError('参数无效')
+        if quantity <= 0:
+            raise JoinError('参数无效')
+        lines[group_buy_id] = lines.get(group_buy_id, 0) + quantity
+    if len(lines) > max_lines():
+        raise JoinError(f'单次最多结算 {max_lines()} 个拼单')
+    return lines
+
+
+def _bulk_create_orders(user, orders):
+    if connection.features.can_return_rows_from_bulk_insert:
+        return Order.objects.bulk_create(orders)
+    # 不支持批量插入回填主键的数据库（如 MySQL）：仍用一条 INSERT 写入，再用一条查询按用户、拼单和创建时间取回主键。
+    # 涉及的拼单行已在本事务内加锁，其它参团请求要先更新拼单名额，此时无法为这些拼单插入订单
+    started = timezone.now()
+    Order.objects.bulk_create(orders)
+    ids = dict(
+        Order.objects.filter(
+            user=user, group_buy_id__in=[order.group_buy_id for order in orders], created_at__gte=started,
+        ).order_by('id').values_list('group_buy_id', 'id')
+    )
+    for order in orders:
+        order.pk = ids[order.group_buy_id]
+    return orders
+
+
+def _add_participants(quantities, now):
+    """一条 UPDATE 为多个拼单增加名额，已到开始时间的待开始拼单顺带激活"""
+    delta = Case(
+        *[When(id=group_buy_id, then=Value(qty)) for group_buy_id, qty in quantities.items()],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+    # status 放在 current_participants 之前：MySQL 按顺序求值 SET 子句
+    GroupBuy.objects.filter(id__in=list(quantities)).update(
+        status=Case(
+            When(status='pending', start_time__lte=now, then=Value('active')),
+            default=F('status'),
+        ),
+        current_participants=F('current_participants') + delta,
+    )
+
+
+def checkout(user, lines) -> CheckoutResult:
+    """lines 为 {group_buy_id: 数量}，返回逐行结果"""
+    now = timezone.now()
+    result = CheckoutResult(lines=[CheckoutLine(gb_id, qty) for gb_id, qty in lines.items()])
+
+    # 计数器扣减不随数据库回滚，由 stock_counters.atomic 在回滚时归还
+    with stock_counters.atomic():
+        group_buys = {
+            gb.id: gb
+            for gb in GroupBuy.objects.select_for_update().filter(id__in=list(lines)).order_by('id')
+        }
+        product_ids = sorted({gb.product_id for gb in group_buys.values()})
+        products = {
+            p.id: p
+            for p in Product.objects.select_for_update().filter(id__in=product_ids).order_by('id')
+        }
+        use_counters = stock_counters.enabled()
+        if use_counters:
+            # 库存以分片计数器为准，商品行锁只用于保持加锁顺序
+            for product in products.values():
+                product.stock_quantity = stock_counters.available(product.id)
+
+        accepted = []
+        for line in result.lines:
+            group_buy = group_buys.get(line.group_buy_id)
+            if group_buy is None:
+                line.error = JoinError('拼单不存在')
+                continue
+            product = products[group_buy.product_id]
+            try:
+                # 锁内快照，同一商品的多行依次扣减
+                check_joinable(group_buy, product, line.quantity)
+            except JoinError as e:
+                line.error = e
+                continue
+            if use_counters and not stock_counters.take(product.id, line.quantity):
+                line.error = JoinError('库存不足')
+                continue
+            group_buy.current_participants += line.quantity
+            product.stock_quantity -= line.quantity
+            accepted.append((line, group_buy, product))
+
+        if not accepted:
+            return result
+
+        _create_orders(user, accepted, now)
+
+    return result
+
+
+def _create_orders(user, accepted, now):
+    """在结算事务内写回名额与库存并批量创建订单"""
+    _add_participants({gb.id: line.quantity for line, gb, _ in accepted}, now)
+    if not stock_counters.enabled():
+        # 库存已在锁内校验，负的变化量即扣减
+        stock = defaultdict(int)
+        for line, _, product in accepted:
+            stock[product.id] -= line.quantity
+        stock_counters.update_stock_in_db(dict(stock))
+
+    orders = []
+    for line, group_buy, product in accepted:
+        line.price_per_unit = member_unit_price(user, product)
+        line.order = Order(
+            user=user,
+            group_buy_id=group_buy.id,
+            quantity=line.quantity,
+            total_price=line.price_per_unit * line.quantity,
+            status='awaiting_group_success',
+        )
+        orders.append(line.order)
+    _bulk_create_orders(user, orders)
+    OrderItem.objects.bulk_create([
+        OrderItem(order=line.order, product_id=product.id, quantity=line.quantity,
+                  price_per_unit=line.price_per_unit)
+        for line, _, product in accepted
+    ])
+    hold_stock_many([(line.order, product.id, line.quantity) for line, _, product in accepted], now)
+
+    for line, group_buy, _ in accepted:
+        if group_buy.current_participants >= group_buy.target_participants:
+            line.group_buy_successful = mark_successful_if_full(group_buy.id)
+            if line.group_buy_successful:
+                line.order.status = 'successful'
+
+    # bulk_create 与批量 UPDATE 不触发模型信号
+    invalidate_tags(GROUPBUYS, PRODUCTS, ORDERS)
+    for line, group_buy, _ in accepted:
+        transaction.on_commit(
+            lambda gb_id=group_buy.id, ok=line.group_buy_successful: publish_progress(gb_id, ok)
+        )
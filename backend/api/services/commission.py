@@ -0,0 +1,118 @@
+"""团长收益聚合
+
+所有团长/管理端收益接口共用：一条条件聚合查询同时算出
+累计、本月、待结算等各个口径，不再把订单逐条取回 Python 求和。
+接口读取增量维护的月度台账（见 api.services.ledger），
+leader_earnings_from_orders 直接从订单计算，用于核对。
+"""
+from dataclasses import dataclass
+from decimal import Decimal
+
+from django.db.models import Count, IntegerField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from api.models import GroupBuy, LeaderMonthlyEarnings, Order
+
+# 团长提成比例（10%）
+COMMISSION_RATE = Decimal('0.1')
+# 计入团长收益的订单状态
+COMMISSION_STATUSES = ('successful', 'completed')
+
+
+def month_start(now=None):
+    """本地时区当月第一天零点"""
+    now = timezone.localtime(now or timezone.now())
+    return now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+@dataclass
+class LeaderEarnings:
+    total_sales: Decimal = Decimal('0')
+    total_orders: int = 0
+    monthly_sales: Decimal = Decimal('0')
+    monthly_orders: int = 0
+    settled_sales: Decimal = Decimal('0')
+    pending_pickups: int = 0
+
+    @property
+    def total_commission(self) -> Decimal:
+        return self.total_sales * COMMISSION_RATE
+
+    @property
+    def monthly_commission(self) -> Decimal:
+        return self.monthly_sales * COMMISSION_RATE
+
+    @property
+    def pending_commission(self) -> Decimal:
+        # 待结算收益：已完成但尚未结算的订单
+        return self.settled_sales * COMMISSION_RATE
+
+
+def leader_earnings(leader_id, now=None) -> LeaderEarnings:
+    """从月度台账读取团长的全部收益口径（每个团长每月一行）"""
+    current_month = month_start(now).date()
+    this_month = Q(month=current_month)
+    agg = LeaderMonthlyEarnings.objects.filter(leader_id=leader_id).aggregate(
+        total_sales=Sum('sales_amount'),
+        total_orders=Sum('order_count'),
+        monthly_sales=Sum('sales_amount', filter=this_month),
+        monthly_orders=Sum('order_count', filter=this_month),
+        settled_sales=Sum('settled_amount'),
+        settled_orders=Sum('settled_count'),
+    )
+    total_orders = agg['total_orders'] or 0
+    return LeaderEarnings(
+        total_sales=agg['total_sales'] or Decimal('0'),
+        total_orders=total_orders,
+        monthly_sales=agg['monthly_sales'] or Decimal('0'),
+        monthly_orders=agg['monthly_orders'] or 0,
+        settled_sales=agg['settled_sales'] or Decimal('0'),
+        # 计入收益的订单中除已完成外均为待提货（successful）
+        pending_pickups=total_orders - (agg['settled_orders'] or 0),
+    )
+
+
+def leader_earnings_from_orders(leader_id, now=None) -> LeaderEarnings:
+    """一条查询直接从订单算出团长的全部收益口径"""
+    current_month = month_start(now)
+    agg = Order.objects.filter(
+        group_buy__leader_id=leader_id,
+        status__in=COMMISSION_STATUSES,
+    ).aggregate(
+        total_sales=Sum('total_price'),
+        total_orders=Count('id'),
+        monthly_sales=Sum('total_price', filter=Q(created_at__gte=current_month)),
+        monthly_orders=Count('id', filter=Q(created_at__gte=current_month)),
+        settled_sales=Sum('total_price', filter=Q(status='completed')),
+        pending_pickups=Count('id', filter=Q(status='successful')),
+    )
+    return LeaderEarnings(
+        total_sales=agg['total_sales'] or Decimal('0'),
+        total_orders=agg['total_orders'] or 0,
+        monthly_sales=agg['monthly_sales'] or Decimal('0'),
+        monthly_orders=agg['monthly_orders'] or 0,
+        settled_sales=agg['settled_sales'] or Decimal('0'),
+        pending_pickups=agg['pending_pickups'] or 0,
+    )
+
+
+def annotate_leader_stats(queryset, now=None):
+    """为用户查询集附加拼单数与本月流水（相关子查询，列表页查询数与团长数无关）"""
+    groupbuy_count = (
+        GroupBuy.objects
+        .filter(leader=OuterRef('pk'))
+        .order_by()
+        .values('leader')
+        .annotate(count=Count('id'))
+        .values('count')
+    )
+    monthly_sales = (
+        LeaderMonthlyEarnings.objects
+        .filter(leader=OuterRef('pk'), month=month_start(now).date())
+        .values('sales_amount')[:1]
+    )
+    return queryset.annotate(
+        groupbuy_count=Coalesce(Subquery(groupbuy_count, output_field=IntegerField()), Value(0)),
+        monthly_sales=Subquery(monthly_sales),
+    )
@@ -0,0 +1,117 @@
+"""拼单到期结算引擎
+
+按 id 分批处理到期拼单，每批只发出固定条数的 SQL：
+库存回补先 GROUP BY 汇总到商品维度，再用一条 CASE UPDATE 批量写回；
+订单与拼单状态均以集合方式更新。
+"""
+import time
+from dataclasses import asdict, dataclass, field
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from api.broadcaster import broadcaster
+from api.caching import GROUPBUYS, PRODUCTS, invalidate_tags
+from api.models import GroupBuy, Order, OrderItem
+from api.services.ledger import transition_orders
+from api.services.reservations import convert_reservations, release_reservations, restock_products
+
+DEFAULT_CHUNK_SIZE = 500
+
+
+@dataclass
+class FinalizationReport:
+    """单次结算运行的计数与耗时"""
+    chunks: int = 0
+    successful: int = 0
+    failed: int = 0
+    orders_succeeded: int = 0
+    orders_canceled: int = 0
+    products_restocked: int = 0
+    units_restocked: int = 0
+    elapsed_ms: float = 0.0
+    chunk_ms: list = field(default_factory=list)
+
+    @property
+    def processed(self) -> int:
+        return self.successful + self.failed
+
+    def as_dict(self) -> dict:
+        data = asdict(self)
+        data['processed'] = self.processed
+        return data
+
+
+def _finalize_chunk(success_ids, failed_ids, report):
+    if success_ids:
+        succeeded_orders = Order.objects.filter(group_buy_id__in=success_ids, status='awaiting_group_success')
+        convert_reservations(succeeded_orders)
+        report.orders_succeeded += transition_orders(succeeded_orders, 'successful')
+        report.successful += GroupBuy.objects.filter(id__in=success_ids).update(status='successful')
+
+    if failed_ids:
+        pending_orders = Order.objects.filter(group_buy_id__in=failed_ids, status='awaiting_group_success')
+        refunds = dict(
+            OrderItem.objects
+            .filter(order__in=pending_orders)
+            .values('product_id')
+            .annotate(qty=Sum('quantity'))
+            .values_list('product_id', 'qty')
+        )
+        report.products_restocked += restock_products(refunds)
+        report.units_restocked += sum(refunds.values())
+        release_reservations(pending_orders)
+        report.orders_canceled += transition_orders(pending_orders, 'canceled')
+        report.failed += GroupBuy.objects.filter(id__in=failed_ids).update(status='failed')
+
+    invalidate_tags(GROUPBUYS, PRODUCTS)
+    # 终态立即推送，不参与进度合并
+    transaction.on_commit(lambda: broadcaster.publish_now(failed_ids, success_ids=success_ids))
+
+
+def finalize_due_group_buys(statuses=('pending', 'active'), allow_success=True, now=None,
+                            chunk_size=None, group_buy_ids=None) -> FinalizationReport:
+    """结算所有已到结束时间的拼单
+
+    达到目标人数的标记为 successful（allow_success=False 时一律按失败处理），
+    其余标记为 failed，并取消待成团订单、回补库存。传入 group_buy_ids 时只结算这些拼单。
+    """
+    now = now or timezone.now()
+    chunk_size = chunk_size or getattr(settings, 'GROUPBUY_FINALIZE_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+    report = FinalizationReport()
+    started = time.perf_counter()
+
+    due = GroupBuy.objects.filter(status__in=statuses, end_time__lte=now)
+    if group_buy_ids is not None:
+        due = due.filter(id__in=group_buy_ids)
+
+    last_id = 0
+    while True:
+        chunk_started = time.perf_counter()
+        with transaction.atomic():
+            # 锁住本批拼单，防止结算过程中仍有人参团
+            rows = list(
+                due.select_for_update()
+                .filter(id__gt=last_id)
+                .order_by('id')
+                .values_list('id', 'current_participants', 'target_participants')[:chunk_size]
+            )
+            if not rows:
+                break
+            last_id = rows[-1][0]
+
+            success_ids, failed_ids = [], []
+            for gb_id, current, target in rows:
+                if allow_success and current >= target:
+                    success_ids.append(gb_id)
+                else:
+                    failed_ids.append(gb_id)
+            _finalize_chunk(success_ids, failed_ids, report)
+
+        report.chunks += 1
+        report.chunk_ms.append(round((time.perf_counter() - chunk_started) * 1000, 2))
+
+    report.elapsed_ms = round((time.perf_counter() - started) * 1000, 2)
+    return report
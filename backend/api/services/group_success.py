@@ -0,0 +1,77 @@
+"""按已支付订单数判定拼单成功
+
+支付回调和模拟支付共用 complete_if_paid：
+- 一条条件 UPDATE 把拼单改为 successful（WHERE 中用子查询统计已支付订单数），
+  只有真正完成状态切换的那次调用会继续往下执行，重复回调不会重复处理；
+- 待成团的已支付订单用一条 UPDATE（transition_orders，同步台账）改为 successful；
+- 成团通知在事务提交后分批推送，不在回调请求的事务内逐条发送。
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from api.broadcaster import broadcaster
+from api.caching import GROUPBUYS, invalidate_tags
+from api.models import GroupBuy, Order
+from api.services.join import JOINABLE_STATUSES
+from api.services.ledger import transition_orders
+from api.services.reservations import convert_reservations
+from api.websocket_utils import send_order_updates
+
+SUCCESS_MESSAGE = '拼单成功！等待团长安排提货'
+
+
+def _notify_batch_size() -> int:
+    return getattr(settings, 'GROUP_SUCCESS_NOTIFY_BATCH_SIZE', 200)
+
+
+def paid_orders_count():
+    """拼单已支付订单数的相关子查询"""
+    return Coalesce(
+        Subquery(
+            Order.objects
+            .filter(group_buy_id=OuterRef('pk'), payment_status='paid')
+            .order_by()
+            .values('group_buy_id')
+            .annotate(paid=Count('id'))
+            .values('paid')[:1]
+        ),
+        Value(0),
+    )
+
+
+def notify_group_success(group_buy_id, recipients):
+    """推送成团通知，recipients 为 [(user_id, order_id)]"""
+    broadcaster.publish_now((), success_ids=[group_buy_id])
+    batch_size = _notify_batch_size()
+    for start in range(0, len(recipients), batch_size):
+        send_order_updates([
+            (user_id, order_id, 'groupbuy_success', {'message': SUCCESS_MESSAGE})
+            for user_id, order_id in recipients[start:start + batch_size]
+        ])
+
+
+def complete_if_paid(group_buy_id) -> bool:
+    """已支付订单数达到目标时把拼单及其已支付的待成团订单标记为 successful，返回是否完成了切换"""
+    with transaction.atomic():
+        flipped = (
+            GroupBuy.objects
+            .filter(id=group_buy_id, status__in=JOINABLE_STATUSES)
+            .alias(paid=paid_orders_count())
+            .filter(paid__gte=F('target_participants'))
+            .update(status='successful')
+        )
+        if not flipped:
+            return False
+
+        orders = Order.objects.filter(
+            group_buy_id=group_buy_id, payment_status='paid', status='awaiting_group_success',
+        )
+        recipients = list(orders.values_list('user_id', 'id'))
+        convert_reservations([order_id for _, order_id in recipients])
+        transition_orders(orders, 'successful')
+        # 批量 UPDATE 不触发模型信号
+        invalidate_tags(GROUPBUYS)
+        transaction.on_commit(lambda: notify_group_success(group_buy_id, recipients))
+    return True
@@ -0,0 +1,189 @@
+"""参团引擎
+
+名额和库存都以计数器的方式预占：通过带 F() 条件的原子 UPDATE 扣减，
+不使用 select_for_update，也不在创建订单期间持有任何热点行锁。
+订单创建失败时再把预占的名额和库存原样归还。
+"""
+from dataclasses import dataclass
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+from rest_framework import status
+
+from api.broadcaster import broadcaster
+from api.caching import GROUPBUYS, PRODUCTS, invalidate_tags
+from api.models import GroupBuy, Order, OrderItem, Product
+from api.services import stock_counters
+from api.services.ledger import transition_orders
+from api.services.reservations import convert_reservations, hold_stock
+
+JOINABLE_STATUSES = ('pending', 'active')
+
+
+class JoinError(Exception):
+    """参团业务校验失败，携带返回给前端的错误信息"""
+
+    def __init__(self, message, status_code=status.HTTP_400_BAD_REQUEST, **extra):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+        self.extra = extra
+
+    def as_response_data(self):
+        return {'error': self.message, **self.extra}
+
+
+@dataclass
+class JoinResult:
+    order: Order
+    group_buy_id: int
+    group_buy_successful: bool
+
+
+def member_unit_price(user, product) -> Decimal:
+    """计算会员折扣价（如有会员等级）"""
+    price_per_unit = product.price
+    tier = getattr(user, 'membership_tier', None)
+    if tier and getattr(tier, 'discount_percentage', None):
+        discount = (Decimal('100') - Decimal(str(tier.discount_percentage))) / Decimal('100')
+        price_per_unit = (Decimal(str(product.price)) * discount).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    return price_per_unit
+
+
+def check_joinable(group_buy, product, quantity):
+    """按当前快照校验拼单状态、剩余名额和库存，不满足时抛出 JoinError"""
+    if group_buy.status not in JOINABLE_STATUSES:
+        raise JoinError('该拼单已结束或取消')
+
+    remaining_slots = group_buy.target_participants - group_buy.current_participants
+    if quantity > remaining_slots:
+        raise JoinError(
+            f'参团失败：拼单仅剩 {remaining_slots} 个名额，无法加入 {quantity} 个',
+            remaining_slots=remaining_slots,
+        )
+
+    if product.stock_quantity < quantity:
+        raise JoinError('库存不足')
+
+
+def reserve_slots(group_buy_id, quantity, now=None) -> bool:
+    """原子预占拼单名额；待开始且已到开始时间的拼单顺带激活"""
+    now = now or timezone.now()
+    # status 放在 current_participants 之前：MySQL 按顺序求值 SET 子句
+    return GroupBuy.objects.filter(
+        id=group_buy_id,
+        status__in=JOINABLE_STATUSES,
+        current_participants__lte=F('target_participants') - quantity,
+    ).update(
+        status=Case(
+            When(status='pending', start_time__lte=now, then=Value('active')),
+            default=F('status'),
+        ),
+        current_participants=F('current_participants') + quantity,
+    ) == 1
+
+
+def release_slots(group_buy_id, quantity):
+    GroupBuy.objects.filter(id=group_buy_id).update(
+        current_participants=F('current_participants') - quantity
+    )
+
+
+def take_stock(product_id, quantity) -> bool:
+    """原子扣减库存，库存不足时不做任何修改"""
+    if stock_counters.enabled():
+        return stock_counters.take(product_id, quantity)
+    return Product.objects.filter(
+        id=product_id,
+        stock_quantity__gte=quantity,
+    ).update(stock_quantity=F('stock_quantity') - quantity) == 1
+
+
+def return_stock(product_id, quantity):
+    if stock_counters.enabled():
+        stock_counters.give(product_id, quantity)
+        return
+    Product.objects.filter(id=product_id).update(
+        stock_quantity=F('stock_quantity') + quantity
+    )
+
+
+def mark_successful_if_full(group_buy_id) -> bool:
+    """名额已满时把拼单和所有待成团订单标记为 successful"""
+    flipped = GroupBuy.objects.filter(
+        id=group_buy_id,
+        status__in=JOINABLE_STATUSES,
+        current_participants__gte=F('target_participants'),
+    ).update(status='successful')
+    if flipped:
+        orders = Order.objects.filter(group_buy_id=group_buy_id, status='awaiting_group_success')
+        # 已成团的订单不再因超时未支付而释放库存
+        convert_reservations(orders)
+        transition_orders(orders, 'successful')
+    return bool(flipped)
+
+
+def publish_progress(group_buy_id, successful=False):
+    """推送拼单最新参团进度（事务提交后调用）；进度合并推送，成团立即推送"""
+    if successful:
+        broadcaster.publish_now((), success_ids=[group_buy_id])
+    else:
+        broadcaster.publish(group_buy_id)
+
+
+def join_group_buy(user, group_buy_id, quantity) -> JoinResult:
+    try:
+        group_buy = GroupBuy.objects.select_related('product').get(id=group_buy_id)
+    except GroupBuy.DoesNotExist:
+        raise JoinError('拼单不存在', status.HTTP_404_NOT_FOUND)
+
+    product = group_buy.product
+    if stock_counters.enabled():
+        # 以计数器中的实时库存为准
+        product.stock_quantity = stock_counters.available(product.id)
+    # 无锁预检：明显无法成功的请求直接拒绝，不触碰热点行
+    check_joinable(group_buy, product, quantity)
+
+    if not reserve_slots(group_buy.id, quantity):
+        # 预占失败，重新读取最新快照给出准确的失败原因
+        group_buy.refresh_from_db(fields=['status', 'current_participants', 'target_participants'])
+        check_joinable(group_buy, product, quantity)
+        raise JoinError('参团失败：名额已被抢完，请稍后重试', status.HTTP_409_CONFLICT)
+
+    if not take_stock(product.id, quantity):
+        release_slots(group_buy.id, quantity)
+        raise JoinError('库存不足')
+
+    price_per_unit = member_unit_price(user, product)
+    try:
+        with transaction.atomic():
+            order = Order.objects.create(
+                user=user,
+                group_buy_id=group_buy.id,
+                quantity=quantity,
+                total_price=price_per_unit * quantity,
+                status='awaiting_group_success',
+            )
+            OrderItem.objects.create(
+                order=order,
+                product_id=product.id,
+                quantity=quantity,
+                price_per_unit=price_per_unit,
+            )
+            # 库存已扣减，记录带有效期的预留，超时未支付由定时任务释放
+            hold_stock(order, product.id, quantity)
+            successful = mark_successful_if_full(group_buy.id)
+    except Exception:
+        # 订单未能落库，归还预占的名额和库存
+        release_slots(group_buy.id, quantity)
+        return_stock(product.id, quantity)
+        raise
+
+    # 名额/库存由批量 UPDATE 修改，不经过模型信号
+    invalidate_tags(GROUPBUYS, PRODUCTS)
+    transaction.on_commit(lambda: publish_progress(group_buy.id, successful))
+    if successful:
+        order.status = 'successful'
+    return JoinResult(order=order, group_buy_id=group_buy.id, group_buy_successful=successful)
@@ -0,0 +1,133 @@
+"""团长收益台账维护
+
+订单进入或离开 successful / completed 时，在同一事务内把差额累加到
+LeaderMonthlyEarnings（按团长、按订单创建月份），并同步 User.total_commission。
+所有修改订单状态的路径都应通过 set_order_status / transition_orders 完成。
+两者都先锁定订单行再读取原状态，并发修改同一批订单时差额按实际发生的状态变化计算，
+台账不会与订单状态脱节。
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DateField, DecimalField, ExpressionWrapper, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, TruncMonth
+from django.utils import timezone
+
+from api.caching import LEADERS, ORDERS, invalidate_tags
+from api.models import GroupBuy, LeaderMonthlyEarnings, Order, User
+from api.services.commission import COMMISSION_RATE, COMMISSION_STATUSES
+
+SETTLED_STATUSES = ('completed',)
+
+
+def _weights(status):
+    return (1 if status in COMMISSION_STATUSES else 0, 1 if status in SETTLED_STATUSES else 0)
+
+
+def order_month(created_at):
+    return timezone.localtime(created_at).date().replace(day=1)
+
+
+def group_orders_by_leader_month(queryset):
+    """按 (团长, 月份, 状态) 汇总订单数与金额"""
+    return (
+        queryset
+        .order_by()
+        .values('status', leader_id=F('group_buy__leader_id'),
+                month=TruncMonth('created_at', output_field=DateField()))
+        .annotate(orders=Count('id'), amount=Sum('total_price'))
+    )
+
+
+def _add(deltas, key, status_from, status_to, orders, amount):
+    old, new = _weights(status_from), _weights(status_to)
+    earning, settled = new[0] - old[0], new[1] - old[1]
+    if earning or settled:
+        bucket = deltas[key]
+        bucket[0] += earning * orders
+        bucket[1] += earning * amount
+        bucket[2] += settled * orders
+        bucket[3] += settled * amount
+
+
+def apply_deltas(deltas):
+    """把 {(leader_id, month): [订单数, 金额, 已完成订单数, 已完成金额]} 累加到台账"""
+    deltas = {key: value for key, value in deltas.items() if any(value)}
+    for (leader_id, month), (orders, amount, settled_orders, settled_amount) in deltas.items():
+        changes = dict(
+            order_count=F('order_count') + orders,
+            sales_amount=F('sales_amount') + amount,
+            settled_count=F('settled_count') + settled_orders,
+            settled_amount=F('settled_amount') + settled_amount,
+        )
+        row = LeaderMonthlyEarnings.objects.filter(leader_id=leader_id, month=month)
+        if row.update(**changes):
+            continue
+        try:
+            with transaction.atomic():
+                LeaderMonthlyEarnings.objects.create(
+                    leader_id=leader_id, month=month, order_count=orders, sales_amount=amount,
+                    settled_count=settled_orders, settled_amount=settled_amount,
+                )
+        except IntegrityError:
+            # 并发事务已创建该月记录
+            row.update(**changes)
+    if deltas:
+        sync_total_commission({leader_id for leader_id, _ in deltas})
+
+
+def sync_total_commission(leader_ids):
+    """用台账汇总刷新 User.total_commission（按团长数条记录求和，不扫描订单）"""
+    total_sales = (
+        LeaderMonthlyEarnings.objects
+        .filter(leader_id=OuterRef('pk'))
+        .order_by()
+        .values('leader_id')
+        .annotate(total=Sum('sales_amount'))
+        .values('total')
+    )
+    User.objects.filter(id__in=list(leader_ids)).update(
+        total_commission=ExpressionWrapper(
+            Coalesce(Subquery(total_sales), Value(Decimal('0'))) * Value(COMMISSION_RATE),
+            output_field=DecimalField(max_digits=12, decimal_places=2),
+        )
+    )
+    # 批量 UPDATE 不触发 User 信号
+    invalidate_tags(LEADERS)
+
+
+def transition_orders(queryset, new_status, **fields) -> int:
+    """以集合方式修改订单状态并同步台账，返回更新的订单数"""
+    with transaction.atomic():
+        # 先按 id 顺序锁定目标订单，原状态从锁定后的行读取
+        ids = list(queryset.select_for_update().order_by('id').values_list('id', flat=True))
+        locked = Order.objects.filter(id__in=ids)
+        deltas = defaultdict(lambda: [0, Decimal('0'), 0, Decimal('0')])
+        for row in group_orders_by_leader_month(locked.exclude(status=new_status)):
+            _add(deltas, (row['leader_id'], row['month']), row['status'], new_status, row['orders'], row['amount'])
+        updated = locked.update(status=new_status, **fields)
+        apply_deltas(deltas)
+        if updated:
+            invalidate_tags(ORDERS)
+    return updated
+
+
+def set_order_status(order, new_status, **fields):
+    """修改单个订单状态（及其它字段）并保存，同步台账"""
+    with transaction.atomic():
+        # 以数据库中（加锁后）的状态为准，order 可能是并发修改前读出的旧对象
+        old_status = (
+            Order.objects.select_for_update().filter(id=order.id).values_list('status', flat=True).first()
+            or order.status
+        )
+        order.status = new_status
+        for name, value in fields.items():
+            setattr(order, name, value)
+        order.save()
+        if old_status != new_status:
+            leader_id = GroupBuy.objects.filter(id=order.group_buy_id).values_list('leader_id', flat=True).first()
+            deltas = defaultdict(lambda: [0, Decimal('0'), 0, Decimal('0')])
+            _add(deltas, (leader_id, order_month(order.created_at)), old_status, new_status, 1, order.total_price)
+            apply_deltas(deltas)
+    return order
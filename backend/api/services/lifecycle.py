@@ -0,0 +1,125 @@
+"""拼单生命周期调度
+
+采用两级时间轮，取代每个 beat 周期全表扫描 GroupBuy：
+- 粗粒度轮在数据库中：只取出未来 GROUPBUY_SCHEDULE_HORIZON 秒内到期的开始/结束时间点；
+- 细粒度轮是 Celery worker 的定时器堆：每个时间点投递为一个带 eta 的任务，到点即触发。
+
+拼单创建或开始/结束时间被修改时（post_save 信号）立即投递其精确的时间点；worker 重启时从数据库重建队列。
+状态转换都是按主键的条件 UPDATE，重复投递不会产生副作用。
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from api.caching import GROUPBUYS, invalidate_tags
+from api.models import GroupBuy
+from api.services.finalization import finalize_due_group_buys
+
+logger = logging.getLogger(__name__)
+
+ACTIVATE = 'activate'
+FINALIZE = 'finalize'
+
+
+def schedule_horizon() -> timedelta:
+    return timedelta(seconds=getattr(settings, 'GROUPBUY_SCHEDULE_HORIZON', 3600))
+
+
+def retry_delay() -> timedelta:
+    return timedelta(seconds=getattr(settings, 'GROUPBUY_SCHEDULE_RETRY_DELAY', 5))
+
+
+def deadlines_for(group_buy):
+    """返回拼单尚未发生的 (动作, 时间点) 列表"""
+    if group_buy.status == 'pending':
+        return [(ACTIVATE, group_buy.start_time), (FINALIZE, group_buy.end_time)]
+    if group_buy.status == 'active':
+        return [(FINALIZE, group_buy.end_time)]
+    return []
+
+
+def _enqueue(group_buy_id, action, when, force=False) -> bool:
+    from api.tasks import transition_groupbuy
+
+    # 同一时间点只投递一次；worker 重启恢复时 force=True 强制重投
+    dedup_key = f'groupbuy_lifecycle:{group_buy_id}:{action}:{when.timestamp()}'
+    if not cache.add(dedup_key, 1, timeout=int(schedule_horizon().total_seconds())) and not force:
+        return False
+    try:
+        transition_groupbuy.apply_async(args=(group_buy_id, action), eta=when, retry=False)
+    except Exception:
+        # 消息队列不可用时由兜底的 beat 任务处理
+        cache.delete(dedup_key)
+        logger.warning('无法投递拼单 %s 的 %s 调度', group_buy_id, action, exc_info=True)
+        return False
+    return True
+
+
+def schedule_group_buy(group_buy, now=None, actions=(ACTIVATE, FINALIZE), force=False) -> int:
+    """投递拼单在调度窗口内的状态转换时间点，返回投递数"""
+    now = now or timezone.now()
+    until = now + schedule_horizon()
+    enqueued = 0
+    for action, when in deadlines_for(group_buy):
+        if action in actions and when <= until:
+            enqueued += _enqueue(group_buy.id, action, when, force=force)
+    return enqueued
+
+
+def schedule_group_buy_on_commit(group_buy):
+    transaction.on_commit(lambda: schedule_group_buy(group_buy))
+
+
+def refill_schedule(now=None, force=False) -> int:
+    """从数据库取出调度窗口内到期的时间点并投递（仅走状态+时间的范围查询）"""
+    now = now or timezone.now()
+    until = now + schedule_horizon()
+    enqueued = 0
+    pending_starts = GroupBuy.objects.filter(status='pending', start_time__lte=until).values_list('id', 'start_time')
+    for group_buy_id, start_time in pending_starts.iterator():
+        enqueued += _enqueue(group_buy_id, ACTIVATE, start_time, force=force)
+    due_ends = GroupBuy.objects.filter(status__in=('pending', 'active'), end_time__lte=until).values_list('id', 'end_time')
+    for group_buy_id, end_time in due_ends.iterator():
+        enqueued += _enqueue(group_buy_id, FINALIZE, end_time, force=force)
+    return enqueued
+
+
+def activate_group_buy(group_buy_id, now=None) -> int:
+    now = now or timezone.now()
+    updated = GroupBuy.objects.filter(id=group_buy_id, status='pending', start_time__lte=now).update(status='active')
+    if updated:
+        invalidate_tags(GROUPBUYS)
+    return updated
+
+
+def run_transition(group_buy_id, action, now=None) -> int:
+    """执行到点的状态转换，返回受影响的拼单数"""
+    now = now or timezone.now()
+    if action == ACTIVATE:
+        changed = activate_group_buy(group_buy_id, now)
+    elif action == FINALIZE:
+        changed = finalize_due_group_buys(now=now, group_buy_ids=[group_buy_id]).processed
+    else:
+        raise ValueError(f'未知的拼单调度动作: {action}')
+
+    if not changed:
+        # 因时钟偏差提前触发或时间被修改：按最新的时间点重新投递，
+        # 但至少推迟 retry_delay，时间点已过仍未转换时不会原地反复触发
+        group_buy = GroupBuy.objects.filter(id=group_buy_id).first()
+        if group_buy:
+            reschedule(group_buy, action, now)
+    return changed
+
+
+def reschedule(group_buy, action, now) -> int:
+    """重新投递拼单的某个动作，最早在 now + retry_delay 触发，返回投递数"""
+    earliest = now + retry_delay()
+    enqueued = 0
+    for deadline_action, when in deadlines_for(group_buy):
+        if deadline_action == action and when <= now + schedule_horizon():
+            enqueued += _enqueue(group_buy.id, action, max(when, earliest), force=True)
+    return enqueued
@@ -0,0 +1,168 @@
+"""会员等级与积分
+
+会员等级只有寥寥几行且极少修改，却在每次订单完成时都要查一次：
+- 各等级的积分门槛按升序缓存在进程内，用 bisect 查找可达到的最高等级；
+- MembershipTier 保存或删除时由信号清空本进程的副本，其它进程通过
+  MEMBERSHIP_TIERS 缓存标签的版本号发现变化后重新加载；
+- accrue_loyalty 用一条 UPDATE 累加积分，并按缓存的门槛以 CASE 设置累加后的等级（F() 表达式，
+  不读出再写回，并发完成的订单不会互相覆盖积分）；
+- 修改等级门槛后 retier_users 按 id 区间分块，每块每个积分区间一条 UPDATE，
+  把所有用户调整到与积分相符的等级（积分低于最低门槛的用户清空等级）。
+"""
+import logging
+import threading
+import time
+from bisect import bisect_right
+from collections import Counter
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Max, Min, Value, When
+
+from api.caching import MEMBERSHIP_TIERS, tag_versions
+from api.models import MembershipTier, User
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_tiers = None  # (标签版本, [积分门槛], [等级ID])
+
+
+def clear_tier_cache():
+    global _tiers
+    with _lock:
+        _tiers = None
+
+
+def _load():
+    global _tiers
+    version = tag_versions([MEMBERSHIP_TIERS])[0]
+    current = _tiers
+    if current is not None and current[0] == version:
+        return current
+    rows = list(MembershipTier.objects.order_by('points_required', 'id').values_list('points_required', 'id'))
+    loaded = (version, [points for points, _ in rows], [tier_id for _, tier_id in rows])
+    with _lock:
+        _tiers = loaded
+    return loaded
+
+
+def tier_id_for_points(points):
+    """积分可达到的最高等级ID，未达到任何等级时返回 None"""
+    _, thresholds, tier_ids = _load()
+    index = bisect_right(thresholds, points or 0)
+    return tier_ids[index - 1] if index else None
+
+
+def accrue_loyalty(user, points) -> User:
+    """为用户累加积分并自动升级会员（未达到任何等级时保留原等级），返回刷新后的用户"""
+    _, thresholds, tier_ids = _load()
+    # 门槛从高到低匹配累加后的积分；membership_tier 放在 loyalty_points 之前：MySQL 按顺序求值 SET 子句
+    tier = Case(
+        *[When(loyalty_points__gte=threshold - points, then=Value(tier_id))
+          for threshold, tier_id in reversed(list(zip(thresholds, tier_ids)))],
+        default=F('membership_tier'),
+        output_field=IntegerField(),
+    )
+    User.objects.filter(pk=user.pk).update(membership_tier=tier, loyalty_points=F('loyalty_points') + points)
+    user.refresh_from_db(fields=['loyalty_points', 'membership_tier'])
+    return user
+
+
+def tier_bands():
+    """[(积分下限, 积分上限（不含，None 为无上限）, 等级ID)]，第一段为低于最低门槛、等级为 None 的区间"""
+    _, thresholds, tier_ids = _load()
+    bounds = [None] + thresholds
+    ids = [None] + tier_ids
+    return [
+        (bounds[i], bounds[i + 1] if i + 1 < len(bounds) else None, ids[i])
+        for i in range(len(bounds))
+        if i + 1 >= len(bounds) or bounds[i] != bounds[i + 1]
+    ]
+
+
+def _target_tier(bands):
+    return Case(
+        *[When(loyalty_points__gte=lower, then=Value(tier_id)) for lower, _, tier_id in reversed(bands) if lower is not None],
+        default=Value(None),
+        output_field=IntegerField(),
+    )
+
+
+@dataclass
+class RetierReport:
+    dry_run: bool = False
+    users: int = 0
+    changed: int = 0
+    chunks: int = 0
+    elapsed_ms: float = 0.0
+    transitions: Counter = field(default_factory=Counter)  # {(原等级ID, 新等级ID): 人数}
+
+    def as_dict(self) -> dict:
+        return {
+            'dry_run': self.dry_run,
+            'users': self.users,
+            'changed': self.changed,
+            'chunks': self.chunks,
+            'elapsed_ms': self.elapsed_ms,
+            'transitions': [
+                {'from_tier_id': from_id, 'to_tier_id': to_id, 'users': n}
+                for (from_id, to_id), n in sorted(self.transitions.items(), key=lambda item: str(item[0]))
+            ],
+        }
+
+
+def _retier_chunk(chunk, bands, report):
+    rows = (
+        chunk.order_by()
+        .values('membership_tier_id', target=_target_tier(bands))
+        .annotate(users=Count('id'))
+    )
+    for row in rows:
+        report.users += row['users']
+        if row['membership_tier_id'] != row['target']:
+            report.transitions[(row['membership_tier_id'], row['target'])] += row['users']
+    if report.dry_run:
+        return
+
+    for lower, upper, tier_id in bands:
+        band = chunk
+        if lower is not None:
+            band = band.filter(loyalty_points__gte=lower)
+        if upper is not None:
+            band = band.filter(loyalty_points__lt=upper)
+        if tier_id is None:
+            band = band.filter(membership_tier__isnull=False)
+        else:
+            band = band.exclude(membership_tier_id=tier_id)
+        report.changed += band.update(membership_tier_id=tier_id)
+
+
+def retier_users(chunk_size=None, dry_run=False) -> RetierReport:
+    """把所有用户的会员等级调整到与当前门槛相符；dry_run=True 时只统计等级变化"""
+    chunk_size = chunk_size or getattr(settings, 'MEMBERSHIP_RETIER_CHUNK_SIZE', 5000)
+    report = RetierReport(dry_run=dry_run)
+    started = time.perf_counter()
+    bands = tier_bands()
+    bounds = User.objects.aggregate(low=Min('id'), high=Max('id'))
+    if bounds['low'] is not None:
+        for start in range(bounds['low'], bounds['high'] + 1, chunk_size):
+            with transaction.atomic():
+                chunk = User.objects.filter(id__gte=start, id__lt=start + chunk_size)
+                _retier_chunk(chunk, bands, report)
+            report.chunks += 1
+    if dry_run:
+        report.changed = sum(report.transitions.values())
+    report.elapsed_ms = round((time.perf_counter() - started) * 1000, 2)
+    return report
+
+
+def schedule_retier():
+    """等级门槛变化后异步重新评定所有用户（消息队列不可用时可手动执行 retier_users 命令）"""
+    from api.tasks import retier_users as retier_users_task
+
+    try:
+        retier_users_task.apply_async(retry=False)
+    except Exception:
+        logger.warning('无法投递会员等级重新评定任务', exc_info=True)
@@ -0,0 +1,124 @@
+"""站内通知收件箱与未读数
+
+推送给用户的通知（订单状态、有人参团、团长通知、系统通知）同时写入 Notification：
+- record 一次 bulk_create 写入一批通知，并在同一事务中用一条 CASE UPDATE 为涉及的
+  用户累加 User.unread_notifications；不支持批量插入回填主键的数据库（如 MySQL）再用一条查询取回 id；
+- mark_read 按 id（或全部）标记已读，更新了几行就减几；
+- 未读数缓存在 notifications:unread:<用户ID> 中，事务提交后用 incr/decr 原子调整，
+  未缓存时从用户行读取（主键查询），角标读取从不对通知表做 COUNT；
+  读取与写入缓存之间若有调整提交，回填的是旧值，回填后再读一次用户行，不一致就删除。
+"""
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from api.models import Notification, User
+
+MAX_MARK_READ_IDS = 500
+
+
+def _unread_key(user_id):
+    return f'notifications:unread:{user_id}'
+
+
+def _adjust_cached(deltas):
+    for user_id, delta in deltas.items():
+        try:
+            if delta >= 0:
+                cache.incr(_unread_key(user_id), delta)
+            else:
+                cache.decr(_unread_key(user_id), -delta)
+        except ValueError:
+            # 未缓存，下次读取时从用户行加载；并发回填的旧值由 unread_count 复查删除
+            cache.delete(_unread_key(user_id))
+
+
+def _adjust(deltas):
+    """{用户ID: 增量}：一条 UPDATE 调整未读数，提交后同步调整缓存"""
+    deltas = {user_id: delta for user_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    change = Case(
+        *[When(id=user_id, then=Value(delta)) for user_id, delta in deltas.items()],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+    User.objects.filter(id__in=list(deltas)).update(unread_notifications=F('unread_notifications') + change)
+    transaction.on_commit(lambda: _adjust_cached(deltas))
+
+
+def _bulk_create(rows):
+    if connection.features.can_return_rows_from_bulk_insert:
+        return Notification.objects.bulk_create(rows)
+    # 不支持批量插入回填主键的数据库（如 MySQL）：仍用一条 INSERT 写入，再用一条查询按用户和创建时间取回 id。
+    # 调用方已在本事务内更新（锁住）这些用户行，其它 record 调用此时无法为他们插入通知，
+    # 每个用户新插入的行按 id 升序即插入顺序
+    started = timezone.now()
+    Notification.objects.bulk_create(rows)
+    ids = defaultdict(list)
+    inserted = Notification.objects.filter(
+        user_id__in={row.user_id for row in rows}, created_at__gte=started,
+    ).order_by('id').values_list('user_id', 'id')
+    for user_id, notification_id in inserted:
+        ids[user_id].append(notification_id)
+    for row in reversed(rows):
+        row.pk = ids[row.user_id].pop()
+    return rows
+
+
+def record(notifications) -> list:
+    """批量写入 [(用户ID, 通知类型, 数据)]，返回带 id 的 Notification"""
+    rows = [
+        Notification(user_id=user_id, notification_type=notification_type, data=data)
+        for user_id, notification_type, data in notifications
+    ]
+    if not rows:
+        return []
+    with transaction.atomic():
+        # 先更新未读数：用户行在事务结束前保持锁定
+        _adjust(Counter(row.user_id for row in rows))
+        _bulk_create(rows)
+    return rows
+
+
+def parse_ids(raw):
+    """校验客户端提交的通知 ID 列表，不合法时返回 None"""
+    if not isinstance(raw, list) or len(raw) > MAX_MARK_READ_IDS:
+        return None
+    try:
+        return [int(value) for value in raw]
+    except (TypeError, ValueError):
+        return None
+
+
+def mark_read(user_id, ids=None) -> int:
+    """把用户的未读通知标记为已读（ids 为 None 时全部），返回实际标记的条数"""
+    unread = Notification.objects.filter(user_id=user_id, is_read=False)
+    if ids is not None:
+        unread = unread.filter(id__in=ids)
+    with transaction.atomic():
+        updated = unread.update(is_read=True, read_at=timezone.now())
+        _adjust({user_id: -updated})
+    return updated
+
+
+def _stored_count(user_id) -> int:
+    return User.objects.filter(id=user_id).values_list('unread_notifications', flat=True).first() or 0
+
+
+def unread_count(user_id) -> int:
+    key = _unread_key(user_id)
+    count = cache.get(key)
+    if count is None:
+        count = _stored_count(user_id)
+        if cache.add(key, count, timeout=getattr(settings, 'NOTIFICATION_UNREAD_CACHE_TTL', 300)):
+            # 回填前提交的调整 incr 落空，回填的可能是旧值；之后提交的调整会作用在缓存上
+            latest = _stored_count(user_id)
+            if latest != count:
+                cache.delete(key)
+                count = latest
+    return count
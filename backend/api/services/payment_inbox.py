@@ -0,0 +1,195 @@
+"""支付回调收件箱
+
+网关回调只做一次 INSERT 即应答（provider + out_trade_no 唯一，重复回调被数据库去重），
+订单更新、库存预留转换、WebSocket 推送和成团检查都由 process_payment_callbacks 定时任务
+按批处理：每个回调在各自的保存点中把订单标记为已支付，出错的回调记为 failed 并记录错误，
+同批其余回调照常处理；每个涉及的拼单只检查一次是否成团。
+inbox_metrics 给出积压量与处理延迟，用于监控收件箱落后了多少。
+"""
+import logging
+import time
+from dataclasses import asdict, dataclass
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Avg, Count, DurationField, ExpressionWrapper, F, Min, Q
+from django.utils import timezone
+
+from api.caching import ORDERS, invalidate_tags
+from api.models import Order, PaymentCallback
+from api.services.group_success import complete_if_paid
+from api.services.reservations import convert_reservations
+from api.websocket_utils import send_order_updates
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 200
+
+PAYMENT_MESSAGES = {
+    'wechat': '支付成功，等待拼单结果',
+    'alipay': '支付宝支付成功，等待拼单结果',
+}
+
+
+def parse_order_id(provider, out_trade_no):
+    """从商户订单号中解析订单ID：微信为 GB{id}_...，支付宝为 alipay_order_{id}_..."""
+    try:
+        if provider == 'wechat' and out_trade_no.startswith('GB'):
+            return int(out_trade_no.split('_')[0][2:])
+        if provider == 'alipay' and out_trade_no.startswith('alipay_order_'):
+            return int(out_trade_no.split('_')[2])
+    except (IndexError, ValueError):
+        pass
+    return None
+
+
+def ingest(provider, out_trade_no, success, payload) -> None:
+    """回调落库（重复的回调由唯一约束忽略）"""
+    PaymentCallback.objects.bulk_create([
+        PaymentCallback(
+            provider=provider,
+            out_trade_no=out_trade_no,
+            order_id=parse_order_id(provider, out_trade_no),
+            success=success,
+            payload=payload,
+        )
+    ], ignore_conflicts=True)
+    if success:
+        # 同一订单号先收到失败、后收到成功时，以成功为准重新处理
+        PaymentCallback.objects.filter(
+            provider=provider, out_trade_no=out_trade_no, success=False,
+        ).update(success=True, status='pending', payload=payload)
+
+
+@dataclass
+class InboxReport:
+    batches: int = 0
+    processed: int = 0
+    ignored: int = 0
+    failed: int = 0
+    orders_paid: int = 0
+    elapsed_ms: float = 0.0
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+def _mark_paid(cb, order, now):
+    fields = {'payment_status': 'paid', 'payment_time': now}
+    if cb.provider == 'alipay':
+        fields['payment_method'] = 'alipay'
+    paid = Order.objects.filter(id=order.id).exclude(payment_status='paid').update(**fields)
+    convert_reservations([order.id])
+    return paid
+
+
+def _process_batch(callbacks, report, now):
+    order_ids = {cb.order_id for cb in callbacks if cb.success and cb.order_id}
+    orders = {
+        order.id: order
+        for order in Order.objects.select_for_update().filter(id__in=order_ids).order_by('id')
+    }
+
+    outcome = {'processed': [], 'ignored': [], 'failed': []}
+    errors = {}  # 处理时出错的回调 -> 错误信息
+    paid_by_provider = {}
+    for cb in callbacks:
+        order = orders.get(cb.order_id)
+        if not cb.success:
+            outcome['ignored'].append(cb.id)
+        elif order is None:
+            outcome['failed'].append(cb.id)
+        elif order.payment_status == 'paid' or order.id in paid_by_provider:
+            # 订单已支付（其它渠道或更早的回调）
+            outcome['ignored'].append(cb.id)
+        else:
+            # 每个回调一个保存点：单个回调出错只回滚它自己，不拖住同批的其它回调
+            try:
+                with transaction.atomic():
+                    report.orders_paid += _mark_paid(cb, order, now)
+            except Exception as exc:
+                logger.exception('支付回调 %s（订单 %s）处理失败', cb.id, order.id)
+                errors[cb.id] = str(exc)[:255] or exc.__class__.__name__
+                continue
+            paid_by_provider[order.id] = cb.provider
+            outcome['processed'].append(cb.id)
+
+    if paid_by_provider:
+        # 批量 UPDATE 不触发模型信号
+        invalidate_tags(ORDERS)
+
+    # 推送在事务提交后统一发出
+    send_order_updates([
+        (orders[order_id].user_id, order_id, 'payment_success', {'message': PAYMENT_MESSAGES[provider]})
+        for order_id, provider in paid_by_provider.items()
+    ])
+
+    # 每个拼单只检查一次是否成团；成团检查失败不影响已记录的支付，下一笔支付或到期结算会再次检查
+    group_buy_ids = {orders[order_id].group_buy_id for order_id in paid_by_provider}
+    for group_buy_id in sorted(group_buy_ids):
+        try:
+            complete_if_paid(group_buy_id)
+        except Exception:
+            logger.exception('拼单 %s 成团检查失败', group_buy_id)
+
+    PaymentCallback.objects.filter(id__in=outcome['processed']).update(status='processed', processed_at=now)
+    PaymentCallback.objects.filter(id__in=outcome['ignored']).update(status='ignored', processed_at=now)
+    PaymentCallback.objects.filter(id__in=outcome['failed']).update(
+        status='failed', processed_at=now, error='订单不存在或订单号无法解析',
+    )
+    for callback_id, error in errors.items():
+        PaymentCallback.objects.filter(id=callback_id).update(status='failed', processed_at=now, error=error)
+    report.processed += len(outcome['processed'])
+    report.ignored += len(outcome['ignored'])
+    report.failed += len(outcome['failed']) + len(errors)
+    if outcome['failed']:
+        logger.warning('支付回调无法匹配订单: %s', outcome['failed'])
+
+
+def process_pending(batch_size=None, max_batches=None) -> InboxReport:
+    """批量处理收件箱中待处理的回调"""
+    batch_size = batch_size or getattr(settings, 'PAYMENT_INBOX_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+    report = InboxReport()
+    started = time.perf_counter()
+
+    while max_batches is None or report.batches < max_batches:
+        with transaction.atomic():
+            # 多个 worker 并行时各取不同的回调
+            callbacks = list(
+                PaymentCallback.objects.select_for_update(skip_locked=True)
+                .filter(status='pending')
+                .order_by('id')[:batch_size]
+            )
+            if not callbacks:
+                break
+            _process_batch(callbacks, report, timezone.now())
+        report.batches += 1
+        if len(callbacks) < batch_size:
+            break
+
+    report.elapsed_ms = round((time.perf_counter() - started) * 1000, 2)
+    return report
+
+
+def inbox_metrics(window_minutes=5) -> dict:
+    """收件箱积压与处理延迟"""
+    now = timezone.now()
+    pending = PaymentCallback.objects.filter(status='pending').aggregate(
+        count=Count('id'), oldest=Min('received_at'),
+    )
+    recent = PaymentCallback.objects.filter(
+        processed_at__gte=now - timedelta(minutes=window_minutes),
+    ).aggregate(
+        count=Count('id'),
+        failed=Count('id', filter=Q(status='failed')),
+        avg_delay=Avg(ExpressionWrapper(F('processed_at') - F('received_at'), output_field=DurationField())),
+    )
+    return {
+        'pending': pending['count'],
+        'oldest_pending_age_seconds': round((now - pending['oldest']).total_seconds(), 3) if pending['oldest'] else 0,
+        'window_minutes': window_minutes,
+        'processed_in_window': recent['count'],
+        'failed_in_window': recent['failed'],
+        'avg_processing_delay_seconds': round(recent['avg_delay'].total_seconds(), 3) if recent['avg_delay'] else 0,
+    }
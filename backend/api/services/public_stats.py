@@ -0,0 +1,78 @@
+"""首页公开统计
+
+统计数据由 beat 任务按 PUBLIC_STATS_REFRESH_SECONDS 周期重算并写入缓存，
+首页请求只读缓存（stale-while-revalidate），不访问订单表。
+仅当缓存为空或定时任务长时间未刷新时，由抢到锁的单个请求同步重算一次，
+其余请求在重算期间继续拿到旧条目，不会看到全零。
+条目本身不过期，是否过旧按 computed_at 判断：beat 与 Web 进程不共享缓存（默认的进程内缓存）时，
+Web 进程自己算出的条目超过 max_age 后同样会被重新计算，而不会一直返回旧数据；
+多进程部署应使用共享缓存（CACHE_BACKEND=redis），check --deploy 会给出 api.W001 警告。
+"""
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import DecimalField, ExpressionWrapper, F, Sum
+from django.utils import timezone
+
+from api.models import GroupBuy, Order
+
+CACHE_KEY = 'public_stats'
+LOCK_KEY = 'public_stats:refreshing'
+# 假设原价比拼单价高20%，每件节省 price * 0.2
+SAVINGS_RATE = Decimal('0.2')
+EMPTY_STATS = {'active_groups': 0, 'total_participants': 0, 'total_savings': '0'}
+
+
+def refresh_interval() -> int:
+    return getattr(settings, 'PUBLIC_STATS_REFRESH_SECONDS', 60)
+
+
+def max_age() -> int:
+    # 定时任务正常时缓存年龄不超过一个周期；超过三个周期说明 beat 未运行
+    return refresh_interval() * 3
+
+
+def compute_public_stats(now=None) -> dict:
+    """重新计算首页统计（节省金额一条关联聚合查询完成）"""
+    now = now or timezone.now()
+    active_groups = GroupBuy.objects.filter(status='active', end_time__gt=now).count()
+
+    total_participants = Order.objects.filter(
+        status__in=['awaiting_group_success', 'successful', 'completed']
+    ).aggregate(total=Sum('quantity'))['total'] or 0
+
+    saved_value = Order.objects.filter(
+        status__in=['successful', 'completed'],
+    ).aggregate(
+        total=Sum(ExpressionWrapper(
+            F('quantity') * F('group_buy__product__price'),
+            output_field=DecimalField(max_digits=14, decimal_places=2),
+        ))
+    )['total'] or Decimal('0')
+    total_savings = saved_value * SAVINGS_RATE
+
+    return {
+        'active_groups': active_groups,
+        'total_participants': total_participants,
+        'total_savings': f"{total_savings:.0f}",
+    }
+
+
+def refresh_public_stats() -> dict:
+    """重算并写入缓存；条目不设 TTL，过旧的条目在重算完成前继续提供"""
+    stats = compute_public_stats()
+    cache.set(CACHE_KEY, {'stats': stats, 'computed_at': time.time()}, timeout=None)
+    return stats
+
+
+def get_public_stats() -> dict:
+    entry = cache.get(CACHE_KEY)
+    stale = entry is None or time.time() - entry['computed_at'] > max_age()
+    if stale and cache.add(LOCK_KEY, 1, timeout=refresh_interval()):
+        try:
+            return refresh_public_stats()
+        finally:
+            cache.delete(LOCK_KEY)
+    return entry['stats'] if entry else dict(EMPTY_STATS)
@@ -0,0 +1,173 @@
+"""库存预留
+
+参团时库存已通过条件 UPDATE 从 Product.stock_quantity 中扣除，同时记录一条带有效期的预留：
+- 订单支付或拼单成团后，预留转为销售（converted）；
+- 超时未支付、仍在等待成团的订单由 release_expired_reservations 批量取消并释放预留，
+  每批一条 CASE UPDATE 回补库存、一条 CASE UPDATE 退回拼单名额。
+Product.stock_quantity 始终是扣除预留后的可售库存，读取无需锁商品行。
+"""
+import time
+from collections import defaultdict
+from dataclasses import asdict, dataclass
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from api.caching import GROUPBUYS, PRODUCTS, invalidate_tags
+from api.models import GroupBuy, Order, StockReservation
+from api.services import stock_counters
+from api.services.ledger import transition_orders
+
+DEFAULT_BATCH_SIZE = 500
+# 超时后可释放库存的订单状态；其它状态（已成团、待提货等）视为已成交
+RELEASABLE_STATUSES = ('awaiting_group_success', 'canceled')
+
+
+def reservation_ttl() -> timedelta:
+    return timedelta(minutes=getattr(settings, 'STOCK_RESERVATION_TTL_MINUTES', 30))
+
+
+def hold_stock(order, product_id, quantity, now=None) -> StockReservation:
+    """为刚创建的订单记录库存预留（库存已由调用方扣减）"""
+    now = now or timezone.now()
+    return StockReservation.objects.create(
+        order=order, product_id=product_id, quantity=quantity, expires_at=now + reservation_ttl(),
+    )
+
+
+def hold_stock_many(entries, now=None):
+    """批量记录预留，entries 为 [(订单, 商品id, 数量)]"""
+    now = now or timezone.now()
+    expires_at = now + reservation_ttl()
+    return StockReservation.objects.bulk_create([
+        StockReservation(order=order, product_id=product_id, quantity=quantity, expires_at=expires_at)
+        for order, product_id, quantity in entries
+    ])
+
+
+def convert_reservations(orders) -> int:
+    """订单已支付或已成团：预留转为销售，不再过期"""
+    return StockReservation.objects.filter(order__in=orders, status='held').update(status='converted')
+
+
+def release_reservations(orders) -> int:
+    """库存已由调用方回补（如拼单失败结算），只把预留标记为已释放"""
+    return StockReservation.objects.filter(order__in=orders, status='held').update(status='released')
+
+
+@dataclass
+class ReleaseReport:
+    batches: int = 0
+    released: int = 0
+    converted: int = 0
+    orders_canceled: int = 0
+    units_restocked: int = 0
+    elapsed_ms: float = 0.0
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+def restock_products(quantities) -> int:
+    """批量调整多个商品的库存，quantities 为 {product_id: 变化量}
+
+    启用分片库存计数器时写入计数器，由定时任务写回数据库；否则一条 CASE UPDATE 直接写库。
+    """
+    if not quantities:
+        return 0
+    if stock_counters.enabled():
+        stock_counters.adjust_many(quantities)
+        return len(quantities)
+    return stock_counters.update_stock_in_db(quantities)
+
+
+def _release_slots(quantities) -> int:
+    """一条 UPDATE 为多个拼单退回名额，quantities 为 {group_buy_id: 数量}"""
+    if not quantities:
+        return 0
+    delta = Case(
+        *[When(id=group_buy_id, then=Value(qty)) for group_buy_id, qty in quantities.items()],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+    return GroupBuy.objects.filter(id__in=list(quantities)).update(
+        current_participants=F('current_participants') - delta
+    )
+
+
+def _release_batch(rows, report):
+    # 加锁顺序与支付路径一致：先锁订单、再锁预留。与支付回调竞争同一订单时以加锁后读到的状态为准；
+    # 正被其它事务锁住的订单与预留跳过（skip_locked），留给下一次清理，清理任务不会等锁
+    orders = {
+        order_id: (order_status, payment_status, group_buy_id)
+        for order_id, order_status, payment_status, group_buy_id in (
+            Order.objects.select_for_update(skip_locked=True)
+            .filter(id__in=[order_id for _, order_id, _, _ in rows])
+            .order_by('id')
+            .values_list('id', 'status', 'payment_status', 'group_buy_id')
+        )
+    }
+    # 并行的清理任务可能已处理过其中的预留：只处理加锁后仍为 held 的，保证库存与名额只回补一次
+    held = set(
+        StockReservation.objects.select_for_update(skip_locked=True)
+        .filter(id__in=[reservation_id for reservation_id, order_id, _, _ in rows if order_id in orders], status='held')
+        .order_by('id')
+        .values_list('id', flat=True)
+    )
+    rows = [row for row in rows if row[0] in held]
+
+    released, converted, to_cancel = [], [], []
+    restock = defaultdict(int)
+    slots = defaultdict(int)
+    for reservation_id, order_id, product_id, quantity in rows:
+        order_status, payment_status, group_buy_id = orders[order_id]
+        if payment_status == 'paid' or order_status not in RELEASABLE_STATUSES:
+            converted.append(reservation_id)
+            continue
+        released.append(reservation_id)
+        restock[product_id] += quantity
+        if order_status == 'awaiting_group_success':
+            to_cancel.append(order_id)
+            slots[group_buy_id] += quantity
+
+    report.orders_canceled += transition_orders(Order.objects.filter(id__in=to_cancel), 'canceled')
+    restock_products(dict(restock))
+    _release_slots(dict(slots))
+    report.released += StockReservation.objects.filter(id__in=released).update(status='released')
+    report.converted += StockReservation.objects.filter(id__in=converted).update(status='converted')
+    report.units_restocked += sum(restock.values())
+    if released:
+        invalidate_tags(GROUPBUYS, PRODUCTS)
+
+
+def release_expired_reservations(now=None, batch_size=None) -> ReleaseReport:
+    """释放所有已过期的预留：取消未支付的待成团订单，批量回补库存与拼单名额"""
+    now = now or timezone.now()
+    batch_size = batch_size or getattr(settings, 'STOCK_RESERVATION_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+    report = ReleaseReport()
+    started = time.perf_counter()
+
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            # 只读出候选预留，不加锁；订单与预留在 _release_batch 中按固定顺序加锁。
+            # 按 id 推进，被跳过的（正被锁住的）预留不会让本轮反复读到同一批
+            rows = list(
+                StockReservation.objects
+                .filter(status='held', expires_at__lte=now, id__gt=last_id)
+                .order_by('id')
+                .values_list('id', 'order_id', 'product_id', 'quantity')[:batch_size]
+            )
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            _release_batch(rows, report)
+        report.batches += 1
+        if len(rows) < batch_size:
+            break
+
+    report.elapsed_ms = round((time.perf_counter() - started) * 1000, 2)
+    return report
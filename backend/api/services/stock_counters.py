@@ -0,0 +1,418 @@
+"""分片库存计数器
+
+热门商品的 Product.stock_quantity 是全库最热的一行：参团、取消、结算都要改它。
+启用 STOCK_COUNTERS_ENABLED 后，库存以计数器为准：
+- 每个商品的库存拆成 STOCK_COUNTER_SHARDS 个子计数器，扣减随机落在某个分片上，
+  分片余量不足时再跨分片凑齐，并发写入不会集中到同一个键；
+- 每次变化同时累加到该商品的待写回差额，flush_stock_counters 定时把差额
+  用一条 CASE UPDATE 批量写回 Product.stock_quantity；
+- 计数器首次使用时按数据库库存初始化；管理员直接修改商品库存时把修改量计入计数器，
+  尚未写回的差额保留，写回时叠加在新库存上。
+
+后端：RedisStockBackend 用于生产（多进程共享，扣减为 Lua 原子操作）；
+InProcessStockBackend 为纯 Python 实现，仅用于测试和单进程部署。
+reconcile 对比计数器与数据库（含待写回差额），发现偏差可按数据库重置。
+
+计数器不参与数据库事务：
+- give（回补）在事务中调用时延迟到提交后执行，回滚则不回补；
+- take（扣减）必须立即生效才能拒绝超卖，在 stock_counters.atomic() 块内调用时，
+  事务回滚（含提交失败）后把块内扣减的库存原样归还。
+"""
+import logging
+import random
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+
+from api.models import Product
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SHARDS = 8
+
+
+def enabled() -> bool:
+    return getattr(settings, 'STOCK_COUNTERS_ENABLED', False)
+
+
+def shard_count() -> int:
+    return getattr(settings, 'STOCK_COUNTER_SHARDS', DEFAULT_SHARDS)
+
+
+def split(total, shards):
+    """把库存尽量均分到各分片"""
+    base, extra = divmod(max(total, 0), shards)
+    return [base + (1 if i < extra else 0) for i in range(shards)]
+
+
+class InProcessStockBackend:
+    """进程内计数器：按商品分段加锁"""
+
+    def __init__(self):
+        self._shards = {}
+        self._deltas = {}
+        self._lock_stripes = [threading.Lock() for _ in range(64)]
+        self._delta_lock = threading.Lock()
+
+    def _lock(self, product_id, shard):
+        return self._lock_stripes[hash((product_id, shard)) % len(self._lock_stripes)]
+
+    def load(self, product_id, values) -> bool:
+        with self._delta_lock:
+            if product_id in self._shards:
+                return False
+            self._shards[product_id] = list(values)
+            return True
+
+    def reset(self, product_id, values):
+        with self._delta_lock:
+            self._shards[product_id] = list(values)
+            self._deltas.pop(product_id, None)
+
+    def is_loaded(self, product_id) -> bool:
+        return product_id in self._shards
+
+    def take_up_to(self, product_id, shard, quantity, exact) -> int:
+        with self._lock(product_id, shard):
+            shards = self._shards[product_id]
+            available = shards[shard]
+            taken = quantity if available >= quantity else (0 if exact else available)
+            shards[shard] -= taken
+            return taken
+
+    def give(self, product_id, shard, quantity):
+        with self._lock(product_id, shard):
+            self._shards[product_id][shard] += quantity
+
+    def values(self, product_id):
+        return list(self._shards.get(product_id, []))
+
+    def add_delta(self, product_id, delta):
+        with self._delta_lock:
+            self._deltas[product_id] = self._deltas.get(product_id, 0) + delta
+
+    def pending(self, product_id) -> int:
+        return self._deltas.get(product_id, 0)
+
+    def pop_deltas(self, limit):
+        with self._delta_lock:
+            product_ids = list(self._deltas)[:limit]
+            return {pid: self._deltas.pop(pid) for pid in product_ids}
+
+    def loaded_products(self):
+        return list(self._shards)
+
+
+class RedisStockBackend:
+    """Redis 计数器：每个分片一个键，条件扣减与初始化用 Lua 保证原子性"""
+
+    TAKE_SCRIPT = """
+    local available = tonumber(redis.call('GET', KEYS[1]) or '0')
+    local quantity = tonumber(ARGV[1])
+    local taken = quantity
+    if available < quantity then
+        if ARGV[2] == '1' then return 0 end
+        taken = available
+    end
+    if taken > 0 then redis.call('DECRBY', KEYS[1], taken) end
+    return taken
+    """
+    LOAD_SCRIPT = """
+    if redis.call('SETNX', KEYS[1], 1) == 0 then return 0 end
+    for i = 2, #KEYS do redis.call('SET', KEYS[i], ARGV[i - 1]) end
+    return 1
+    """
+
+    def __init__(self, url, prefix='stock'):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self._take = self.client.register_script(self.TAKE_SCRIPT)
+        self._load = self.client.register_script(self.LOAD_SCRIPT)
+
+    def _shard_key(self, product_id, shard):
+        return f'{self.prefix}:{product_id}:{shard}'
+
+    def _loaded_key(self, product_id):
+        return f'{self.prefix}:{product_id}:loaded'
+
+    def _delta_key(self, product_id):
+        return f'{self.prefix}:{product_id}:delta'
+
+    @property
+    def _dirty_key(self):
+        return f'{self.prefix}:dirty'
+
+    @property
+    def _products_key(self):
+        return f'{self.prefix}:products'
+
+    def load(self, product_id, values) -> bool:
+        keys = [self._loaded_key(product_id)] + [self._shard_key(product_id, i) for i in range(len(values))]
+        loaded = bool(self._load(keys=keys, args=values))
+        if loaded:
+            self.client.sadd(self._products_key, product_id)
+        return loaded
+
+    def reset(self, product_id, values):
+        pipe = self.client.pipeline()
+        for i, value in enumerate(values):
+            pipe.set(self._shard_key(product_id, i), value)
+        pipe.set(self._loaded_key(product_id), 1)
+        pipe.delete(self._delta_key(product_id))
+        pipe.srem(self._dirty_key, product_id)
+        pipe.sadd(self._products_key, product_id)
+        pipe.execute()
+
+    def is_loaded(self, product_id) -> bool:
+        return bool(self.client.exists(self._loaded_key(product_id)))
+
+    def take_up_to(self, product_id, shard, quantity, exact) -> int:
+        return int(self._take(keys=[self._shard_key(product_id, shard)], args=[quantity, '1' if exact else '0']))
+
+    def give(self, product_id, shard, quantity):
+        self.client.incrby(self._shard_key(product_id, shard), quantity)
+
+    def values(self, product_id):
+        return [int(v or 0) for v in self.client.mget([self._shard_key(product_id, i) for i in range(shard_count())])]
+
+    def add_delta(self, product_id, delta):
+        pipe = self.client.pipeline()
+        pipe.incrby(self._delta_key(product_id), delta)
+        pipe.sadd(self._dirty_key, product_id)
+        pipe.execute()
+
+    def pending(self, product_id) -> int:
+        return int(self.client.get(self._delta_key(product_id)) or 0)
+
+    def pop_deltas(self, limit):
+        product_ids = [int(pid) for pid in self.client.spop(self._dirty_key, limit) or []]
+        if not product_ids:
+            return {}
+        pipe = self.client.pipeline()
+        for pid in product_ids:
+            pipe.getset(self._delta_key(pid), 0)
+        return {pid: int(delta or 0) for pid, delta in zip(product_ids, pipe.execute())}
+
+    def loaded_products(self):
+        return [int(pid) for pid in self.client.smembers(self._products_key)]
+
+
+_backend = None
+_backend_lock = threading.Lock()
+_local = threading.local()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if getattr(settings, 'STOCK_COUNTER_BACKEND', 'memory') == 'redis':
+                    _backend = RedisStockBackend(getattr(settings, 'STOCK_COUNTER_REDIS_URL', 'redis://127.0.0.1:6379/3'))
+                else:
+                    _backend = InProcessStockBackend()
+    return _backend
+
+
+def set_backend(backend):
+    """替换后端（测试用）"""
+    global _backend
+    _backend = backend
+
+
+def ensure_loaded(product_id):
+    backend = get_backend()
+    if not backend.is_loaded(product_id):
+        stock = Product.objects.filter(id=product_id).values_list('stock_quantity', flat=True).first() or 0
+        backend.load(product_id, split(stock, shard_count()))
+
+
+def available(product_id) -> int:
+    """实时库存（各分片之和），不读数据库、不加锁"""
+    ensure_loaded(product_id)
+    return sum(get_backend().values(product_id))
+
+
+def _take(product_id, quantity) -> bool:
+    ensure_loaded(product_id)
+    backend = get_backend()
+    shards = shard_count()
+    start = random.randrange(shards)
+    order = [(start + k) % shards for k in range(shards)]
+
+    # 绝大多数请求数量很小，先尝试在单个分片上整体扣减
+    for shard in order:
+        if backend.take_up_to(product_id, shard, quantity, exact=True):
+            backend.add_delta(product_id, -quantity)
+            return True
+
+    # 各分片余量都不够时跨分片凑齐，凑不齐则原样退回
+    taken = []
+    need = quantity
+    for shard in order:
+        got = backend.take_up_to(product_id, shard, need, exact=False)
+        if got:
+            taken.append((shard, got))
+            need -= got
+        if need == 0:
+            backend.add_delta(product_id, -quantity)
+            return True
+    for shard, got in taken:
+        backend.give(product_id, shard, got)
+    return False
+
+
+def take(product_id, quantity) -> bool:
+    """扣减库存，库存不足时不做任何修改；在 atomic() 块内扣减的库存于事务回滚时归还"""
+    taken = _take(product_id, quantity)
+    stack = getattr(_local, 'takes', None)
+    if taken and stack:
+        stack[-1].append((product_id, quantity))
+    return taken
+
+
+def _give(product_id, quantity):
+    ensure_loaded(product_id)
+    backend = get_backend()
+    backend.give(product_id, random.randrange(shard_count()), quantity)
+    backend.add_delta(product_id, quantity)
+
+
+def give(product_id, quantity):
+    """归还库存；在事务中调用时于提交后生效，回滚则不归还"""
+    transaction.on_commit(lambda: _give(product_id, quantity))
+
+
+@contextmanager
+def atomic():
+    """同 transaction.atomic，另外在事务回滚（含提交失败）时归还块内 take 扣减的库存"""
+    stack = _local.__dict__.setdefault('takes', [])
+    takes = []
+    stack.append(takes)
+    try:
+        with transaction.atomic():
+            yield
+    except BaseException:
+        stack.pop()
+        for product_id, quantity in takes:
+            _give(product_id, quantity)
+        raise
+    stack.pop()
+    if stack:
+        # 嵌套块提交的只是保存点，外层回滚时仍需归还
+        stack[-1].extend(takes)
+
+
+def adjust_many(quantities):
+    """批量调整库存（回补为正数，提交后生效），quantities 为 {product_id: 变化量}"""
+    for product_id, delta in quantities.items():
+        if delta > 0:
+            give(product_id, delta)
+        elif delta < 0 and not take(product_id, -delta):
+            logger.warning('商品 %s 计数器库存不足，无法扣减 %s', product_id, -delta)
+
+
+def apply_db_change(product_id, delta):
+    """数据库库存已被直接修改（如管理员编辑）：把变化量计入计数器，不产生待写回差额"""
+    backend = get_backend()
+    if not delta or not backend.is_loaded(product_id):
+        # 未加载的计数器首次使用时按数据库中的新库存初始化
+        return
+    if delta > 0:
+        backend.give(product_id, random.randrange(shard_count()), delta)
+        return
+    need = -delta
+    for shard in range(shard_count()):
+        need -= backend.take_up_to(product_id, shard, need, exact=False)
+        if not need:
+            return
+    logger.warning('商品 %s 计数器库存不足，少扣减 %s，请运行 reconcile_stock_counters', product_id, need)
+
+
+def reset(product_id, stock):
+    """以数据库中的库存重置计数器（丢弃未写回的差额）"""
+    get_backend().reset(product_id, split(stock, shard_count()))
+
+
+def update_stock_in_db(quantities) -> int:
+    """一条 UPDATE 为多个商品调整库存，quantities 为 {product_id: 变化量}"""
+    if not quantities:
+        return 0
+    delta = Case(
+        *[When(id=product_id, then=Value(qty)) for product_id, qty in quantities.items()],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+    return Product.objects.filter(id__in=list(quantities)).update(
+        stock_quantity=F('stock_quantity') + delta
+    )
+
+
+@dataclass
+class FlushReport:
+    products: int = 0
+    net_units: int = 0
+    batches: int = 0
+
+
+def flush(batch_size=None) -> FlushReport:
+    """把各商品累计的库存差额批量写回数据库"""
+    batch_size = batch_size or getattr(settings, 'STOCK_COUNTER_FLUSH_BATCH', 500)
+    backend = get_backend()
+    report = FlushReport()
+    while True:
+        deltas = {pid: d for pid, d in backend.pop_deltas(batch_size).items() if d}
+        if not deltas:
+            break
+        try:
+            update_stock_in_db(deltas)
+        except Exception:
+            # 写回失败时把差额放回，下次再写
+            for pid, delta in deltas.items():
+                backend.add_delta(pid, delta)
+            raise
+        report.products += len(deltas)
+        report.net_units += sum(deltas.values())
+        report.batches += 1
+    return report
+
+
+@dataclass
+class Drift:
+    product_id: int
+    counter: int
+    database: int
+    pending: int
+
+    @property
+    def difference(self) -> int:
+        return self.counter - (self.database + self.pending)
+
+
+def reconcile(fix=False):
+    """对比计数器与数据库库存（加上待写回差额），返回存在偏差的商品；fix=True 时按数据库重置"""
+    backend = get_backend()
+    product_ids = backend.loaded_products()
+    db_stock = dict(Product.objects.filter(id__in=product_ids).values_list('id', 'stock_quantity'))
+    drifts = []
+    for product_id in product_ids:
+        drift = Drift(
+            product_id=product_id,
+            counter=sum(backend.values(product_id)),
+            database=db_stock.get(product_id, 0),
+            pending=backend.pending(product_id),
+        )
+        if drift.difference:
+            drifts.append(drift)
+    if fix:
+        flush()
+        for drift in drifts:
+            stock = Product.objects.filter(id=drift.product_id).values_list('stock_quantity', flat=True).first() or 0
+            reset(drift.product_id, stock)
+    return drifts
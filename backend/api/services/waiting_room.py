@@ -0,0 +1,224 @@
+"""热门拼单的等候室
+
+开团瞬间的大量参团请求先在缓存中排队，只有能拿到名额的请求才会访问数据库：
+- 每个请求立即获得一个递增的排队号；
+- 缓存中为每个拼单维护剩余名额计数器（首次使用或过期后从数据库读取一次），
+  用原子 decr 扣减，扣到负数即名额已满，直接拒绝，不再等待拼单行锁；
+- 拿到名额的请求获得准入资格，可立即参团，也可先调用排队接口、在有效期内再参团；
+- 参团失败的名额立即退回计数器；准入过期未使用的名额在计数器定期从数据库重新同步时收回。
+  已发放、尚未参团的准入按到期时间分桶计数，同步时从数据库的剩余名额中扣除，
+  避免同一名额被再次发放；
+- 拼单不存在或已不可参团时不经过闸门，由参团引擎返回真实的错误。
+
+计数器只是数据库前的闸门，名额的最终判定仍由参团引擎的条件 UPDATE 完成。
+排队长度推送到拼单房间（GroupBuyConsumer），每个用户本人的排队号与准入结果
+推送到其个人房间（UserNotificationConsumer）。
+"""
+import math
+import time
+from dataclasses import asdict, dataclass
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+
+from api.models import GroupBuy
+from api.services.join import JOINABLE_STATUSES
+from api.websocket_utils import send_queue_position, send_queue_status
+
+# 已发放准入按到期时间分桶的粒度（秒）
+HELD_BUCKET_SECONDS = 10
+
+
+@dataclass
+class Admission:
+    group_buy_id: int
+    position: int
+    quantity: int
+    admitted: bool
+    slots_left: int
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+def enabled() -> bool:
+    return getattr(settings, 'WAITING_ROOM_ENABLED', True)
+
+
+def _sync_seconds() -> int:
+    return getattr(settings, 'WAITING_ROOM_SYNC_SECONDS', 10)
+
+
+def _admission_seconds() -> int:
+    return getattr(settings, 'WAITING_ROOM_ADMISSION_SECONDS', 120)
+
+
+def _slots_key(group_buy_id):
+    return f'waiting_room:{group_buy_id}:slots'
+
+
+def _seq_key(group_buy_id):
+    return f'waiting_room:{group_buy_id}:seq'
+
+
+def _ticket_key(group_buy_id, user_id):
+    return f'waiting_room:{group_buy_id}:user:{user_id}'
+
+
+def _held_key(group_buy_id, bucket):
+    return f'waiting_room:{group_buy_id}:held:{bucket}'
+
+
+def _hold(group_buy_id, quantity) -> int:
+    """记录一张已发放的准入，返回其到期时间所在的桶"""
+    expires_at = time.time() + _admission_seconds()
+    bucket = int(expires_at // HELD_BUCKET_SECONDS)
+    # 桶在其覆盖的最后一张准入到期时一并过期
+    timeout = max(math.ceil((bucket + 1) * HELD_BUCKET_SECONDS - time.time()), 1)
+    key = _held_key(group_buy_id, bucket)
+    cache.add(key, 0, timeout=timeout)
+    try:
+        cache.incr(key, quantity)
+    except ValueError:
+        cache.set(key, quantity, timeout=timeout)
+    return bucket
+
+
+def _unhold(group_buy_id, bucket, quantity):
+    try:
+        cache.decr(_held_key(group_buy_id, bucket), quantity)
+    except ValueError:
+        pass
+
+
+def held_slots(group_buy_id) -> int:
+    """已发放、尚未参团且未过期的准入占用的名额"""
+    now = time.time()
+    first = int(now // HELD_BUCKET_SECONDS)
+    last = int((now + _admission_seconds()) // HELD_BUCKET_SECONDS)
+    keys = [_held_key(group_buy_id, bucket) for bucket in range(first, last + 1)]
+    return sum(max(count, 0) for count in cache.get_many(keys).values())
+
+
+def _remaining_slots(group_buy_id):
+    """可发放的名额：数据库剩余名额减去已发放的准入；拼单不存在或不可参团时返回 None"""
+    remaining = (
+        GroupBuy.objects
+        .filter(id=group_buy_id, status__in=JOINABLE_STATUSES)
+        .values_list(F('target_participants') - F('current_participants'), flat=True)
+        .first()
+    )
+    if remaining is None:
+        return None
+    return max(remaining - held_slots(group_buy_id), 0)
+
+
+def take_slots(group_buy_id, quantity):
+    """从缓存计数器扣减名额，返回 (是否成功, 剩余名额)；拼单不可参团时返回 None"""
+    key = _slots_key(group_buy_id)
+    for _ in range(2):
+        try:
+            left = cache.decr(key, quantity)
+        except ValueError:
+            # 计数器不存在或已过期，从数据库同步一次
+            remaining = _remaining_slots(group_buy_id)
+            if remaining is None:
+                return None
+            cache.add(key, remaining, timeout=_sync_seconds())
+            continue
+        if left >= 0:
+            return True, left
+        release_slots(group_buy_id, quantity)
+        return False, max(left + quantity, 0)
+    return False, 0
+
+
+def release_slots(group_buy_id, quantity):
+    """退回名额（计数器已过期时无需处理，下次使用会从数据库重新同步）"""
+    try:
+        cache.incr(_slots_key(group_buy_id), quantity)
+    except ValueError:
+        pass
+
+
+def _next_position(group_buy_id) -> int:
+    key = _seq_key(group_buy_id)
+    cache.add(key, 0, timeout=24 * 3600)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, timeout=24 * 3600)
+        return 1
+
+
+def _publish(admission, user_id):
+    # 本人的排队号每次都推送；拼单房间的排队长度每个拼单每秒最多推送一次
+    send_queue_position(user_id, admission.group_buy_id, admission.as_dict())
+    if cache.add(f'waiting_room:{admission.group_buy_id}:pushed', 1, timeout=1):
+        send_queue_status(admission.group_buy_id, {
+            'queue_length': admission.position,
+            'slots_left': admission.slots_left,
+        })
+
+
+def _ticket_admission(record):
+    return Admission(**{key: value for key, value in record.items() if key != 'held_bucket'})
+
+
+def enter(group_buy_id, user_id, quantity, hold=True):
+    """进入等候室：立即分配排队号，有剩余名额则准入，否则直接拒绝
+
+    hold=True 时准入资格保存到缓存，供之后的参团请求使用。
+    拼单不存在或不可参团时返回 None，不分配排队号。
+    """
+    if hold:
+        record = cache.get(_ticket_key(group_buy_id, user_id))
+        if record:
+            return _ticket_admission(record)
+
+    taken = take_slots(group_buy_id, quantity)
+    if taken is None:
+        return None
+    admitted, slots_left = taken
+    position = _next_position(group_buy_id)
+    admission = Admission(
+        group_buy_id=group_buy_id,
+        position=position,
+        quantity=quantity,
+        admitted=admitted,
+        slots_left=slots_left,
+    )
+    if admitted and hold:
+        record = {**admission.as_dict(), 'held_bucket': _hold(group_buy_id, quantity)}
+        cache.set(_ticket_key(group_buy_id, user_id), record, timeout=_admission_seconds())
+    _publish(admission, user_id)
+    return admission
+
+
+def claim(group_buy_id, user_id, quantity):
+    """参团前取得准入：优先使用之前排队得到的资格，否则当场排队
+
+    返回 None 表示拼单不存在或不可参团，调用方应跳过闸门，由参团引擎返回错误。
+    """
+    key = _ticket_key(group_buy_id, user_id)
+    record = cache.get(key)
+    if record and cache.delete(key):
+        if record.get('held_bucket') is not None:
+            _unhold(group_buy_id, record['held_bucket'], record['quantity'])
+        admission = _ticket_admission(record)
+        extra = quantity - admission.quantity
+        if extra > 0:
+            taken = take_slots(group_buy_id, extra)
+            if taken is None:
+                release_slots(group_buy_id, admission.quantity)
+                return None
+            admitted, admission.slots_left = taken
+            if not admitted:
+                release_slots(group_buy_id, admission.quantity)
+                admission.admitted = False
+        elif extra < 0:
+            release_slots(group_buy_id, -extra)
+        admission.quantity = quantity
+        return admission
+    return enter(group_buy_id, user_id, quantity, hold=False)
@@ -1,6 +1,9 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
-from .models import Alert
+from .caching import GROUPBUYS, LEADERS, MEMBERSHIP_TIERS, ORDERS, PRODUCTS, invalidate_tags
+from .models import Alert, GroupBuy, MembershipTier, Order, Product, User
+from .services import lifecycle, membership, stock_counters
 from .tasks import send_low_stock_notification
 
 
@@ -10,3 +13,75 @@ def on_alert_created(sender, instance: Alert, created: bool, **kwargs):
         send_low_stock_notification.delay(instance.id)
 
 
+# 接口缓存失效：模型保存/删除时递增对应标签的版本号
+CACHE_TAGS = {
+    Product: (PRODUCTS,),
+    GroupBuy: (GROUPBUYS,),
+    Order: (ORDERS,),
+    MembershipTier: (MEMBERSHIP_TIERS,),
+}
+
+
+def invalidate_cached_responses(sender, **kwargs):
+    invalidate_tags(*CACHE_TAGS[sender])
+
+
+for model in CACHE_TAGS:
+    post_save.connect(invalidate_cached_responses, sender=model, dispatch_uid=f'api_cache_save_{model.__name__}')
+    post_delete.connect(invalidate_cached_responses, sender=model, dispatch_uid=f'api_cache_delete_{model.__name__}')
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_leader_responses(sender, update_fields=None, **kwargs):
+    # 团长审核、资料修改等会改变团长展示数据；登录只更新 last_login，不必失效
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    invalidate_tags(LEADERS)
+
+
+@receiver(post_save, sender=MembershipTier)
+@receiver(post_delete, sender=MembershipTier)
+def reset_tier_resolver(sender, **kwargs):
+    # 本进程立即丢弃等级副本；其它进程由 MEMBERSHIP_TIERS 标签版本变化发现
+    membership.clear_tier_cache()
+    # 门槛变化后已有用户的等级需要重新评定
+    transaction.on_commit(membership.schedule_retier)
+
+
+@receiver(pre_save, sender=Product)
+def remember_product_stock(sender, instance: Product, **kwargs):
+    if stock_counters.enabled() and instance.pk:
+        instance._previous_stock = (
+            Product.objects.filter(pk=instance.pk).values_list('stock_quantity', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Product)
+def sync_stock_counter(sender, instance: Product, created: bool, **kwargs):
+    # 新建商品以初始库存重置分片计数器；直接修改了库存（如管理员编辑）时只计入修改量，
+    # 参团/退款产生但尚未写回的差额不被丢弃
+    if not stock_counters.enabled():
+        return
+    product_id, stock = instance.pk, instance.stock_quantity
+    previous = getattr(instance, '_previous_stock', None)
+    if created or previous is None:
+        transaction.on_commit(lambda: stock_counters.reset(product_id, stock))
+    elif previous != stock:
+        transaction.on_commit(lambda: stock_counters.apply_db_change(product_id, stock - previous))
+
+
+@receiver(pre_save, sender=GroupBuy)
+def remember_group_buy_times(sender, instance: GroupBuy, **kwargs):
+    if instance.pk:
+        instance._previous_times = (
+            GroupBuy.objects.filter(pk=instance.pk).values_list('start_time', 'end_time').first()
+        )
+
+
+@receiver(post_save, sender=GroupBuy)
+def schedule_group_buy_transitions(sender, instance: GroupBuy, created: bool, **kwargs):
+    # 新建或修改了开始/结束时间（如提前结束）时按新时间点投递；已投递的旧时间点到期后是空操作
+    previous = getattr(instance, '_previous_times', None)
+    if created or previous != (instance.start_time, instance.end_time):
+        lifecycle.schedule_group_buy_on_commit(instance)
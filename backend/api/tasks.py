@@ -1,75 +1,58 @@
+import logging
+
 from celery import shared_task
+from celery.signals import worker_ready
 from django.utils import timezone
-from django.db import transaction
-from .models import GroupBuy, Order, OrderItem, Product
-from django.db import models
+from .caching import GROUPBUYS, invalidate_tags
+from .models import GroupBuy
+from .services import lifecycle, membership, payment_inbox, stock_counters
+from .services.public_stats import refresh_public_stats as _refresh_public_stats
+from .services.finalization import finalize_due_group_buys
+from .services.reservations import release_expired_reservations as _release_expired_reservations
+
+logger = logging.getLogger(__name__)
 
 
-def _cancel_expired_group_buys_core() -> int:
-    count = 0
-    expired = GroupBuy.objects.filter(end_time__lt=timezone.now(), status='active')
-    for gb in expired:
-        with transaction.atomic():
-            orders_to_cancel = Order.objects.filter(group_buy_id=gb.id, status='awaiting_group_success')
+def _log_report(name, report):
+    logger.info(
+        '%s: processed=%d successful=%d failed=%d orders_succeeded=%d orders_canceled=%d '
+        'units_restocked=%d chunks=%d elapsed_ms=%.2f',
+        name, report.processed, report.successful, report.failed, report.orders_succeeded,
+        report.orders_canceled, report.units_restocked, report.chunks, report.elapsed_ms,
+    )
+    return report
 
-            # rollback stock for each order
-            for order in orders_to_cancel.select_related('group_buy').prefetch_related('items'):
-                for item in order.items.all():
-                    Product.objects.filter(id=item.product_id).update(
-                        stock_quantity=models.F('stock_quantity') + item.quantity
-                    )
 
-            updated = orders_to_cancel.update(status='canceled')
-            gb.status = 'failed'
-            gb.save()
-            count += 1
-    return count
+def _cancel_expired_group_buys_core():
+    # 到期仍处于 active 的拼单一律按失败处理：取消待成团订单并回补库存
+    report = finalize_due_group_buys(statuses=('active',), allow_success=False)
+    return _log_report('cancel_expired_group_buys', report)
 
 
 @shared_task
 def cancel_expired_groupbuys():
     # 保持兼容的旧任务名（每次调用返回处理的拼单数）
-    return _cancel_expired_group_buys_core()
+    return _cancel_expired_group_buys_core().processed
 
 
 @shared_task
 def cancel_expired_group_buys():
     # 新任务名，供 Celery Beat 调度使用
-    return _cancel_expired_group_buys_core()
+    return _cancel_expired_group_buys_core().as_dict()
 
 
 def _activate_pending_groupbuys_core() -> int:
     now = timezone.now()
     updated = GroupBuy.objects.filter(status='pending', start_time__lte=now).update(status='active')
+    if updated:
+        invalidate_tags(GROUPBUYS)
     return updated
 
 
-def _finalize_groupbuys_core() -> int:
-    now = timezone.now()
-    processed = 0
-    # 成功：到达或超过目标人数且在结束时间或之后
-    success_candidates = GroupBuy.objects.filter(status__in=['active', 'pending'], end_time__lte=now)
-    for gb in success_candidates.select_related('product'):
-        if gb.current_participants >= gb.target_participants:
-            gb.status = 'successful'
-            gb.save()
-            # 更新相关订单到 successful
-            Order.objects.filter(group_buy_id=gb.id, status='awaiting_group_success').update(status='successful')
-            processed += 1
-        else:
-            # 走失败逻辑（与过期取消一致）：退库存并取消订单
-            with transaction.atomic():
-                orders_to_cancel = Order.objects.filter(group_buy_id=gb.id, status='awaiting_group_success')
-                for order in orders_to_cancel.select_related('group_buy').prefetch_related('items'):
-                    for item in order.items.all():
-                        Product.objects.filter(id=item.product_id).update(
-                            stock_quantity=models.F('stock_quantity') + item.quantity
-                        )
-                orders_to_cancel.update(status='canceled')
-                gb.status = 'failed'
-                gb.save()
-                processed += 1
-    return processed
+def _finalize_groupbuys_core():
+    # 成功：到达或超过目标人数且在结束时间或之后；失败：退库存并取消订单
+    report = finalize_due_group_buys(statuses=('active', 'pending'))
+    return _log_report('finalize_groupbuys', report)
 
 
 @shared_task
@@ -79,7 +62,77 @@ def activate_pending_groupbuys():
 
 @shared_task
 def finalize_groupbuys():
-    return _finalize_groupbuys_core()
+    return _finalize_groupbuys_core().as_dict()
+
+
+@shared_task
+def transition_groupbuy(group_buy_id: int, action: str):
+    # 由生命周期调度器按拼单的开始/结束时间点投递（eta），到点执行单个拼单的状态转换
+    return lifecycle.run_transition(group_buy_id, action)
+
+
+@shared_task
+def refill_groupbuy_schedule(force: bool = False):
+    # 把调度窗口内即将到期的时间点补充进 worker 的定时队列
+    return lifecycle.refill_schedule(force=force)
+
+
+@worker_ready.connect
+def recover_groupbuy_schedule(sender=None, **kwargs):
+    # worker 重启后内存中的定时队列可能已丢失，从数据库重建
+    refill_groupbuy_schedule.delay(force=True)
+
+
+@shared_task
+def release_expired_reservations():
+    # 释放超时未支付的库存预留：取消待成团订单，批量回补库存与名额
+    report = _release_expired_reservations()
+    logger.info(
+        'release_expired_reservations: released=%d converted=%d orders_canceled=%d units_restocked=%d '
+        'batches=%d elapsed_ms=%.2f',
+        report.released, report.converted, report.orders_canceled, report.units_restocked,
+        report.batches, report.elapsed_ms,
+    )
+    return report.as_dict()
+
+
+@shared_task
+def flush_stock_counters():
+    # 把分片库存计数器累计的差额批量写回 Product.stock_quantity
+    if not stock_counters.enabled():
+        return None
+    report = stock_counters.flush()
+    if report.products:
+        logger.info('flush_stock_counters: products=%d net_units=%d batches=%d',
+                    report.products, report.net_units, report.batches)
+    return report.products
+
+
+@shared_task
+def process_payment_callbacks():
+    # 批量处理支付回调收件箱：标记订单已支付、转换库存预留、检查成团
+    report = payment_inbox.process_pending()
+    if report.batches:
+        logger.info(
+            'process_payment_callbacks: processed=%d ignored=%d failed=%d orders_paid=%d batches=%d elapsed_ms=%.2f',
+            report.processed, report.ignored, report.failed, report.orders_paid, report.batches, report.elapsed_ms,
+        )
+    return report.as_dict()
+
+
+@shared_task
+def retier_users(dry_run: bool = False):
+    # 等级门槛变化后按积分区间批量重新评定所有用户的会员等级
+    report = membership.retier_users(dry_run=dry_run)
+    logger.info('retier_users: users=%d changed=%d chunks=%d dry_run=%s elapsed_ms=%.2f',
+                report.users, report.changed, report.chunks, dry_run, report.elapsed_ms)
+    return report.as_dict()
+
+
+@shared_task
+def refresh_public_stats():
+    # 定时重算首页统计并写入缓存
+    return _refresh_public_stats()
 
 
 @shared_task
@@ -87,5 +140,3 @@ def send_low_stock_notification(alert_id: int):
     # 占位实现：此处可集成邮件/短信/管理端推送
     # 为了演示，当前不做任何阻塞操作
     return f"alert {alert_id} notified"
-
-
@@ -1,3 +1,1318 @@
-from django.test import TestCase
+import json
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+import requests
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from requests.adapters import BaseAdapter
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.models import (
+    GroupBuy, LeaderMonthlyEarnings, MembershipTier, Notification, Order, OrderItem, PaymentCallback, Product,
+    StockReservation, User,
+)
+from api.services import (
+    finalization, group_success, ledger, lifecycle, membership, notifications, payment_inbox, public_stats, reservations,
+    stock_counters, waiting_room,
+)
+from api.services.checkout import checkout
+from api.services.join import JoinError, join_group_buy
+from api import broadcaster, caching, checks, payment_gateway, websocket_streams, websocket_utils
+from api.services.commission import month_start
+from core.asgi import application
 
 # Create your tests here.
+
+
+def make_group_buy(target=5, stock=100, status='active', **kwargs):
+    n = User.objects.count()
+    leader = User.objects.create(username=f'leader{n}', role='leader', leader_status='approved')
+    product = Product.objects.create(name='苹果', price=Decimal('10.00'), stock_quantity=stock)
+    now = timezone.now()
+    fields = {'start_time': now - timedelta(minutes=1), 'end_time': now + timedelta(days=1), **kwargs}
+    return GroupBuy.objects.create(product=product, leader=leader, target_participants=target, status=status, **fields)
+
+
+def make_order(group_buy, quantity=1, status='awaiting_group_success', **kwargs):
+    user = kwargs.pop('user', None) or User.objects.create(username=f'buyer{User.objects.count()}')
+    return Order.objects.create(
+        user=user, group_buy=group_buy, quantity=quantity, status=status,
+        total_price=group_buy.product.price * quantity, **kwargs,
+    )
+
+
+class LeaderApplicationsListViewTests(TestCase):
+    url = '/api/admin/leader-applications/'
+
+    def setUp(self):
+        self.admin = User.objects.create(username='admin', role='admin')
+        self.product = Product.objects.create(name='苹果', price=Decimal('10.00'), stock_quantity=100)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def create_leaders(self, count):
+        now = timezone.now()
+        for _ in range(count):
+            n = User.objects.count()
+            leader = User.objects.create(username=f'leader{n}', role='leader', leader_status='approved')
+            GroupBuy.objects.create(
+                product=self.product, leader=leader, target_participants=5,
+                start_time=now, end_time=now + timedelta(days=1), status='active',
+            )
+            LeaderMonthlyEarnings.objects.create(
+                leader=leader, month=month_start().date(), order_count=1, sales_amount=Decimal('50.00'),
+            )
+        User.objects.create(username=f'applicant{count}', leader_status='pending')
+
+    def test_query_count_does_not_grow_with_leaders(self):
+        self.create_leaders(3)
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url, {'page_size': 100})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total'], 4)
+
+        self.create_leaders(30)
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url, {'page_size': 100})
+        self.assertEqual(response.data['total'], 35)
+
+    def test_annotated_stats_pagination_and_status_filter(self):
+        self.create_leaders(3)
+        response = self.client.get(self.url, {'status': 'approved', 'page': 2, 'page_size': 2})
+        self.assertEqual(response.data['total'], 3)
+        self.assertEqual(response.data['counts']['pending'], 1)
+        self.assertEqual(len(response.data['results']), 1)
+        leader = response.data['results'][0]
+        self.assertEqual(leader['groupbuy_count'], 1)
+        self.assertEqual(leader['monthly_commission'], '5.00')
+
+        response = self.client.get(self.url, {'status': 'pending'})
+        self.assertEqual([u['leader_status'] for u in response.data['results']], ['pending'])
+        self.assertEqual(response.data['results'][0]['monthly_commission'], '0.00')
+
+    def test_invalid_pagination_params_return_400(self):
+        for params in ({'page': 'abc'}, {'page_size': 'x'}):
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.data['error'], '分页参数无效')
+
+
+class WebSocketPushTests(TransactionTestCase):
+    headers = [(b'origin', b'http://localhost')]
+
+    def create_group_buy(self):
+        leader = User.objects.create(username='leader', role='leader', leader_status='approved')
+        product = Product.objects.create(name='苹果', price=Decimal('10.00'), stock_quantity=100)
+        now = timezone.now()
+        return GroupBuy.objects.create(
+            product=product, leader=leader, target_participants=5,
+            start_time=now - timedelta(minutes=1), end_time=now + timedelta(days=1), status='active',
+        )
+
+    def join(self, user, group_buy_id):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client.post(f'/api/group-buys/{group_buy_id}/join/', {'quantity': 2}, format='json')
+
+    async def test_join_pushes_progress_to_subscribed_socket(self):
+        group_buy = await database_sync_to_async(self.create_group_buy)()
+        user = await database_sync_to_async(User.objects.create)(username='buyer')
+
+        communicator = WebsocketCommunicator(application, '/ws/groupbuys/', headers=self.headers)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual((await communicator.receive_json_from())['type'], 'connection_established')
+        await communicator.send_json_to({'type': 'join_groupbuy', 'groupbuy_id': group_buy.id})
+        self.assertEqual((await communicator.receive_json_from())['type'], 'joined_groupbuy')
+
+        response = await database_sync_to_async(self.join)(user, group_buy.id)
+        self.assertEqual(response.status_code, 201)
+
+        # 等候室会先推送排队进度
+        frame = await communicator.receive_json_from(timeout=2)
+        if frame['type'] == 'queue_status':
+            frame = await communicator.receive_json_from(timeout=2)
+        self.assertEqual(frame['type'], 'groupbuy_update')
+        self.assertEqual(frame['groupbuy_id'], group_buy.id)
+        self.assertEqual(frame['data']['current_participants'], 2)
+        await communicator.disconnect()
+
+    async def join_room(self, groupbuy_id, last_seq=None):
+        communicator = WebsocketCommunicator(application, '/ws/groupbuys/', headers=self.headers)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.receive_json_from()
+        message = {'type': 'join_groupbuy', 'groupbuy_id': groupbuy_id}
+        if last_seq is not None:
+            message['last_seq'] = last_seq
+        await communicator.send_json_to(message)
+        joined = await communicator.receive_json_from()
+        self.assertEqual(joined['type'], 'joined_groupbuy')
+        self.assertEqual(joined['stream'], f'groupbuy_{groupbuy_id}')
+        return communicator, joined['seq']
+
+    @override_settings(WS_REPLAY_BUFFER_SIZE=3)
+    async def test_reconnect_replays_missed_messages_or_requests_resync(self):
+        communicator, seq = await self.join_room(9001)
+        await communicator.disconnect()
+
+        for participants in (1, 2):
+            await sync_to_async(websocket_utils.send_groupbuy_update)(9001, {'current_participants': participants})
+
+        communicator, _ = await self.join_room(9001, last_seq=seq)
+        frames = [await communicator.receive_json_from() for _ in range(2)]
+        self.assertEqual([frame['seq'] for frame in frames], [seq + 1, seq + 2])
+        self.assertEqual([frame['data']['current_participants'] for frame in frames], [1, 2])
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+        for participants in (3, 4, 5):
+            await sync_to_async(websocket_utils.send_groupbuy_update)(9001, {'current_participants': participants})
+
+        communicator, _ = await self.join_room(9001, last_seq=seq)
+        frame = await communicator.receive_json_from()
+        self.assertEqual(frame['type'], 'resync')
+        self.assertEqual(frame['seq'], seq + 5)
+        await communicator.disconnect()
+
+    async def test_out_of_order_delivery_keeps_both_frames_replayable(self):
+        communicator, seq = await self.join_room(9002)
+        room = 'groupbuy_9002'
+        stamped = await sync_to_async(websocket_streams.stamp)([
+            websocket_utils.groupbuy_update_message(9002, {'current_participants': 1}),
+            websocket_utils.groupbuy_update_message(9002, {'current_participants': 2}),
+        ])
+        self.assertEqual([event['data']['seq'] for _, event in stamped], [seq + 1, seq + 2])
+
+        # 不同进程发出的消息可能乱序到达：N+1 先于 N
+        await websocket_utils.transmit(stamped[::-1])
+        received = [(await communicator.receive_json_from())['seq'] for _ in range(2)]
+        self.assertEqual(received, [seq + 2, seq + 1])
+        await communicator.disconnect()
+
+        # 客户端以连续收到的最大序号重连，两条都能补收
+        result = await sync_to_async(websocket_streams.replay)(room, seq)
+        self.assertFalse(result.resync)
+        self.assertEqual([frame['seq'] for frame in result.frames], [seq + 1, seq + 2])
+
+    async def test_notifications_socket_requires_valid_token(self):
+        user = await database_sync_to_async(User.objects.create)(username='buyer')
+
+        communicator = WebsocketCommunicator(application, '/ws/notifications/', headers=self.headers)
+        connected, _ = await communicator.connect()
+        self.assertFalse(connected)
+
+        token = str(AccessToken.for_user(user))
+        communicator = WebsocketCommunicator(application, f'/ws/notifications/?token={token}', headers=self.headers)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual((await communicator.receive_json_from())['type'], 'connection_established')
+        await communicator.disconnect()
+
+
+class FakeTimer:
+    """记录而不启动的定时器，由测试手动触发窗口结束"""
+
+    started = []
+
+    def __init__(self, interval, function):
+        self.interval, self.function, self.daemon = interval, function, False
+
+    def start(self):
+        FakeTimer.started.append(self)
+
+
+class GroupBuyBroadcasterTests(TestCase):
+    def setUp(self):
+        FakeTimer.started = []
+        patches = [
+            mock.patch('api.broadcaster.threading.Timer', FakeTimer),
+            # 定时线程结束时会关闭数据库连接，测试在主线程触发，不能关闭
+            mock.patch('api.broadcaster.connection'),
+            mock.patch('api.broadcaster.send_groupbuy_success'),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        push = mock.patch('api.broadcaster.push')
+        self.push = push.start()
+        self.addCleanup(push.stop)
+        self.broadcaster = broadcaster.GroupBuyBroadcaster(window_ms=100)
+        self.first, self.second = make_group_buy(target=10), make_group_buy(target=10)
+
+    def frames(self):
+        """每次 push 调用推送的 [(拼单id, 参团人数)]"""
+        return [
+            [(event['data']['groupbuy_id'], event['data']['data']['current_participants']) for _, event in call.args[0]]
+            for call in self.push.call_args_list
+        ]
+
+    def end_window(self):
+        timers, FakeTimer.started = FakeTimer.started, []
+        self.assertEqual(len(timers), 1)
+        self.assertEqual(timers[0].interval, 0.1)
+        timers[0].function()
+
+    def join(self, group_buy, participants):
+        GroupBuy.objects.filter(id=group_buy.id).update(current_participants=participants)
+        self.broadcaster.publish(group_buy.id)
+
+    def test_one_frame_per_group_buy_per_window(self):
+        for n in range(1, 4):
+            self.join(self.first, n)
+        self.join(self.second, 1)
+        self.join(self.second, 2)
+        self.push.assert_not_called()
+
+        self.end_window()
+        self.assertEqual(self.frames(), [[(self.first.id, 3), (self.second.id, 2)]])
+        self.assertEqual((self.broadcaster.published, self.broadcaster.sent), (5, 2))
+
+        # 下一个窗口重新计时
+        self.join(self.first, 4)
+        self.end_window()
+        self.assertEqual(self.frames()[-1], [(self.first.id, 4)])
+
+    def test_unchanged_snapshot_is_not_resent(self):
+        self.join(self.first, 1)
+        self.end_window()
+        self.broadcaster.publish(self.first.id)
+        self.end_window()
+        self.assertEqual(self.frames(), [[(self.first.id, 1)], []])
+        self.assertEqual(self.broadcaster.sent, 1)
+
+    def test_publish_now_sends_immediately_and_drops_pending(self):
+        self.join(self.first, 1)
+        self.join(self.second, 1)
+        GroupBuy.objects.filter(id=self.first.id).update(current_participants=10, status='successful')
+        self.broadcaster.publish_now((), success_ids=[self.first.id])
+        self.assertEqual(self.frames(), [[(self.first.id, 10)]])
+        broadcaster.send_groupbuy_success.assert_called_once_with(self.first.id, {'message': '拼单成功！'})
+
+        self.end_window()
+        self.assertEqual(self.frames()[-1], [(self.second.id, 1)])
+
+    def test_tracked_snapshots_are_bounded(self):
+        third = make_group_buy(target=10)
+        with mock.patch('api.broadcaster.MAX_TRACKED', 2):
+            for group_buy in (self.first, self.second, third):
+                self.broadcaster.publish(group_buy.id)
+            self.end_window()
+            self.assertEqual(len(self.broadcaster._last_sent), 3)
+
+            # 超过上限后清空记录，未变化的快照也会重新推送一次
+            self.broadcaster.publish(self.first.id)
+            self.end_window()
+            self.assertEqual(self.frames()[-1], [(self.first.id, 0)])
+            self.assertEqual(len(self.broadcaster._last_sent), 1)
+
+    def test_zero_window_sends_directly(self):
+        direct = broadcaster.GroupBuyBroadcaster(window_ms=0)
+        GroupBuy.objects.filter(id=self.first.id).update(current_participants=1)
+        direct.publish(self.first.id)
+        direct.publish(self.first.id)
+        self.assertEqual(FakeTimer.started, [])
+        self.assertEqual(self.frames(), [[(self.first.id, 1)], []])
+
+
+class PostCommitPushTests(TestCase):
+    def setUp(self):
+        self.sent = []
+        sent = self.sent
+
+        class RecordingLayer:
+            async def group_send(self, group, event):
+                sent.append((group, event['type']))
+
+        original = websocket_utils.channel_layer
+        websocket_utils.channel_layer = RecordingLayer()
+        self.addCleanup(setattr, websocket_utils, 'channel_layer', original)
+
+    def test_pushes_are_sent_after_commit_and_dropped_on_rollback(self):
+        user = User.objects.create(username='buyer')
+        with self.captureOnCommitCallbacks(execute=True):
+            websocket_utils.send_order_update(user.id, 10, 'paid')
+            try:
+                with transaction.atomic():
+                    websocket_utils.send_order_update(user.id, 11, 'paid')
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+            websocket_utils.send_groupbuy_success(5, {})
+            self.assertEqual(self.sent, [])
+
+        self.assertEqual(self.sent, [
+            (f'user_{user.id}', 'order_update'),
+            ('groupbuy_5', 'groupbuy_success'),
+            ('groupbuy_groupbuy_updates', 'groupbuy_success'),
+        ])
+
+
+class NotificationInboxTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='buyer')
+        self.other = User.objects.create(username='other')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def notify(self, updates):
+        websocket_utils.send_order_updates(updates)
+
+    def test_push_helpers_persist_notifications_and_count_unread(self):
+        self.notify([(self.user.id, order_id, 'paid', None) for order_id in (1, 2, 3)] + [(self.other.id, 4, 'paid', None)])
+        self.assertEqual(Notification.objects.filter(user=self.user).count(), 3)
+
+        self.client.get('/api/me/notifications/unread-count/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/me/notifications/unread-count/')
+        self.assertEqual(response.data['unread_count'], 3)
+
+        # 新通知在提交后原子地累加到已缓存的计数器
+        self.notify([(self.user.id, 5, 'paid', None)])
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/me/notifications/unread-count/')
+        self.assertEqual(response.data['unread_count'], 4)
+
+    def test_cold_fill_racing_a_commit_does_not_cache_a_stale_count(self):
+        self.notify([(self.user.id, 1, 'paid', None)])
+        stored_count = notifications._stored_count
+        reads = []
+
+        def read_then_commit(user_id):
+            count = stored_count(user_id)
+            if not reads:
+                # 读取用户行后、回填缓存前，另一个请求提交了新通知（incr 落空）
+                notifications.record([(self.user.id, 'order_update', {'order_id': 2})])
+            reads.append(count)
+            return count
+
+        with mock.patch.object(notifications, '_stored_count', side_effect=read_then_commit):
+            self.assertEqual(notifications.unread_count(self.user.id), 2)
+        self.assertEqual(reads, [1, 2])
+        self.assertEqual(notifications.unread_count(self.user.id), 2)
+
+    def test_list_pages_by_id_and_bulk_mark_read(self):
+        self.notify([(self.user.id, order_id, 'paid', None) for order_id in range(1, 6)])
+        response = self.client.get('/api/me/notifications/', {'page_size': 3})
+        self.assertEqual([n['data']['order_id'] for n in response.data['results']], [5, 4, 3])
+        self.assertEqual(response.data['unread_count'], 5)
+        response = self.client.get('/api/me/notifications/', {'page_size': 3, 'before_id': response.data['next_before_id']})
+        self.assertEqual([n['data']['order_id'] for n in response.data['results']], [2, 1])
+        self.assertIsNone(response.data['next_before_id'])
+
+        ids = [n['id'] for n in response.data['results']]
+        response = self.client.post('/api/me/notifications/read/', {'ids': ids + ids}, format='json')
+        self.assertEqual(response.data['updated'], 2)
+        self.assertEqual(response.data['unread_count'], 3)
+
+        response = self.client.post('/api/me/notifications/read/', {'all': True}, format='json')
+        self.assertEqual(response.data, {'updated': 3, 'unread_count': 0})
+        self.assertEqual(self.client.get('/api/me/notifications/', {'unread': '1'}).data['results'], [])
+
+        response = self.client.post('/api/me/notifications/read/', {'ids': 'x'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_ids_are_fetched_when_bulk_insert_returns_none(self):
+        self.notify([(self.user.id, 1, 'paid', None)])
+        batch = [(self.user.id, 'order_update', {'order_id': n}) for n in (2, 3)] + [
+            (self.other.id, 'order_update', {'order_id': 4}), (self.user.id, 'order_update', {'order_id': 5}),
+        ]
+        # 模拟 MySQL：批量插入不回填主键
+        with mock.patch.object(
+            type(connection.features), 'can_return_rows_from_bulk_insert', new_callable=mock.PropertyMock,
+            return_value=False,
+        ):
+            rows = notifications.record(batch)
+        stored = dict(Notification.objects.values_list('id', 'data__order_id'))
+        self.assertEqual([stored[row.id] for row in rows], [2, 3, 4, 5])
+        self.assertEqual([row.user_id for row in rows], [Notification.objects.get(id=row.id).user_id for row in rows])
+
+
+class PaymentInboxTests(TestCase):
+    def test_failing_callback_does_not_block_the_rest_of_the_batch(self):
+        group_buy = make_group_buy(target=10)
+        orders = [make_order(group_buy) for _ in range(3)]
+        for order in orders:
+            payment_inbox.ingest('wechat', f'GB{order.id}_1', True, {})
+        bad_id = orders[1].id
+
+        def convert(order_ids):
+            if bad_id in order_ids:
+                raise RuntimeError('预留转换失败')
+            return 0
+
+        with mock.patch('api.services.payment_inbox.convert_reservations', side_effect=convert), \
+                self.assertLogs('api.services.payment_inbox', 'ERROR'):
+            report = payment_inbox.process_pending(batch_size=10)
+
+        self.assertEqual((report.processed, report.failed), (2, 1))
+        statuses = dict(Order.objects.values_list('id', 'payment_status'))
+        self.assertEqual([statuses[order.id] for order in orders], ['paid', 'pending', 'paid'])
+        failed = PaymentCallback.objects.get(order_id=bad_id)
+        self.assertEqual((failed.status, failed.error), ('failed', '预留转换失败'))
+        # 出错的回调不再停留在 pending，下一轮不会重复处理
+        self.assertEqual(payment_inbox.process_pending(batch_size=10).processed, 0)
+
+
+class WaitingRoomTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='buyer')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_missing_or_closed_group_buy_gets_the_engine_error(self):
+        response = self.client.post('/api/group-buys/999999/join/', {'quantity': 1}, format='json')
+        self.assertEqual(response.status_code, 404)
+        closed = make_group_buy(status='failed')
+        response = self.client.post(f'/api/group-buys/{closed.id}/join/', {'quantity': 1}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], '该拼单已结束或取消')
+        response = self.client.post(f'/api/group-buys/{closed.id}/queue/', {'quantity': 1}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_resync_does_not_reissue_held_admissions(self):
+        group_buy = make_group_buy(target=3)
+        with mock.patch('api.services.waiting_room.send_queue_position') as push_position:
+            first = waiting_room.enter(group_buy.id, self.user.id, 2)
+            self.assertTrue(first.admitted)
+            push_position.assert_called_once_with(self.user.id, group_buy.id, first.as_dict())
+
+            # 计数器过期后从数据库重新同步，已发放的 2 个名额不能再次发放
+            cache.delete(f'waiting_room:{group_buy.id}:slots')
+            self.assertFalse(waiting_room.enter(group_buy.id, self.user.id + 1, 2).admitted)
+            self.assertTrue(waiting_room.enter(group_buy.id, self.user.id + 2, 1).admitted)
+
+
+class LedgerTests(TestCase):
+    def setUp(self):
+        self.group_buy = make_group_buy()
+        self.orders = [make_order(self.group_buy, quantity=2) for _ in range(3)]
+
+    def earnings(self):
+        row = LeaderMonthlyEarnings.objects.get(leader=self.group_buy.leader)
+        return row.order_count, row.sales_amount, row.settled_count, row.settled_amount
+
+    def test_transitions_keep_monthly_earnings_in_sync(self):
+        ids = [order.id for order in self.orders]
+        self.assertEqual(ledger.transition_orders(Order.objects.filter(id__in=ids), 'successful'), 3)
+        self.assertEqual(self.earnings(), (3, Decimal('60.00'), 0, Decimal('0')))
+
+        # 已是目标状态的订单不重复计入
+        ledger.transition_orders(Order.objects.filter(id__in=ids[:2]), 'successful')
+        self.assertEqual(self.earnings(), (3, Decimal('60.00'), 0, Decimal('0')))
+
+        ledger.set_order_status(Order.objects.get(id=ids[0]), 'completed')
+        self.assertEqual(self.earnings(), (3, Decimal('60.00'), 1, Decimal('20.00')))
+
+        ledger.transition_orders(Order.objects.filter(id__in=ids), 'canceled')
+        self.assertEqual(self.earnings(), (0, Decimal('0'), 0, Decimal('0')))
+        self.group_buy.leader.refresh_from_db()
+        self.assertEqual(self.group_buy.leader.total_commission, Decimal('0'))
+
+    def test_set_order_status_uses_current_row_status_not_stale_instance(self):
+        stale = Order.objects.get(id=self.orders[0].id)
+        ledger.transition_orders(Order.objects.filter(id=stale.id), 'successful')
+        self.assertEqual(self.earnings()[0], 1)
+
+        # stale.status 仍是 awaiting_group_success，撤销应按数据库中的 successful 扣回
+        ledger.set_order_status(stale, 'canceled')
+        self.assertEqual(self.earnings()[:2], (0, Decimal('0')))
+
+
+class MembershipTierTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        membership.clear_tier_cache()
+        self.silver = MembershipTier.objects.create(tier_name='白银', discount_percentage=Decimal('2'), points_required=100)
+        self.gold = MembershipTier.objects.create(tier_name='黄金', discount_percentage=Decimal('5'), points_required=500)
+
+    def test_tier_resolution_at_and_just_under_each_threshold(self):
+        self.assertIsNone(membership.tier_id_for_points(0))
+        self.assertIsNone(membership.tier_id_for_points(99))
+        self.assertEqual(membership.tier_id_for_points(100), self.silver.id)
+        self.assertEqual(membership.tier_id_for_points(499), self.silver.id)
+        self.assertEqual(membership.tier_id_for_points(500), self.gold.id)
+
+    def test_accrue_loyalty_promotes_exactly_at_thresholds(self):
+        user = User.objects.create(username='buyer')
+        expected = [(99, None), (1, self.silver.id), (399, self.silver.id), (1, self.gold.id)]
+        for points, tier_id in expected:
+            membership.accrue_loyalty(user, points)
+            self.assertEqual(user.membership_tier_id, tier_id)
+        user.refresh_from_db()
+        self.assertEqual((user.loyalty_points, user.membership_tier_id), (500, self.gold.id))
+
+    def test_accrue_loyalty_adds_to_the_stored_points_in_one_update(self):
+        user = User.objects.create(username='buyer')
+        membership.tier_id_for_points(0)
+        # 并发完成的订单已写入积分，内存中的 user 仍是旧值
+        User.objects.filter(pk=user.pk).update(loyalty_points=450)
+        with CaptureQueriesContext(connection) as queries:
+            membership.accrue_loyalty(user, 60)
+        self.assertEqual([q['sql'].split()[0] for q in queries], ['UPDATE', 'SELECT'])
+        self.assertEqual((user.loyalty_points, user.membership_tier_id), (510, self.gold.id))
+
+    def test_retier_users_in_chunks_with_dry_run(self):
+        users = {
+            points: User.objects.create(username=f'u{points}', loyalty_points=points, membership_tier=tier)
+            for points, tier in [(0, self.gold), (100, self.silver), (150, None), (499, self.gold), (600, self.silver)]
+        }
+
+        report = membership.retier_users(chunk_size=2, dry_run=True)
+        self.assertEqual((report.users, report.changed, report.chunks), (5, 4, 3))
+        self.assertEqual(report.transitions, {
+            (self.gold.id, None): 1,
+            (None, self.silver.id): 1,
+            (self.gold.id, self.silver.id): 1,
+            (self.silver.id, self.gold.id): 1,
+        })
+        self.assertEqual(User.objects.get(id=users[0].id).membership_tier_id, self.gold.id)
+
+        out = StringIO()
+        call_command('retier_users', '--chunk-size', '2', stdout=out)
+        self.assertIn('已调整 4 名用户的等级', out.getvalue())
+        tiers = dict(User.objects.values_list('loyalty_points', 'membership_tier_id'))
+        self.assertEqual(tiers, {0: None, 100: self.silver.id, 150: self.silver.id, 499: self.silver.id, 600: self.gold.id})
+
+
+class ReservationSweeperTests(TestCase):
+    def test_expired_hold_is_released_exactly_once(self):
+        group_buy = make_group_buy(target=10, stock=20)
+        buyer = User.objects.create(username='buyer')
+        unpaid = join_group_buy(buyer, group_buy.id, 3).order
+        paid = join_group_buy(User.objects.create(username='payer'), group_buy.id, 2).order
+        Order.objects.filter(id=paid.id).update(payment_status='paid')
+        later = timezone.now() + reservations.reservation_ttl() + timedelta(minutes=1)
+        # 另一个清理任务在第一个提交前读到的同一批预留
+        stale_rows = list(
+            StockReservation.objects.filter(status='held').order_by('id')
+            .values_list('id', 'order_id', 'product_id', 'quantity')
+        )
+
+        report = reservations.release_expired_reservations(now=later)
+        self.assertEqual((report.released, report.converted, report.orders_canceled, report.units_restocked), (1, 1, 1, 3))
+        reservations._release_batch(stale_rows, reservations.ReleaseReport())
+        again = reservations.release_expired_reservations(now=later)
+        self.assertEqual((again.released, again.units_restocked), (0, 0))
+
+        group_buy.refresh_from_db()
+        group_buy.product.refresh_from_db()
+        self.assertEqual(group_buy.current_participants, 2)
+        self.assertEqual(group_buy.product.stock_quantity, 18)
+        self.assertEqual(Order.objects.get(id=unpaid.id).status, 'canceled')
+        self.assertEqual(Order.objects.get(id=paid.id).status, 'awaiting_group_success')
+
+    def test_orders_are_locked_before_reservations(self):
+        group_buy = make_group_buy(target=10, stock=20)
+        join_group_buy(User.objects.create(username='buyer'), group_buy.id, 1)
+        later = timezone.now() + reservations.reservation_ttl() + timedelta(minutes=1)
+        rows = list(StockReservation.objects.values_list('id', 'order_id', 'product_id', 'quantity'))
+        with CaptureQueriesContext(connection) as queries:
+            reservations._release_batch(rows, reservations.ReleaseReport())
+        selects = [q['sql'] for q in queries if q['sql'].startswith('SELECT')]
+        self.assertIn('FROM "api_order"', selects[0])
+        self.assertIn('FROM "api_stockreservation"', selects[1])
+        self.assertEqual(reservations.release_expired_reservations(now=later).released, 0)
+
+
+class JoinGroupBuyTests(TestCase):
+    def setUp(self):
+        self.group_buy = make_group_buy(target=3, stock=10)
+        self.product = self.group_buy.product
+
+    def buyer(self):
+        return User.objects.create(username=f'buyer{User.objects.count()}')
+
+    def assert_counts(self, participants, stock):
+        self.group_buy.refresh_from_db()
+        self.product.refresh_from_db()
+        self.assertEqual((self.group_buy.current_participants, self.product.stock_quantity), (participants, stock))
+
+    def test_last_slot_completes_group_and_extra_quantity_is_refused(self):
+        join_group_buy(self.buyer(), self.group_buy.id, 2)
+        with self.assertRaises(JoinError) as raised:
+            join_group_buy(self.buyer(), self.group_buy.id, 2)
+        self.assertEqual(raised.exception.extra['remaining_slots'], 1)
+        self.assert_counts(2, 8)
+
+        result = join_group_buy(self.buyer(), self.group_buy.id, 1)
+        self.assertTrue(result.group_buy_successful)
+        self.assert_counts(3, 7)
+        self.assertEqual(set(Order.objects.values_list('status', flat=True)), {'successful'})
+
+        with self.assertRaises(JoinError):
+            join_group_buy(self.buyer(), self.group_buy.id, 1)
+        self.assert_counts(3, 7)
+
+    def test_oversell_is_refused_without_taking_a_slot(self):
+        Product.objects.filter(id=self.product.id).update(stock_quantity=1)
+        with self.assertRaises(JoinError) as raised:
+            join_group_buy(self.buyer(), self.group_buy.id, 2)
+        self.assertEqual(raised.exception.message, '库存不足')
+        self.assert_counts(0, 1)
+
+        # 无锁预检通过后库存才被抢光：条件扣减失败，已预占的名额退回
+        with mock.patch('api.services.join.check_joinable'):
+            with self.assertRaises(JoinError):
+                join_group_buy(self.buyer(), self.group_buy.id, 2)
+        self.assert_counts(0, 1)
+
+    def test_failed_order_creation_returns_slots_and_stock(self):
+        with mock.patch('api.services.join.hold_stock', side_effect=RuntimeError('写入失败')):
+            with self.assertRaises(RuntimeError):
+                join_group_buy(self.buyer(), self.group_buy.id, 2)
+        self.assert_counts(0, 10)
+        self.assertFalse(Order.objects.exists())
+
+
+class CheckoutTests(TestCase):
+    url = '/api/orders/checkout/'
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='buyer')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def post(self, *lines):
+        items = [{'group_buy_id': gb_id, 'quantity': qty} for gb_id, qty in lines]
+        return self.client.post(self.url, {'items': items}, format='json')
+
+    def counts(self, group_buy):
+        group_buy.refresh_from_db()
+        group_buy.product.refresh_from_db()
+        return group_buy.current_participants, group_buy.product.stock_quantity
+
+    def test_mixed_cart_orders_valid_lines_and_flips_full_group(self):
+        partial = make_group_buy(target=5, stock=10)
+        filling = make_group_buy(target=2, stock=10)
+        canceled = make_group_buy(target=5, stock=10, status='canceled')
+
+        response = self.post((partial.id, 2), (filling.id, 2), (canceled.id, 1), (999999, 1))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data['succeeded'], response.data['failed']), (2, 2))
+        results = response.data['results']
+        self.assertEqual([r['success'] for r in results], [True, True, False, False])
+        self.assertEqual([r['group_buy_successful'] for r in results[:2]], [False, True])
+        self.assertEqual(results[3]['error'], '拼单不存在')
+
+        self.assertEqual(self.counts(partial), (2, 8))
+        self.assertEqual(self.counts(filling), (2, 8))
+        self.assertEqual(self.counts(canceled), (0, 10))
+        filling.refresh_from_db()
+        self.assertEqual(filling.status, 'successful')
+        orders = {o.group_buy_id: o for o in Order.objects.all()}
+        self.assertEqual(set(orders), {partial.id, filling.id})
+        self.assertEqual(orders[partial.id].status, 'awaiting_group_success')
+        self.assertEqual(orders[filling.id].status, 'successful')
+        self.assertEqual(OrderItem.objects.filter(order__in=orders.values()).count(), 2)
+        self.assertEqual(
+            dict(StockReservation.objects.values_list('order__group_buy_id', 'status')),
+            {partial.id: 'held', filling.id: 'converted'},
+        )
+
+    def test_lines_on_the_same_product_share_its_stock(self):
+        first = make_group_buy(target=5, stock=3)
+        second = GroupBuy.objects.create(
+            product=first.product, leader=first.leader, target_participants=5, status='active',
+            start_time=first.start_time, end_time=first.end_time,
+        )
+        response = self.post((first.id, 2), (second.id, 2))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['results'][1]['error'], '库存不足')
+        self.assertEqual(self.counts(first), (2, 1))
+        self.assertEqual(self.counts(second), (0, 1))
+
+    def test_fully_failed_cart_returns_400(self):
+        full = make_group_buy(target=1, stock=10)
+        full.current_participants = 1
+        full.save()
+        no_stock = make_group_buy(target=5, stock=0)
+
+        response = self.post((full.id, 1), (no_stock.id, 1))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], '所选拼单均无法参加')
+        self.assertEqual((response.data['succeeded'], response.data['failed']), (0, 2))
+        self.assertEqual(response.data['results'][0]['remaining_slots'], 0)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(self.counts(full), (1, 10))
+        self.assertEqual(self.counts(no_stock), (0, 0))
+
+    def test_failure_while_creating_orders_rolls_back_slots_and_stock(self):
+        first, second = make_group_buy(target=5, stock=10), make_group_buy(target=5, stock=10)
+        with mock.patch('api.services.checkout.hold_stock_many', side_effect=RuntimeError('写入失败')):
+            with self.assertLogs('api.views.user', 'ERROR'):
+                response = self.post((first.id, 2), (second.id, 3))
+        self.assertEqual(response.status_code, 500)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(self.counts(first), (0, 10))
+        self.assertEqual(self.counts(second), (0, 10))
+
+    def test_group_buys_are_locked_before_products_in_id_order(self):
+        group_buys = [make_group_buy(target=5, stock=10) for _ in range(3)]
+        with CaptureQueriesContext(connection) as queries:
+            checkout(self.user, {gb.id: 1 for gb in reversed(group_buys)})
+        selects = [q['sql'] for q in queries if q['sql'].startswith('SELECT')]
+        locked_group_buys = next(i for i, sql in enumerate(selects) if 'FROM "api_groupbuy"' in sql)
+        locked_products = next(i for i, sql in enumerate(selects) if 'FROM "api_product"' in sql)
+        self.assertLess(locked_group_buys, locked_products)
+        self.assertIn('ORDER BY "api_groupbuy"."id" ASC', selects[locked_group_buys])
+        self.assertIn('ORDER BY "api_product"."id" ASC', selects[locked_products])
+
+    def test_bulk_insert_without_returned_ids_fetches_them_in_one_query(self):
+        group_buys = [make_group_buy(target=5, stock=10) for _ in range(3)]
+        earlier = make_order(group_buys[0], user=self.user)
+        # 模拟 MySQL：批量插入不回填主键
+        with mock.patch.object(
+            type(connection.features), 'can_return_rows_from_bulk_insert', new_callable=mock.PropertyMock,
+            return_value=False,
+        ):
+            with CaptureQueriesContext(connection) as queries:
+                result = checkout(self.user, {gb.id: 1 for gb in group_buys})
+        order_inserts = [q for q in queries if q['sql'].startswith('INSERT INTO "api_order" ')]
+        self.assertEqual(len(order_inserts), 1)
+
+        orders = [line.order for line in result.lines]
+        self.assertNotIn(earlier.id, [o.id for o in orders])
+        for group_buy, order in zip(group_buys, orders):
+            self.assertEqual(Order.objects.get(id=order.id).group_buy_id, group_buy.id)
+            self.assertEqual(OrderItem.objects.get(order=order).quantity, 1)
+            self.assertEqual(StockReservation.objects.get(order=order).product_id, group_buy.product_id)
+
+
+@override_settings(STOCK_COUNTERS_ENABLED=True, STOCK_COUNTER_SHARDS=4)
+class StockCounterTests(TestCase):
+    def setUp(self):
+        stock_counters.set_backend(stock_counters.InProcessStockBackend())
+        self.addCleanup(stock_counters.set_backend, None)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product = Product.objects.create(name='苹果', price=Decimal('10.00'), stock_quantity=10)
+
+    def db_stock(self):
+        self.product.refresh_from_db()
+        return self.product.stock_quantity
+
+    def test_oversell_is_refused_across_shards(self):
+        self.assertTrue(stock_counters.take(self.product.id, 7))
+        self.assertFalse(stock_counters.take(self.product.id, 4))
+        self.assertEqual(stock_counters.available(self.product.id), 3)
+        self.assertTrue(stock_counters.take(self.product.id, 3))
+        self.assertFalse(stock_counters.take(self.product.id, 1))
+        self.assertEqual(stock_counters.get_backend().values(self.product.id), [0, 0, 0, 0])
+
+    def test_flush_writes_net_deltas_back(self):
+        stock_counters.take(self.product.id, 3)
+        with self.captureOnCommitCallbacks(execute=True):
+            stock_counters.give(self.product.id, 1)
+        self.assertEqual(self.db_stock(), 10)
+
+        report = stock_counters.flush()
+        self.assertEqual((report.products, report.net_units, report.batches), (1, -2, 1))
+        self.assertEqual(self.db_stock(), 8)
+        self.assertEqual(stock_counters.get_backend().pending(self.product.id), 0)
+        self.assertEqual(stock_counters.flush().batches, 0)
+
+    def test_admin_stock_edit_keeps_unflushed_deltas(self):
+        stock_counters.take(self.product.id, 2)
+        product = Product.objects.get(id=self.product.id)
+        product.stock_quantity = 20
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        self.assertEqual(stock_counters.available(self.product.id), 18)
+
+        stock_counters.flush()
+        self.assertEqual(self.db_stock(), 18)
+        self.assertEqual(stock_counters.reconcile(), [])
+
+    def test_rolled_back_takes_are_returned(self):
+        with self.assertRaises(RuntimeError):
+            with stock_counters.atomic():
+                self.assertTrue(stock_counters.take(self.product.id, 4))
+                with stock_counters.atomic():
+                    self.assertTrue(stock_counters.take(self.product.id, 2))
+                raise RuntimeError('回滚')
+        self.assertEqual(stock_counters.available(self.product.id), 10)
+
+        # 只回滚内层保存点：只归还内层的扣减
+        with stock_counters.atomic():
+            stock_counters.take(self.product.id, 4)
+            with self.assertRaises(RuntimeError):
+                with stock_counters.atomic():
+                    stock_counters.take(self.product.id, 2)
+                    raise RuntimeError('回滚')
+        self.assertEqual(stock_counters.available(self.product.id), 6)
+
+    def test_restock_in_a_rolled_back_chunk_leaves_the_counter_unchanged(self):
+        group_buy = make_group_buy(target=5, stock=10, end_time=timezone.now() - timedelta(minutes=1))
+        group_buy.product = self.product
+        group_buy.save()
+        join_group_buy(User.objects.create(username='buyer'), group_buy.id, 3)
+        self.assertEqual(stock_counters.available(self.product.id), 7)
+
+        with mock.patch('api.services.finalization.release_reservations', side_effect=RuntimeError('写入失败')):
+            with self.captureOnCommitCallbacks(execute=True):
+                with self.assertRaises(RuntimeError):
+                    finalization.finalize_due_group_buys()
+        self.assertEqual(stock_counters.available(self.product.id), 7)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            finalization.finalize_due_group_buys()
+        self.assertEqual(stock_counters.available(self.product.id), 10)
+
+    def test_failed_checkout_returns_counter_stock(self):
+        group_buy = make_group_buy(target=5)
+        group_buy.product = self.product
+        group_buy.save()
+        with mock.patch('api.services.checkout.hold_stock_many', side_effect=RuntimeError('写入失败')):
+            with self.assertRaises(RuntimeError):
+                checkout(User.objects.create(username='buyer'), {group_buy.id: 3})
+        self.assertEqual(stock_counters.available(self.product.id), 10)
+
+    def test_reconcile_reports_and_fixes_drift(self):
+        stock_counters.take(self.product.id, 2)
+        self.assertEqual(stock_counters.reconcile(), [])
+
+        # 绕过计数器直接改库
+        Product.objects.filter(id=self.product.id).update(stock_quantity=5)
+        out = StringIO()
+        call_command('reconcile_stock_counters', stdout=out)
+        self.assertIn('偏差 +5', out.getvalue())
+        self.assertEqual(stock_counters.available(self.product.id), 8)
+
+        call_command('reconcile_stock_counters', '--fix', stdout=StringIO())
+        self.assertEqual(self.db_stock(), 3)
+        self.assertEqual(stock_counters.available(self.product.id), 3)
+        self.assertEqual(stock_counters.reconcile(), [])
+
+
+class GroupSuccessTests(TestCase):
+    def setUp(self):
+        self.group_buy = make_group_buy(target=2)
+        self.orders = [make_order(self.group_buy) for _ in range(2)]
+        for order in self.orders:
+            reservations.hold_stock(order, self.group_buy.product_id, order.quantity)
+
+    def pay(self, *orders):
+        Order.objects.filter(id__in=[o.id for o in orders]).update(payment_status='paid')
+
+    def complete(self):
+        with mock.patch('api.services.group_success.notify_group_success') as notify:
+            with self.captureOnCommitCallbacks(execute=True):
+                completed = group_success.complete_if_paid(self.group_buy.id)
+        return completed, notify
+
+    def test_not_all_orders_paid_is_a_no_op(self):
+        self.pay(self.orders[0])
+        completed, notify = self.complete()
+        self.assertFalse(completed)
+        notify.assert_not_called()
+        self.group_buy.refresh_from_db()
+        self.assertEqual(self.group_buy.status, 'active')
+        self.assertEqual(set(Order.objects.values_list('status', flat=True)), {'awaiting_group_success'})
+        self.assertEqual(set(StockReservation.objects.values_list('status', flat=True)), {'held'})
+
+    def test_paid_target_flips_group_and_paid_orders(self):
+        self.pay(*self.orders)
+        completed, notify = self.complete()
+        self.assertTrue(completed)
+        self.group_buy.refresh_from_db()
+        self.assertEqual(self.group_buy.status, 'successful')
+        self.assertEqual(set(Order.objects.values_list('status', flat=True)), {'successful'})
+        self.assertEqual(set(StockReservation.objects.values_list('status', flat=True)), {'converted'})
+        notify.assert_called_once()
+        self.assertEqual(
+            sorted(notify.call_args.args[1]), sorted((o.user_id, o.id) for o in self.orders),
+        )
+
+    def test_second_call_is_idempotent(self):
+        self.pay(*self.orders)
+        self.assertTrue(self.complete()[0])
+        completed, notify = self.complete()
+        self.assertFalse(completed)
+        notify.assert_not_called()
+
+    def test_mock_payment_reports_transition_without_recounting(self):
+        self.pay(self.orders[0])
+        client = APIClient()
+        client.force_authenticate(self.orders[1].user)
+        with mock.patch('api.services.group_success.notify_group_success'):
+            response = client.post('/api/payment/mock-success/', {'order_id': self.orders[1].id}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['groupbuy_success'])
+        self.assertEqual(response.data['groupbuy_participants'], '2/2')
+
+
+class FinalizationTests(TestCase):
+    def join(self, group_buy, *quantities):
+        for quantity in quantities:
+            join_group_buy(User.objects.create(username=f'buyer{User.objects.count()}'), group_buy.id, quantity)
+
+    def test_mixed_due_group_buys_across_chunks(self):
+        succeeded = make_group_buy(target=3, stock=10)
+        failed = make_group_buy(target=5, stock=10)
+        failed_too = make_group_buy(target=5, stock=10)
+        not_due = make_group_buy(target=5, stock=10)
+        self.join(succeeded, 1)
+        self.join(failed, 2, 1)
+        self.join(failed_too, 2)
+        self.join(not_due, 1)
+        GroupBuy.objects.filter(id=succeeded.id).update(target_participants=1)
+        GroupBuy.objects.exclude(id=not_due.id).update(end_time=timezone.now() - timedelta(minutes=1))
+
+        report = finalization.finalize_due_group_buys(chunk_size=2)
+        self.assertEqual(report.chunks, 2)
+        self.assertEqual((report.successful, report.failed), (1, 2))
+        self.assertEqual((report.orders_succeeded, report.orders_canceled), (1, 3))
+        self.assertEqual((report.products_restocked, report.units_restocked), (2, 5))
+
+        statuses = dict(GroupBuy.objects.values_list('id', 'status'))
+        self.assertEqual(
+            [statuses[gb.id] for gb in (succeeded, failed, failed_too, not_due)],
+            ['successful', 'failed', 'failed', 'active'],
+        )
+        stock = dict(Product.objects.values_list('id', 'stock_quantity'))
+        self.assertEqual(
+            [stock[gb.product_id] for gb in (succeeded, failed, failed_too, not_due)],
+            [9, 10, 10, 9],
+        )
+        self.assertEqual(
+            dict(StockReservation.objects.values('status').annotate(n=Count('id')).values_list('status', 'n')),
+            {'converted': 1, 'released': 3, 'held': 1},
+        )
+        self.assertFalse(Order.objects.filter(group_buy__in=[failed, failed_too]).exclude(status='canceled').exists())
+
+        # 再次运行不会重复退款或回补
+        self.assertEqual(finalization.finalize_due_group_buys(chunk_size=2).processed, 0)
+
+
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.group_buy = make_group_buy(target=10)
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username='buyer'))
+        self.url = f'/api/group-buys/{self.group_buy.id}/join/'
+
+    def post(self, quantity=1, key='key-1'):
+        return self.client.post(self.url, {'quantity': quantity}, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_same_key_replays_the_saved_response(self):
+        first = self.post()
+        second = self.post()
+        self.assertEqual((first.status_code, second.status_code), (201, 201))
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.count(), 1)
+
+        # 不同的键照常执行
+        self.assertNotEqual(self.post(key='key-2').data['order_id'], first.data['order_id'])
+
+    def test_same_key_with_different_body_is_rejected(self):
+        self.post(quantity=1)
+        response = self.post(quantity=2)
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_concurrent_request_with_same_key_gets_409(self):
+        concurrent = []
+
+        def join_while_retrying(user, group_buy_id, quantity):
+            # 首个请求仍在处理时，客户端用同一个键重试
+            concurrent.append(self.post())
+            return join_group_buy(user, group_buy_id, quantity)
+
+        with mock.patch('api.views.user.join_group_buy', side_effect=join_while_retrying):
+            self.assertEqual(self.post().status_code, 201)
+        self.assertEqual(concurrent[0].status_code, 409)
+        self.assertEqual(concurrent[0]['Retry-After'], '1')
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_process_local_cache_is_reported_by_deploy_check(self):
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.assertEqual([w.id for w in checks.check_shared_cache(None)], ['api.W001'])
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache'}}):
+            self.assertEqual(checks.check_shared_cache(None), [])
+
+
+class ResponseCacheTests(TestCase):
+    url = '/api/leaders/featured/'
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.leader = User.objects.create(username='leader', role='leader', leader_status='approved')
+            self.client.force_authenticate(User.objects.create(username='buyer'))
+
+    def get(self):
+        response = self.client.get(self.url)
+        return response['X-Cache'], [leader['name'] for leader in response.data]
+
+    def test_hits_and_misses_are_counted(self):
+        caching.reset_cache_stats()
+        self.assertEqual(self.get(), ('MISS', ['leader']))
+        self.assertEqual(self.get(), ('HIT', ['leader']))
+        stats = caching.cache_stats()['featured_leaders']
+        self.assertEqual((stats['hits'], stats['misses'], stats['hit_rate']), (1, 1, 0.5))
+
+    def test_approving_a_leader_invalidates_featured_leaders(self):
+        self.get()
+        applicant = User.objects.create(username='applicant', leader_status='pending')
+        # 事务提交前不失效
+        self.assertEqual(self.get(), ('HIT', ['leader']))
+
+        applicant.role, applicant.leader_status = 'leader', 'approved'
+        with self.captureOnCommitCallbacks(execute=True):
+            applicant.save()
+        status, names = self.get()
+        self.assertEqual((status, sorted(names)), ('MISS', ['applicant', 'leader']))
+
+        # 登录只更新 last_login，不失效
+        with self.captureOnCommitCallbacks(execute=True):
+            self.leader.last_login = timezone.now()
+            self.leader.save(update_fields=['last_login'])
+        self.assertEqual(self.get()[0], 'HIT')
+
+    def test_commission_sync_invalidates_featured_leaders(self):
+        self.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            ledger.sync_total_commission([self.leader.id])
+        self.assertEqual(self.get()[0], 'MISS')
+
+    def test_error_fallback_is_not_cached(self):
+        with mock.patch.object(User.objects, 'filter', side_effect=RuntimeError('数据库不可用')):
+            self.assertEqual(self.get(), ('MISS', []))
+        self.assertEqual(self.get(), ('MISS', ['leader']))
+        self.assertEqual(self.get(), ('HIT', ['leader']))
+
+
+class StubAdapter(BaseAdapter):
+    """按顺序返回预设响应（(状态码, 数据)）或抛出预设异常的传输适配器"""
+
+    def __init__(self, *outcomes):
+        super().__init__()
+        self.outcomes = list(outcomes)
+        self.requests = []
+
+    def send(self, request, **kwargs):
+        self.requests.append(request)
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        response = requests.Response()
+        response.status_code, response._content = outcome[0], json.dumps(outcome[1]).encode()
+        response.request, response.url = request, request.url
+        return response
+
+    def close(self):
+        pass
+
+
+class PaymentGatewayTests(SimpleTestCase):
+    base_url = 'http://gateway.test'
+
+    def setUp(self):
+        self.now = 0.0
+        self.breaker = payment_gateway.CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=lambda: self.now)
+
+    def client_with(self, *outcomes):
+        client = payment_gateway.PaymentGatewayClient(self.base_url, breaker=self.breaker)
+        adapter = StubAdapter(*outcomes)
+        client.session.mount('http://', adapter)
+        return client, adapter
+
+    def create(self, client):
+        return client.alipay_create('T1', Decimal('9.90'), '苹果')
+
+    def test_breaker_opens_at_failure_threshold(self):
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, 'closed')
+        self.breaker.before_call()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, 'open')
+        with self.assertRaises(payment_gateway.CircuitOpenError):
+            self.breaker.before_call()
+
+        # 成功调用清零连续失败次数
+        self.now = 10
+        self.breaker.before_call()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.as_dict(), {'state': 'closed', 'consecutive_failures': 1})
+
+    def test_single_half_open_probe_after_cooldown(self):
+        for _ in range(2):
+            self.breaker.record_failure()
+        self.now = 9.9
+        self.assertEqual(self.breaker.state, 'open')
+        self.now = 10
+        self.assertEqual(self.breaker.state, 'half_open')
+        self.breaker.before_call()
+        with self.assertRaises(payment_gateway.CircuitOpenError):
+            self.breaker.before_call()
+
+        # 探测失败立即重新熔断，冷却期重新计算
+        self.breaker.record_failure()
+        self.now = 15
+        self.assertEqual(self.breaker.state, 'open')
+        self.now = 20
+        self.breaker.before_call()
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, 'closed')
+        self.breaker.before_call()
+        self.breaker.before_call()
+
+    def test_unexpected_error_during_probe_releases_it(self):
+        client, adapter = self.client_with(KeyError('trade_no'), (200, {'trade_no': 'A1'}))
+        for _ in range(2):
+            self.breaker.record_failure()
+        self.now = 10
+        with self.assertRaises(KeyError):
+            self.create(client)
+        # 探测名额已释放，下一次调用仍可作为探测发出
+        self.assertEqual(self.create(client), {'trade_no': 'A1'})
+        self.assertEqual(self.breaker.state, 'closed')
+
+    def test_client_errors_do_not_trip_the_breaker(self):
+        client, adapter = self.client_with(*[(400, {'message': '参数错误'})] * 3)
+        for _ in range(3):
+            with self.assertRaisesMessage(payment_gateway.GatewayError, '参数错误'):
+                self.create(client)
+        self.assertEqual(self.breaker.as_dict(), {'state': 'closed', 'consecutive_failures': 0})
+        self.assertEqual(len(adapter.requests), 3)
+
+    def test_server_errors_and_timeouts_trip_the_breaker(self):
+        client, adapter = self.client_with((503, {}), requests.exceptions.ReadTimeout())
+        with self.assertRaisesMessage(payment_gateway.GatewayError, 'HTTP 503'):
+            self.create(client)
+        with self.assertRaisesMessage(payment_gateway.GatewayError, 'ReadTimeout'):
+            self.create(client)
+        self.assertEqual(self.breaker.state, 'open')
+
+        # 熔断中直接拒绝，不发出请求
+        with self.assertRaises(payment_gateway.CircuitOpenError):
+            self.create(client)
+        self.assertEqual(len(adapter.requests), 2)
+
+    def test_requests_share_one_pooled_session(self):
+        client, adapter = self.client_with((200, {'trade_no': 'A1'}), (200, {'refund_fee': '9.90'}))
+        session = client.session
+        self.assertEqual(self.create(client), {'trade_no': 'A1'})
+        client.alipay_refund('T1', 'R1', Decimal('9.90'))
+        self.assertIs(client.session, session)
+        self.assertEqual(
+            [r.url for r in adapter.requests],
+            [self.base_url + client.ALIPAY_CREATE_PATH, self.base_url + client.ALIPAY_REFUND_PATH],
+        )
+
+        self.addCleanup(setattr, payment_gateway, '_client', None)
+        payment_gateway._client = None
+        with override_settings(PAYMENT_GATEWAY_URL=self.base_url, PAYMENT_GATEWAY_POOL_SIZE=7):
+            shared = payment_gateway.get_client()
+            self.assertIs(payment_gateway.get_client(), shared)
+        pooled = shared.session.get_adapter(self.base_url)
+        self.assertEqual(pooled._pool_maxsize, 7)
+
+
+class PublicStatsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_stale_entry_is_recomputed_by_web_process(self):
+        make_group_buy(target=10)
+        with mock.patch.object(public_stats.cache, 'set', wraps=public_stats.cache.set) as cache_set:
+            self.assertEqual(public_stats.get_public_stats()['active_groups'], 1)
+        self.assertIsNone(cache_set.call_args.kwargs['timeout'])
+
+        # 条目过旧（beat 的刷新写在别的进程里）后重新计算，而不是一直返回旧值
+        make_group_buy(target=10)
+        self.assertEqual(public_stats.get_public_stats()['active_groups'], 1)
+        later = time.time() + public_stats.max_age() + 1
+        with mock.patch('time.time', return_value=later):
+            self.assertIsNotNone(cache.get(public_stats.CACHE_KEY))
+            self.assertEqual(public_stats.get_public_stats()['active_groups'], 2)
+
+    def test_concurrent_caller_gets_previous_values_while_refreshing(self):
+        make_group_buy(target=10)
+        make_order(make_group_buy(target=10), quantity=3)
+        previous = public_stats.get_public_stats()
+        make_group_buy(target=10)
+
+        later = time.time() + public_stats.max_age() + 1
+        with mock.patch('time.time', return_value=later):
+            # 另一个请求持有刷新锁：本请求不重算，也不返回全零
+            cache.add(public_stats.LOCK_KEY, 1)
+            with self.assertNumQueries(0):
+                self.assertEqual(public_stats.get_public_stats(), previous)
+            self.assertEqual(previous['active_groups'], 2)
+            self.assertEqual(previous['total_participants'], 3)
+
+            cache.delete(public_stats.LOCK_KEY)
+            self.assertEqual(public_stats.get_public_stats()['active_groups'], 3)
+
+
+class DailyStatsTests(TestCase):
+    def test_long_range_returns_plain_response(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create(username='admin', role='admin'))
+        make_order(make_group_buy(target=10))
+        response = client.get('/api/admin/analytics/daily/', {'days': 400})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['daily_stats']), 366)
+        self.assertEqual(response.data['daily_stats'][-1]['order_count'], 1)
+
+
+class LifecycleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def reschedule_eta(self, group_buy, now):
+        with mock.patch('api.tasks.transition_groupbuy.apply_async') as apply_async:
+            self.assertEqual(lifecycle.run_transition(group_buy.id, lifecycle.ACTIVATE, now=now), 0)
+        return apply_async.call_args.kwargs['eta']
+
+    def test_early_fire_reschedules_at_the_deadline(self):
+        now = timezone.now()
+        group_buy = make_group_buy(status='pending', start_time=now + timedelta(minutes=5))
+        self.assertEqual(self.reschedule_eta(group_buy, now), group_buy.start_time)
+
+    def test_unchanged_past_deadline_is_retried_after_a_delay(self):
+        now = timezone.now()
+        group_buy = make_group_buy(status='pending', start_time=now + timedelta(seconds=1))
+        # start_time 只比 now 晚 1 秒：重新投递不得早于 retry_delay
+        self.assertEqual(self.reschedule_eta(group_buy, now), now + lifecycle.retry_delay())
+
+    def test_moving_end_time_earlier_enqueues_the_new_deadline(self):
+        now = timezone.now()
+        with mock.patch('api.tasks.transition_groupbuy.apply_async') as apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                group_buy = make_group_buy(end_time=now + timedelta(minutes=30))
+            self.assertEqual(apply_async.call_args.kwargs['eta'], group_buy.end_time)
+
+            apply_async.reset_mock()
+            with self.captureOnCommitCallbacks(execute=True):
+                group_buy.target_participants = 8
+                group_buy.save()
+            apply_async.assert_not_called()
+
+            group_buy.end_time = now + timedelta(minutes=2)
+            with self.captureOnCommitCallbacks(execute=True):
+                group_buy.save()
+        apply_async.assert_called_once_with(
+            args=(group_buy.id, lifecycle.FINALIZE), eta=group_buy.end_time, retry=False,
+        )
@@ -8,7 +8,7 @@ from .views.admin import (
 )
 from .views.leader import LeaderGroupBuyListCreateView, LeaderGroupBuyOrdersView, LeaderConfirmPickupView, LeaderStartGroupBuyView
 from .views.user import (
-    JoinGroupBuyView, GroupBuyPublicListView, MyOrdersView, MyOrderDetailView,
+    JoinGroupBuyView, WaitingRoomView, CheckoutView, GroupBuyPublicListView, MyOrdersView, MyOrderDetailView,
     MeView, OrderConfirmView, OrderReviewView, ProductReviewsListView,
     MembershipTierListView, ProductPublicListView
 )
@@ -20,11 +20,15 @@ from .views.leader_extras import (
     LeaderStatsView, LeaderPickupsView, LeaderCommissionsSummaryView, LeaderCommissionsView, LeaderDemoteToUserView
 )
 from .views.admin_extras import (
-    AdminLeaderApproveView, AdminLeaderRejectView, AdminLeaderDetailsView, AdminLeaderDeactivateView
+    AdminLeaderApproveView, AdminLeaderRejectView, AdminLeaderDetailsView, AdminLeaderDeactivateView,
+    AdminCacheStatsView, AdminPaymentInboxView
 )
 from .views.user_extras import (
     UserApplyLeaderView, ProductNotifyView, MeDetailView
 )
+from .views.notifications import (
+    NotificationListView, NotificationMarkReadView, NotificationUnreadCountView
+)
 from .views.image_upload import (
     ImageUploadView, ProductImageUploadView
 )
@@ -50,7 +54,9 @@ urlpatterns = [
     path('groupbuys/', GroupBuyPublicListView.as_view(), name='groupbuys-list'),
     path('products/', ProductPublicListView.as_view(), name='products-public-list'),
     path('group-buys/<int:id>/join/', JoinGroupBuyView.as_view(), name='group-buys-join'),
+    path('group-buys/<int:id>/queue/', WaitingRoomView.as_view(), name='group-buys-queue'),
     path('orders/join/', JoinGroupBuyView.as_view(), name='orders-join'),
+    path('orders/checkout/', CheckoutView.as_view(), name='orders-checkout'),
     path('me/orders/', MyOrdersView.as_view(), name='me-orders'),
     path('me/orders/<int:id>/', MyOrderDetailView.as_view(), name='me-orders-detail'),
     path('users/me/', MeDetailView.as_view(), name='users-me'),
@@ -90,10 +96,15 @@ urlpatterns = [
     path('admin/leaders/<int:user_id>/reject/', AdminLeaderRejectView.as_view(), name='admin-leader-reject'),
     path('admin/leaders/<int:user_id>/details/', AdminLeaderDetailsView.as_view(), name='admin-leader-details'),
     path('admin/leaders/<int:user_id>/deactivate/', AdminLeaderDeactivateView.as_view(), name='admin-leader-deactivate'),
+    path('admin/cache-stats/', AdminCacheStatsView.as_view(), name='admin-cache-stats'),
+    path('admin/payment-inbox/', AdminPaymentInboxView.as_view(), name='admin-payment-inbox'),
     
     # 新增的用户功能API
     path('users/apply-leader/', UserApplyLeaderView.as_view(), name='user-apply-leader'),
     path('products/<int:product_id>/notify/', ProductNotifyView.as_view(), name='product-notify'),
+    path('me/notifications/', NotificationListView.as_view(), name='me-notifications'),
+    path('me/notifications/read/', NotificationMarkReadView.as_view(), name='me-notifications-read'),
+    path('me/notifications/unread-count/', NotificationUnreadCountView.as_view(), name='me-notifications-unread-count'),
     
     # 图片上传API
     path('upload/image/', ImageUploadView.as_view(), name='image-upload'),
@@ -5,6 +5,8 @@ from rest_framework.decorators import action
 from api.models import Product, User, Alert, Order, GroupBuy, OrderItem
 from api.serializers import ProductSerializer, AlertSerializer, OrderSerializer, OrderDetailSerializer
 from api.permissions import IsAdminRole
+from api.services.commission import COMMISSION_RATE, annotate_leader_stats
+from api.services.ledger import set_order_status, transition_orders
 from rest_framework.parsers import MultiPartParser, FormParser
 from django.db.models import Sum, Count, F, Q
 from django.utils import timezone
@@ -22,33 +24,42 @@ class AdminProductViewSet(viewsets.ModelViewSet):
 
 class LeaderApplicationsListView(APIView):
     permission_classes = [permissions.IsAuthenticated, IsAdminRole]
+    max_page_size = 100
 
     def get(self, request):
-        from decimal import Decimal
-        
         # 获取所有团长相关用户：待审核、已批准、已拒绝
         status_filter = request.GET.get('status', 'all')
-        
-        if status_filter == 'pending':
-            qs = User.objects.filter(leader_status='pending')
-        elif status_filter == 'approved':
-            qs = User.objects.filter(role='leader', leader_status='approved')
-        elif status_filter == 'rejected':
-            qs = User.objects.filter(leader_status='rejected')
+        try:
+            page = max(1, int(request.GET.get('page', 1)))
+            page_size = max(1, min(int(request.GET.get('page_size', 20)), self.max_page_size))
+        except ValueError:
+            return Response({'error': '分页参数无效'}, status=status.HTTP_400_BAD_REQUEST)
+
+        status_filters = {
+            'pending': Q(leader_status='pending'),
+            'approved': Q(role='leader', leader_status='approved'),
+            'rejected': Q(leader_status='rejected'),
+        }
+        # 返回所有与团长相关的用户
+        base = User.objects.filter(Q(leader_status__isnull=False) | Q(role='leader'))
+
+        # 各状态人数一次聚合得出，同时作为分页总数
+        counts = base.aggregate(
+            all=Count('id'),
+            **{name: Count('id', filter=condition) for name, condition in status_filters.items()}
+        )
+        if status_filter in status_filters:
+            qs = base.filter(status_filters[status_filter])
+            total = counts[status_filter]
         else:
-            # 返回所有与团长相关的用户
-            qs = User.objects.filter(
-                Q(leader_status__isnull=False) | Q(role='leader')
-            )
-        
-        qs = qs.order_by('-date_joined')
-        
-        # 计算统计信息
+            qs = base
+            total = counts['all']
+
+        start = (page - 1) * page_size
+        users = annotate_leader_stats(qs.order_by('-date_joined', '-id'))[start:start + page_size]
+
         data = []
-        commission_rate = Decimal('0.1')
-        current_month = timezone.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        
-        for u in qs:
+        for u in users:
             user_data = {
                 'id': u.id,
                 'username': u.username,
@@ -64,29 +75,25 @@ class LeaderApplicationsListView(APIView):
                 'date_joined': u.date_joined.isoformat() if u.date_joined else None,
                 'created_at': u.date_joined.isoformat() if u.date_joined else None,
             }
-            
+
             # 如果是已批准的团长，添加统计信息
             if u.role == 'leader':
-                # 拼单数
-                groupbuy_count = GroupBuy.objects.filter(leader=u).count()
-                
-                # 本月收益
-                monthly_orders = Order.objects.filter(
-                    group_buy__leader=u,
-                    status__in=['successful', 'completed'],
-                    created_at__gte=current_month
-                )
-                monthly_commission = sum((order.total_price * commission_rate) for order in monthly_orders) if monthly_orders.exists() else Decimal('0')
-                
-                user_data['groupbuy_count'] = groupbuy_count
+                monthly_commission = (u.monthly_sales or 0) * COMMISSION_RATE
+                user_data['groupbuy_count'] = u.groupbuy_count
                 user_data['monthly_commission'] = f"{monthly_commission:.2f}"
             else:
                 user_data['groupbuy_count'] = 0
                 user_data['monthly_commission'] = '0.00'
-            
+
             data.append(user_data)
-        
-        return Response(data)
+
+        return Response({
+            'total': total,
+            'page': page,
+            'page_size': page_size,
+            'counts': counts,
+            'results': data
+        })
 
 
 class LeaderApplicationDetailView(APIView):
@@ -331,8 +338,7 @@ class AdminOrderUpdateStatusView(APIView):
             if new_status not in valid_statuses:
                 return Response({'error': '无效的订单状态'}, status=400)
             
-            order.status = new_status
-            order.save()
+            set_order_status(order, new_status)
             
             return Response({
                 'success': True,
@@ -360,7 +366,7 @@ class AdminOrderBatchUpdateView(APIView):
         if new_status not in valid_statuses:
             return Response({'error': '无效的订单状态'}, status=400)
         
-        updated_count = Order.objects.filter(id__in=order_ids).update(status=new_status)
+        updated_count = transition_orders(Order.objects.filter(id__in=order_ids), new_status)
         
         return Response({
             'success': True,
@@ -382,8 +388,7 @@ class AdminOrderCancelView(APIView):
                     return Response({'error': '该订单无法取消'}, status=400)
                 
                 # 取消订单
-                order.status = 'canceled'
-                order.save()
+                set_order_status(order, 'canceled')
                 
                 # 更新拼单参与人数
                 if order.group_buy.current_participants > 0:
@@ -3,10 +3,11 @@ from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
 from django.db.models import Count, Sum, Q
-from django.utils import timezone
-from decimal import Decimal
-from api.models import GroupBuy, Order, User, Product
+from api.models import GroupBuy, User, Product
+from api.caching import cache_stats, reset_cache_stats
 from api.permissions import IsAdminRole
+from api.services.commission import leader_earnings
+from api.services.payment_inbox import inbox_metrics
 
 
 class AdminLeaderApproveView(APIView):
@@ -69,29 +70,18 @@ class AdminLeaderDetailsView(APIView):
             user = User.objects.get(id=user_id, role='leader')
             
             # 统计数据
-            groupbuy_count = GroupBuy.objects.filter(leader=user).count()
-            successful_groupbuys = GroupBuy.objects.filter(
-                leader=user, 
-                status='successful'
-            ).count()
-            
-            total_orders = Order.objects.filter(
-                group_buy__leader=user,
-                status__in=['successful', 'completed']
-            ).count()
-            
-            # 提成计算（10%提成）
-            commission_rate = Decimal('0.1')
-            orders = Order.objects.filter(
-                group_buy__leader=user,
-                status__in=['successful', 'completed']
+            groupbuy_stats = GroupBuy.objects.filter(leader=user).aggregate(
+                groupbuy_count=Count('id'),
+                successful_groupbuys=Count('id', filter=Q(status='successful')),
             )
-            total_commission = sum((order.total_price * commission_rate) for order in orders) if orders.exists() else Decimal('0')
-            
-            # 本月提成
-            current_month = timezone.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-            monthly_orders = orders.filter(created_at__gte=current_month)
-            monthly_commission = sum((order.total_price * commission_rate) for order in monthly_orders) if monthly_orders.exists() else Decimal('0')
+            groupbuy_count = groupbuy_stats['groupbuy_count']
+            successful_groupbuys = groupbuy_stats['successful_groupbuys']
+
+            # 订单数与提成（累计、本月）
+            earnings = leader_earnings(user.id)
+            total_orders = earnings.total_orders
+            total_commission = earnings.total_commission
+            monthly_commission = earnings.monthly_commission
             
             # 最近拼单
             recent_groupbuys = GroupBuy.objects.filter(
@@ -148,3 +138,27 @@ class AdminLeaderDeactivateView(APIView):
             return Response({'error': '团长不存在'}, status=404)
         except Exception as e:
             return Response({'error': str(e)}, status=500)
+
+
+class AdminCacheStatsView(APIView):
+    """公开接口缓存的命中统计"""
+    permission_classes = [IsAuthenticated, IsAdminRole]
+
+    def get(self, request):
+        return Response(cache_stats())
+
+    def delete(self, request):
+        reset_cache_stats()
+        return Response({'success': True, 'message': '缓存统计已清零'})
+
+
+class AdminPaymentInboxView(APIView):
+    """支付回调收件箱的积压与处理延迟"""
+    permission_classes = [IsAuthenticated, IsAdminRole]
+
+    def get(self, request):
+        try:
+            window = min(max(int(request.GET.get('window', 5)), 1), 1440)
+        except ValueError:
+            return Response({'error': '参数无效'}, status=400)
+        return Response(inbox_metrics(window_minutes=window))
@@ -3,8 +3,9 @@ from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
 from django.db.models import Count, Sum, Avg, Q
+from django.db.models.functions import TruncDate
 from django.utils import timezone
-from datetime import datetime, timedelta
+from datetime import datetime, time, timedelta
 from api.models import Order, GroupBuy, User, Product
 from api.permissions import IsAdminRole
 
@@ -243,45 +244,61 @@ class AdminAnalyticsView(APIView):
         })
 
 
+def _count_by_day(queryset, field, since, **aggregates):
+    """按本地日期分组统计，整个时间段一条查询，返回 {date: {指标: 值}}"""
+    rows = (
+        queryset
+        .filter(**{f'{field}__gte': since})
+        .annotate(day=TruncDate(field))
+        .order_by()
+        .values('day')
+        .annotate(**aggregates)
+    )
+    return {row.pop('day'): row for row in rows}
+
+
 class DailyStatsView(APIView):
     """每日统计数据"""
     permission_classes = [IsAuthenticated, IsAdminRole]
-    
+    # days 的上限：最多一年 366 行，三条聚合查询后直接返回
+    MAX_DAYS = 366
+
     def get(self, request):
         """获取每日统计"""
         try:
             days = int(request.GET.get('days', 7))
-            
+        except (TypeError, ValueError):
+            return Response({'error': 'days 必须是整数'}, status=status.HTTP_400_BAD_REQUEST)
+        days = min(max(days, 1), self.MAX_DAYS)
+
+        try:
+            today = timezone.localdate()
+            first_day = today - timedelta(days=days - 1)
+            since = timezone.make_aware(datetime.combine(first_day, time.min))
+
+            # 每个指标整个时间段只查询一次
+            users = _count_by_day(User.objects.all(), 'date_joined', since, new_users=Count('id'))
+            groupbuys = _count_by_day(GroupBuy.objects.all(), 'created_at', since, new_groupbuys=Count('id'))
+            orders = _count_by_day(
+                Order.objects.all(), 'created_at', since,
+                order_count=Count('id'),
+                revenue=Sum('total_price', filter=Q(payment_status='paid')),
+            )
+
+            # 补齐没有数据的日期，按时间正序
             daily_stats = []
             for i in range(days):
-                date = timezone.now().date() - timedelta(days=i)
-                
-                # 当日新用户
-                new_users = User.objects.filter(date_joined__date=date).count()
-                
-                # 当日新拼单
-                new_groupbuys = GroupBuy.objects.filter(created_at__date=date).count()
-                
-                # 当日订单
-                daily_orders = Order.objects.filter(created_at__date=date)
-                order_count = daily_orders.count()
-                
-                # 当日收入
-                daily_revenue = daily_orders.filter(
-                    payment_status='paid'
-                ).aggregate(total=Sum('total_price'))['total'] or 0
-                
+                date = first_day + timedelta(days=i)
+                day_orders = orders.get(date, {})
                 daily_stats.append({
                     'date': date.isoformat(),
-                    'new_users': new_users,
-                    'new_groupbuys': new_groupbuys,
-                    'order_count': order_count,
-                    'revenue': float(daily_revenue)
+                    'new_users': users.get(date, {}).get('new_users', 0),
+                    'new_groupbuys': groupbuys.get(date, {}).get('new_groupbuys', 0),
+                    'order_count': day_orders.get('order_count', 0),
+                    'revenue': float(day_orders.get('revenue') or 0)
                 })
-            
-            return Response({
-                'daily_stats': list(reversed(daily_stats))  # 按时间正序
-            })
-            
         except Exception as e:
             return Response({'error': str(e)}, status=500)
+
+        return Response({'daily_stats': daily_stats})
+
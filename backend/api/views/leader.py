@@ -4,9 +4,11 @@ from rest_framework.views import APIView
 from django.db import transaction
 from django.db.models import Prefetch
 from django.utils import timezone
-from api.models import GroupBuy, Order, OrderItem, Product, MembershipTier
+from api.models import GroupBuy, Order, OrderItem, Product
 from api.serializers import GroupBuySerializer, OrderSerializer
 from api.permissions import IsLeaderRole
+from api.services.ledger import set_order_status
+from api.services.membership import accrue_loyalty
 
 
 class LeaderGroupBuyListCreateView(generics.ListCreateAPIView):
@@ -45,6 +47,7 @@ class LeaderGroupBuyListCreateView(generics.ListCreateAPIView):
         else:
             serializer.validated_data['status'] = 'pending'
         
+        # 保存后由 post_save 信号按开始/结束时间投递精确的状态转换
         serializer.save(leader=self.request.user)
     
     def create(self, request, *args, **kwargs):
@@ -84,26 +87,13 @@ class LeaderConfirmPickupView(APIView):
         if order.status in ['successful', 'ready_for_pickup']:
             if getattr(order, 'payment_status', '') == 'paid':
                 # 如果已支付，直接完成订单并结算积分
-                order.status = 'completed'
-                order.save()
+                set_order_status(order, 'completed')
                 
                 # 增加积分并升级会员
-                user = order.user
-                user.loyalty_points = (user.loyalty_points or 0) + int(order.total_price)
-                
-                # 自动匹配最高可达会员等级
-                candidates = MembershipTier.objects.all().order_by('points_required')
-                new_tier = None
-                for t in candidates:
-                    if user.loyalty_points >= t.points_required:
-                        new_tier = t
-                if new_tier:
-                    user.membership_tier = new_tier
-                user.save()
+                accrue_loyalty(order.user, int(order.total_price))
             else:
                 # 未支付则转为待支付
-                order.status = 'pending_payment'
-                order.save()
+                set_order_status(order, 'pending_payment')
         
         return Response({'ok': True})
 
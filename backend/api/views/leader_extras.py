@@ -3,11 +3,10 @@ from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
 from django.db.models import Count, Sum, Q
-from django.utils import timezone
 from datetime import datetime, timedelta
-from decimal import Decimal
 from api.models import GroupBuy, Order, User, Product
 from api.permissions import IsLeaderRole
+from api.services.commission import COMMISSION_RATE, leader_earnings
 
 
 class LeaderStatsView(APIView):
@@ -17,40 +16,16 @@ class LeaderStatsView(APIView):
     def get(self, request):
         try:
             leader = request.user
-            current_month = timezone.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-            
+
             # 我的拼单数
             my_groupbuys = GroupBuy.objects.filter(leader=leader).count()
-            
-            # 待提货订单数
-            pending_pickups = Order.objects.filter(
-                group_buy__leader=leader,
-                status='successful'
-            ).count()
-            
-            # 本月提成（估算）
-            commission_rate = Decimal('0.1')
-            monthly_orders = Order.objects.filter(
-                group_buy__leader=leader,
-                status__in=['successful', 'completed'],
-                created_at__gte=current_month
-            )
-            monthly_commission = Decimal('0')
-            for order in monthly_orders:
-                # 假设提成比例为10%
-                commission = order.total_price * commission_rate
-                monthly_commission += commission
-            
-            # 总收益（估算）
-            all_orders = Order.objects.filter(
-                group_buy__leader=leader,
-                status__in=['successful', 'completed']
-            )
-            total_earnings = Decimal('0')
-            for order in all_orders:
-                commission = order.total_price * commission_rate
-                total_earnings += commission
-            
+
+            # 待提货订单数、本月提成、总收益（估算）一次聚合得出
+            earnings = leader_earnings(leader.id)
+            pending_pickups = earnings.pending_pickups
+            monthly_commission = earnings.monthly_commission
+            total_earnings = earnings.total_commission
+
             return Response({
                 'my_groupbuys': my_groupbuys,
                 'pending_pickups': pending_pickups,
@@ -108,38 +83,22 @@ class LeaderCommissionsSummaryView(APIView):
     
     def get(self, request):
         try:
-            leader = request.user
-            current_month = timezone.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-            commission_rate = Decimal('0.1')
-            
-            # 总收益
-            all_orders = Order.objects.filter(
-                group_buy__leader=leader,
-                status__in=['successful', 'completed']
-            )
-            total_earnings = sum((order.total_price * commission_rate) for order in all_orders) if all_orders.exists() else Decimal('0')
-            
-            # 本月收益
-            monthly_orders = all_orders.filter(created_at__gte=current_month)
-            monthly_earnings = sum((order.total_price * commission_rate) for order in monthly_orders) if monthly_orders.exists() else Decimal('0')
-            
-            # 待结算收益（已完成但未结算的订单）
-            pending_orders = Order.objects.filter(
-                group_buy__leader=leader,
-                status='completed'
-                # 这里可以添加结算状态字段的过滤
-            )
-            pending_earnings = sum((order.total_price * commission_rate) for order in pending_orders) if pending_orders.exists() else Decimal('0')
-            
+            earnings = leader_earnings(request.user.id)
+
+            # 总收益、本月收益、待结算收益（已完成但未结算的订单）
+            total_earnings = earnings.total_commission
+            monthly_earnings = earnings.monthly_commission
+            pending_earnings = earnings.pending_commission
+
             # 本月流水和订单数
-            monthly_sales = sum(order.total_price for order in monthly_orders) if monthly_orders.exists() else Decimal('0')
-            monthly_order_count = monthly_orders.count()
-            
+            monthly_sales = earnings.monthly_sales
+            monthly_order_count = earnings.monthly_orders
+
             return Response({
                 'total_earnings': f"{total_earnings:.2f}",
                 'monthly_earnings': f"{monthly_earnings:.2f}",
                 'pending_earnings': f"{pending_earnings:.2f}",
-                'commission_rate': 10,  # 10%提成比例
+                'commission_rate': int(COMMISSION_RATE * 100),  # 提成比例（百分比）
                 'monthly_sales': f"{monthly_sales:.2f}",
                 'monthly_orders': monthly_order_count
             })
@@ -161,7 +120,7 @@ class LeaderCommissionsView(APIView):
     def get(self, request):
         try:
             leader = request.user
-            commission_rate = Decimal('0.1')
+            commission_rate = COMMISSION_RATE
             
             orders = Order.objects.filter(
                 group_buy__leader=leader,
@@ -0,0 +1,64 @@
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework import status
+from rest_framework.permissions import IsAuthenticated
+
+from api.models import Notification
+from api.serializers import NotificationSerializer
+from api.services import notifications as inbox
+
+
+class NotificationListView(APIView):
+    """我的站内通知：按 id 倒序，以 before_id 翻页（不统计总数）"""
+    permission_classes = [IsAuthenticated]
+    max_page_size = 100
+
+    def get(self, request):
+        try:
+            page_size = max(1, min(int(request.GET.get('page_size', 20)), self.max_page_size))
+            before_id = int(request.GET['before_id']) if request.GET.get('before_id') else None
+        except ValueError:
+            return Response({'error': '分页参数无效'}, status=status.HTTP_400_BAD_REQUEST)
+
+        qs = Notification.objects.filter(user=request.user)
+        if request.GET.get('unread') in ('1', 'true'):
+            qs = qs.filter(is_read=False)
+        if before_id is not None:
+            qs = qs.filter(id__lt=before_id)
+        # 多取一条判断是否还有下一页
+        rows = list(qs.order_by('-id')[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+
+        return Response({
+            'results': NotificationSerializer(rows, many=True).data,
+            'page_size': page_size,
+            'next_before_id': rows[-1].id if has_more else None,
+            'unread_count': inbox.unread_count(request.user.id),
+        })
+
+
+class NotificationMarkReadView(APIView):
+    """批量标记已读：{"ids": [...]} 或 {"all": true}"""
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        if request.data.get('all'):
+            ids = None
+        else:
+            ids = inbox.parse_ids(request.data.get('ids'))
+            if ids is None:
+                return Response(
+                    {'error': f'ids 必须是通知 ID 列表（最多 {inbox.MAX_MARK_READ_IDS} 个），或传 all=true'},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+        updated = inbox.mark_read(request.user.id, ids)
+        return Response({'updated': updated, 'unread_count': inbox.unread_count(request.user.id)})
+
+
+class NotificationUnreadCountView(APIView):
+    """通知角标：未读数来自缓存的计数器"""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        return Response({'unread_count': inbox.unread_count(request.user.id)})
@@ -9,9 +9,16 @@ import time
 import random
 import string
 import json
-import requests
-from api.models import Order, GroupBuy, MembershipTier
+from api import payment_gateway
+from api.payment_gateway import GatewayError
+from api.models import Order, GroupBuy
 from api.websocket_utils import send_order_update
+from api.services.ledger import set_order_status
+from api.services.reservations import convert_reservations
+from api.services import payment_inbox
+from api.services.group_success import complete_if_paid, paid_orders_count
+from api.services.membership import accrue_loyalty
+from api.idempotency import idempotent
 
 
 class WeChatPayView(APIView):
@@ -43,6 +50,8 @@ class WeChatPayView(APIView):
                 'amount': str(order.total_price)
             })
             
+        except GatewayError as e:
+            return Response({'error': str(e)}, status=503)
         except Exception as e:
             return Response({'error': f'支付请求失败: {str(e)}'}, status=500)
     
@@ -76,13 +85,18 @@ class WeChatPayView(APIView):
         # 生成签名
         params['sign'] = self.generate_sign(params, key)
         
-        # 在实际应用中，这里应该调用微信支付API
-        # 这里返回模拟的支付参数
+        # 配置了支付网关时调用统一下单，否则返回模拟的支付参数
+        prepay_id = f'demo_prepay_id_{order.id}'
+        if payment_gateway.enabled():
+            result = payment_gateway.get_client().wechat_unified_order(
+                out_trade_no, params['total_fee'], params['body'], params['openid'], notify_url
+            )
+            prepay_id = result['prepay_id']
         return {
             'appId': app_id,
             'timeStamp': str(int(time.time())),
             'nonceStr': self.generate_nonce_str(),
-            'package': f'prepay_id=demo_prepay_id_{order.id}',
+            'package': f'prepay_id={prepay_id}',
             'signType': 'MD5',
             'paySign': 'demo_pay_sign'
         }
@@ -104,43 +118,16 @@ class WeChatPayView(APIView):
 
 
 class WeChatPayNotifyView(APIView):
-    """微信支付回调接口"""
+    """微信支付回调接口：回调写入收件箱后立即应答，由 process_payment_callbacks 异步处理"""
     
     def post(self, request):
         try:
-            # 解析微信支付回调数据
             # 实际应用中需要验证签名和处理XML数据
-            
-            # 模拟处理支付成功回调
             out_trade_no = request.data.get('out_trade_no', '')
             result_code = request.data.get('result_code', 'SUCCESS')
             
-            if result_code == 'SUCCESS' and out_trade_no:
-                # 提取订单ID
-                if out_trade_no.startswith('GB'):
-                    order_id = out_trade_no.split('_')[0][2:]  # 去掉GB前缀
-                    
-                    try:
-                        order = Order.objects.get(id=order_id)
-                        
-                        # 更新订单支付状态
-                        order.payment_status = 'paid'
-                        order.payment_time = timezone.now()
-                        order.save()
-                        
-                        # 发送支付成功通知
-                        send_order_update(
-                            order.user.id,
-                            order.id,
-                            'payment_success',
-                            {'message': '支付成功，等待拼单结果'}
-                        )
-                        
-                        # 检查拼单是否成功
-                        self.check_groupbuy_success(order.group_buy)
-                        
-                    except Order.DoesNotExist:
-                        pass
+            if out_trade_no:
+                payment_inbox.ingest('wechat', out_trade_no, result_code == 'SUCCESS', dict(request.data.items()))
             
             # 返回微信支付要求的响应格式
             return Response('<xml><return_code><![CDATA[SUCCESS]]></return_code></xml>', 
@@ -149,32 +136,6 @@ class WeChatPayNotifyView(APIView):
         except Exception as e:
             return Response('<xml><return_code><![CDATA[FAIL]]></return_code></xml>', 
                           content_type='application/xml')
-    
-    def check_groupbuy_success(self, group_buy):
-        """检查拼单是否达成目标"""
-        paid_orders_count = Order.objects.filter(
-            group_buy=group_buy,
-            payment_status='paid'
-        ).count()
-        
-        if paid_orders_count >= group_buy.target_participants:
-            # 拼单成功，更新状态
-            group_buy.status = 'successful'
-            group_buy.save()
-            
-            # 更新所有相关订单状态
-            orders = Order.objects.filter(group_buy=group_buy, payment_status='paid')
-            for order in orders:
-                order.status = 'successful'
-                order.save()
-                
-                # 发送拼单成功通知
-                send_order_update(
-                    order.user.id,
-                    order.id,
-                    'groupbuy_success',
-                    {'message': '拼单成功！等待团长安排提货'}
-                )
 
 
 class AlipayView(APIView):
@@ -202,6 +163,11 @@ class AlipayView(APIView):
                 'amount': str(order.total_price),
                 'subject': f'社区团购-{order.group_buy.product.name if order.group_buy.product else "商品"}'
             }
+            if payment_gateway.enabled():
+                result = payment_gateway.get_client().alipay_create(
+                    pay_params['orderString'], order.total_price, pay_params['subject']
+                )
+                pay_params['tradeNo'] = result['trade_no']
             
             return Response({
                 'success': True,
@@ -210,6 +176,8 @@ class AlipayView(APIView):
                 'amount': str(order.total_price)
             })
             
+        except GatewayError as e:
+            return Response({'error': str(e)}, status=503)
         except Exception as e:
             return Response({'error': f'支付请求失败: {str(e)}'}, status=500)
 
@@ -237,81 +205,28 @@ class PaymentStatusView(APIView):
 
 
 class AlipayNotifyView(APIView):
-    """支付宝支付回调接口（模拟）"""
+    """支付宝支付回调接口（模拟）：回调写入收件箱后立即应答，由 process_payment_callbacks 异步处理"""
     
     def post(self, request):
         try:
-            # 模拟处理支付宝回调
             out_trade_no = request.data.get('out_trade_no', '')
             trade_status = request.data.get('trade_status', 'TRADE_SUCCESS')
             
-            if trade_status == 'TRADE_SUCCESS' and out_trade_no:
-                # 提取订单ID
-                if out_trade_no.startswith('alipay_order_'):
-                    parts = out_trade_no.split('_')
-                    if len(parts) >= 3:
-                        order_id = parts[2]
-                        
-                        try:
-                            order = Order.objects.get(id=order_id)
-                            
-                            # 更新订单支付状态
-                            order.payment_status = 'paid'
-                            order.payment_time = timezone.now()
-                            order.payment_method = 'alipay'
-                            order.save()
-                            
-                            # 发送支付成功通知
-                            send_order_update(
-                                order.user.id,
-                                order.id,
-                                'payment_success',
-                                {'message': '支付宝支付成功，等待拼单结果'}
-                            )
-                            
-                            # 检查拼单是否成功
-                            self.check_groupbuy_success(order.group_buy)
-                            
-                        except Order.DoesNotExist:
-                            pass
+            if out_trade_no:
+                payment_inbox.ingest('alipay', out_trade_no, trade_status == 'TRADE_SUCCESS', dict(request.data.items()))
             
             # 返回支付宝要求的响应格式
             return Response('success', content_type='text/plain')
             
         except Exception as e:
             return Response('fail', content_type='text/plain')
-    
-    def check_groupbuy_success(self, group_buy):
-        """检查拼单是否达成目标"""
-        paid_orders_count = Order.objects.filter(
-            group_buy=group_buy,
-            payment_status='paid'
-        ).count()
-        
-        if paid_orders_count >= group_buy.target_participants:
-            # 拼单成功，更新状态
-            group_buy.status = 'successful'
-            group_buy.save()
-            
-            # 更新所有相关订单状态
-            orders = Order.objects.filter(group_buy=group_buy, payment_status='paid')
-            for order in orders:
-                order.status = 'successful'
-                order.save()
-                
-                # 发送拼单成功通知
-                send_order_update(
-                    order.user.id,
-                    order.id,
-                    'groupbuy_success',
-                    {'message': '拼单成功！等待团长安排提货'}
-                )
 
 
 class MockPaymentSuccessView(APIView):
     """模拟支付成功接口（仅用于演示测试）"""
     permission_classes = [IsAuthenticated]
     
+    @idempotent('mock_payment')
     def post(self, request):
         """
         模拟支付成功，直接更新订单状态
@@ -338,24 +253,15 @@ class MockPaymentSuccessView(APIView):
             order.payment_time = timezone.now()
             order.payment_method = payment_method
             order.save()
+            # 已支付，库存预留转为销售
+            convert_reservations([order])
 
             # 如果订单已经是待支付状态（说明已收货），则直接完成订单
             if order.status == 'pending_payment':
-                order.status = 'completed'
-                order.save()
+                set_order_status(order, 'completed')
                 
-                # 增加积分
-                user = order.user
-                user.loyalty_points = (user.loyalty_points or 0) + int(order.total_price)
-                # 升级会员
-                candidates = MembershipTier.objects.all().order_by('points_required')
-                new_tier = None
-                for t in candidates:
-                    if user.loyalty_points >= t.points_required:
-                        new_tier = t
-                if new_tier:
-                    user.membership_tier = new_tier
-                user.save()
+                # 增加积分并升级会员
+                accrue_loyalty(order.user, int(order.total_price))
             
             # 发送支付成功通知
             send_order_update(
@@ -366,35 +272,12 @@ class MockPaymentSuccessView(APIView):
             )
             
             # 检查拼单是否达成目标
-            paid_orders_count = Order.objects.filter(
-                group_buy=order.group_buy,
-                payment_status='paid'
-            ).count()
-            
-            groupbuy_success = False
-            if paid_orders_count >= order.group_buy.target_participants:
-                # 拼单成功，更新状态
-                order.group_buy.status = 'successful'
-                order.group_buy.save()
-                groupbuy_success = True
-                
-                # 更新所有相关订单状态
-                orders = Order.objects.filter(
-                    group_buy=order.group_buy, 
-                    payment_status='paid',
-                    status='awaiting_group_success'
-                )
-                for o in orders:
-                    o.status = 'successful'
-                    o.save()
-                    
-                    # 发送拼单成功通知
-                    send_order_update(
-                        o.user.id,
-                        o.id,
-                        'groupbuy_success',
-                        {'message': '拼单成功！等待团长安排提货'}
-                    )
+            completed = complete_if_paid(order.group_buy_id)
+            # 已支付订单数用与状态切换相同的子查询，随拼单行一次读出
+            group_buy = GroupBuy.objects.annotate(paid=paid_orders_count()).values(
+                'status', 'target_participants', 'paid'
+            ).get(id=order.group_buy_id)
+            groupbuy_success = completed or group_buy['status'] == 'successful'
             
             return Response({
                 'success': True,
@@ -403,7 +286,7 @@ class MockPaymentSuccessView(APIView):
                 'payment_status': order.payment_status,
                 'payment_time': order.payment_time.isoformat(),
                 'groupbuy_success': groupbuy_success,
-                'groupbuy_participants': f'{paid_orders_count}/{order.group_buy.target_participants}'
+                'groupbuy_participants': f"{group_buy['paid']}/{group_buy['target_participants']}"
             })
             
         except Exception as e:
@@ -2,10 +2,11 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from django.db.models import Count, Sum, F, Q
-from django.utils import timezone
 from datetime import datetime, timedelta
 from decimal import Decimal
 from api.models import GroupBuy, Order, User, Product
+from api.caching import GROUPBUYS, LEADERS, ORDERS, PRODUCTS, cache_response, skip_cache
+from api.services.public_stats import EMPTY_STATS, get_public_stats
 
 
 class PublicStatsView(APIView):
@@ -13,47 +14,16 @@ class PublicStatsView(APIView):
     
     def get(self, request):
         try:
-            # 活跃拼单数
-            active_groups = GroupBuy.objects.filter(
-                status='active',
-                end_time__gt=timezone.now()
-            ).count()
-            
-            # 总参团人数（估算）
-            total_participants = Order.objects.filter(
-                status__in=['awaiting_group_success', 'successful', 'completed']
-            ).aggregate(total=Sum('quantity'))['total'] or 0
-            
-            # 总节省金额（估算）
-            total_savings = Decimal('0')
-            products = Product.objects.all()
-            price_multiplier = Decimal('1.2')
-            for product in products:
-                # 假设原价比拼单价高20%
-                original_price = product.price * price_multiplier
-                savings_per_item = original_price - product.price
-                orders_count = Order.objects.filter(
-                    group_buy__product=product,
-                    status__in=['successful', 'completed']
-                ).aggregate(total=Sum('quantity'))['total'] or 0
-                total_savings += savings_per_item * orders_count
-                
-            return Response({
-                'active_groups': active_groups,
-                'total_participants': total_participants,
-                'total_savings': f"{total_savings:.0f}"
-            })
+            # 由 refresh_public_stats 定时任务刷新的缓存，请求不访问订单表
+            return Response(get_public_stats())
         except Exception as e:
-            return Response({
-                'active_groups': 0,
-                'total_participants': 0,
-                'total_savings': '0'
-            })
+            return Response(dict(EMPTY_STATS))
 
 
 class SuccessfulGroupBuysView(APIView):
     """成功的拼单案例"""
     
+    @cache_response('successful_groupbuys', tags=(GROUPBUYS, ORDERS, PRODUCTS))
     def get(self, request):
         limit = int(request.GET.get('limit', 6))
         
@@ -90,12 +60,13 @@ class SuccessfulGroupBuysView(APIView):
             
             return Response(results)
         except Exception as e:
-            return Response([])
+            return skip_cache(Response([]))
 
 
 class FeaturedLeadersView(APIView):
     """优秀团长推荐"""
     
+    @cache_response('featured_leaders', tags=(GROUPBUYS, LEADERS))
     def get(self, request):
         limit = int(request.GET.get('limit', 3))
         
@@ -121,7 +92,7 @@ class FeaturedLeadersView(APIView):
             
             return Response(results)
         except Exception as e:
-            return Response([])
+            return skip_cache(Response([]))
 
 
 class RecommendationsView(APIView):
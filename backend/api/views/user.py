@@ -1,95 +1,61 @@
-from django.db import transaction
-from django.utils import timezone
+import logging
+
 from rest_framework import status, permissions, generics
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from api.models import GroupBuy, Product, Order, OrderItem, Review, MembershipTier
+from api.models import GroupBuy, Product, Order, Review, MembershipTier
 from api.serializers import GroupBuyPublicSerializer, OrderSerializer, ReviewSerializer, MembershipTierSerializer, ProductSerializer, OrderDetailSerializer
-from decimal import Decimal, ROUND_HALF_UP
+from api.caching import GROUPBUYS, MEMBERSHIP_TIERS, PRODUCTS, cache_response
+from api.idempotency import idempotent
+from api.services.checkout import checkout, parse_lines
+from api.services import waiting_room
+from api.services.join import join_group_buy, JoinError
+from api.services.ledger import set_order_status
+from api.services.membership import accrue_loyalty
+
+logger = logging.getLogger(__name__)
 
 
 class JoinGroupBuyView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
+    @idempotent('join')
     def post(self, request, *args, **kwargs):
-        group_buy_id = kwargs.get('id') or request.data.get('group_buy_id')
-        quantity = int(request.data.get('quantity', 1))
+        try:
+            group_buy_id = int(kwargs.get('id') or request.data.get('group_buy_id') or 0)
+            quantity = int(request.data.get('quantity', 1))
+        except (TypeError, ValueError):
+            return Response({"error": "参数无效"}, status=status.HTTP_400_BAD_REQUEST)
         if not group_buy_id or quantity <= 0:
             return Response({"error": "参数无效"}, status=status.HTTP_400_BAD_REQUEST)
 
-        try:
-            group_buy = GroupBuy.objects.select_related('product').get(id=group_buy_id)
-        except GroupBuy.DoesNotExist:
-            return Response({"error": "拼单不存在"}, status=status.HTTP_404_NOT_FOUND)
+        # 等候室：拿不到名额的请求在缓存层直接拒绝，不进入数据库；
+        # 拼单不存在或不可参团时跳过闸门，由参团引擎返回具体错误
+        admitted = False
+        if waiting_room.enabled():
+            admission = waiting_room.claim(group_buy_id, request.user.id, quantity)
+            admitted = admission is not None
+            if admitted and not admission.admitted:
+                return Response({
+                    "error": "参团失败：名额已被抢完",
+                    "queue_position": admission.position,
+                    "slots_left": admission.slots_left,
+                }, status=status.HTTP_409_CONFLICT)
 
         try:
-            with transaction.atomic():
-                # 使用 select_for_update 锁定拼单记录，防止并发问题
-                group_buy = GroupBuy.objects.select_for_update().get(id=group_buy_id)
-                product = Product.objects.select_for_update().get(id=group_buy.product_id)
-
-                # 检查拼单状态
-                if group_buy.status not in ['pending', 'active']:
-                    return Response({"error": "该拼单已结束或取消"}, status=status.HTTP_400_BAD_REQUEST)
-
-                # 检查是否会超过目标人数
-                remaining_slots = group_buy.target_participants - group_buy.current_participants
-                if quantity > remaining_slots:
-                    return Response({
-                        "error": f"参团失败：拼单仅剩 {remaining_slots} 个名额，无法加入 {quantity} 个",
-                        "remaining_slots": remaining_slots
-                    }, status=status.HTTP_400_BAD_REQUEST)
-
-                # 检查库存
-                if product.stock_quantity < quantity:
-                    return Response({"error": "库存不足"}, status=status.HTTP_400_BAD_REQUEST)
-
-                # 扣减库存
-                product.stock_quantity -= quantity
-                product.save()
-
-                # 计算会员折扣价（如有会员等级）
-                price_per_unit = product.price
-                tier = getattr(request.user, 'membership_tier', None)
-                if tier and getattr(tier, 'discount_percentage', None):
-                    discount = (Decimal('100') - Decimal(str(tier.discount_percentage))) / Decimal('100')
-                    price_per_unit = (Decimal(str(product.price)) * discount).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-
-                # 创建订单
-                total_price = price_per_unit * quantity
-                order = Order.objects.create(
-                    user=request.user,
-                    group_buy=group_buy,
-                    total_price=total_price,
-                    status='awaiting_group_success'
-                )
-                OrderItem.objects.create(
-                    order=order,
-                    product=product,
-                    quantity=quantity,
-                    price_per_unit=price_per_unit
-                )
-
-                # 更新拼单参与数量（按件数累计）
-                group_buy.current_participants = group_buy.current_participants + quantity
-                # 如果拼单原为 pending 且已到开始时间，自动激活
-                now = timezone.now()
-                if group_buy.status == 'pending' and group_buy.start_time <= now:
-                    group_buy.status = 'active'
-
-                # 如果达到目标人数，标记拼单和所有待成团订单为 successful
-                if group_buy.current_participants >= group_buy.target_participants:
-                    group_buy.status = 'successful'
-                    group_buy.save()
-                    Order.objects.filter(group_buy_id=group_buy.id, status='awaiting_group_success').update(status='successful')
-                else:
-                    group_buy.save()
-
+            result = join_group_buy(request.user, group_buy_id, quantity)
+        except JoinError as e:
+            if admitted:
+                waiting_room.release_slots(group_buy_id, quantity)
+            return Response(e.as_response_data(), status=e.status_code)
         except Exception as e:
+            if admitted:
+                waiting_room.release_slots(group_buy_id, quantity)
             import traceback
             traceback.print_exc()
             return Response({"error": f"参团失败：{str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+        order = result.order
         return Response({
             "message": "参团成功",
             "order_id": order.id,
@@ -97,6 +63,56 @@ class JoinGroupBuyView(APIView):
         }, status=status.HTTP_201_CREATED)
 
 
+class WaitingRoomView(APIView):
+    """热门拼单排队：立即返回排队号，有剩余名额则在有效期内保留参团资格"""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, id: int):
+        try:
+            quantity = int(request.data.get('quantity', 1))
+        except (TypeError, ValueError):
+            quantity = 0
+        if quantity <= 0:
+            return Response({"error": "参数无效"}, status=status.HTTP_400_BAD_REQUEST)
+
+        admission = waiting_room.enter(id, request.user.id, quantity)
+        if admission is None:
+            if not GroupBuy.objects.filter(id=id).exists():
+                return Response({"error": "拼单不存在"}, status=status.HTTP_404_NOT_FOUND)
+            return Response({"error": "该拼单已结束或取消"}, status=status.HTTP_400_BAD_REQUEST)
+        data = admission.as_dict()
+        if not admission.admitted:
+            return Response({"error": "名额已被抢完", **data}, status=status.HTTP_409_CONFLICT)
+        return Response({"message": "已获得参团资格，请尽快完成参团", **data})
+
+
+class CheckoutView(APIView):
+    """购物车结算：一次参加多个拼单，返回逐行结果"""
+    permission_classes = [permissions.IsAuthenticated]
+
+    @idempotent('checkout')
+    def post(self, request):
+        try:
+            lines = parse_lines(request.data.get('items'))
+        except JoinError as e:
+            return Response(e.as_response_data(), status=e.status_code)
+
+        try:
+            result = checkout(request.user, lines)
+        except Exception as e:
+            logger.exception('购物车结算失败')
+            return Response({"error": f"结算失败：{str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        data = {
+            "succeeded": result.succeeded,
+            "failed": len(result.lines) - result.succeeded,
+            "results": [line.as_dict() for line in result.lines],
+        }
+        if not result.succeeded:
+            return Response({"error": "所选拼单均无法参加", **data}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"message": "结算成功", **data}, status=status.HTTP_201_CREATED)
+
+
 class GroupBuyPublicListView(generics.ListAPIView):
     serializer_class = GroupBuyPublicSerializer
     permission_classes = [permissions.AllowAny]
@@ -107,6 +123,10 @@ class GroupBuyPublicListView(generics.ListAPIView):
             status__in=['active', 'pending']
         ).order_by('-created_at')
 
+    @cache_response('groupbuy_public_list', tags=(GROUPBUYS, PRODUCTS))
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
 
 class MyOrdersView(generics.ListAPIView):
     serializer_class = OrderSerializer
@@ -200,24 +220,13 @@ class OrderConfirmView(APIView):
 
         # 检查支付状态
         if getattr(order, 'payment_status', '') == 'paid':
-            order.status = 'completed'
-            order.save()
+            set_order_status(order, 'completed')
 
             # 增加积分（示例：按总价取整累加）并自动升级会员
-            user.loyalty_points = (user.loyalty_points or 0) + int(order.total_price)
-            # 自动匹配最高可达会员等级
-            candidates = MembershipTier.objects.all().order_by('points_required')
-            new_tier = None
-            for t in candidates:
-                if user.loyalty_points >= t.points_required:
-                    new_tier = t
-            if new_tier:
-                user.membership_tier = new_tier
-            user.save()
+            accrue_loyalty(user, int(order.total_price))
         else:
             # 未支付则转为待支付，不加积分
-            order.status = 'pending_payment'
-            order.save()
+            set_order_status(order, 'pending_payment')
 
         return Response({'ok': True, 'loyalty_points': user.loyalty_points, 'membership_tier': MembershipTierSerializer(user.membership_tier).data if user.membership_tier else None})
 
@@ -265,6 +274,10 @@ class MembershipTierListView(generics.ListAPIView):
     def get_queryset(self):
         return MembershipTier.objects.all().order_by('points_required')
 
+    @cache_response('membership_tiers', tags=(MEMBERSHIP_TIERS,))
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
 
 
 class ProductPublicListView(generics.ListAPIView):
@@ -274,4 +287,8 @@ class ProductPublicListView(generics.ListAPIView):
     def get_queryset(self):
         return Product.objects.all().order_by('name')
 
+    @cache_response('product_public_list', tags=(PRODUCTS,))
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
 
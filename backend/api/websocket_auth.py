@@ -0,0 +1,37 @@
+"""WebSocket 鉴权
+
+浏览器的 WebSocket 无法自定义请求头，前端把 JWT access token 放在查询参数中：
+ws://host/ws/notifications/?token=<access>。
+中间件校验 token 后把对应用户放入 scope['user']，无 token 或 token 无效时为匿名用户，
+由各消费者自行决定是否允许匿名连接。
+"""
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+
+@database_sync_to_async
+def get_user_for_token(raw_token):
+    try:
+        token = AccessToken(raw_token)
+    except TokenError:
+        return AnonymousUser()
+    user_id = token.get(api_settings.USER_ID_CLAIM)
+    user = get_user_model().objects.filter(**{api_settings.USER_ID_FIELD: user_id}, is_active=True).first()
+    return user or AnonymousUser()
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """从查询参数 token 中读取 JWT 并设置 scope['user']"""
+
+    async def __call__(self, scope, receive, send):
+        params = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+        raw_token = (params.get('token') or [None])[0]
+        scope = dict(scope, user=await get_user_for_token(raw_token) if raw_token else AnonymousUser())
+        return await super().__call__(scope, receive, send)
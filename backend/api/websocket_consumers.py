@@ -1,13 +1,47 @@
 import json
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth import get_user_model
 from .models import GroupBuy, Order
+from .services import notifications as inbox
+from .websocket_streams import current_seq, replay, resync_frame
 
 User = get_user_model()
 
 
-class GroupBuyConsumer(AsyncWebsocketConsumer):
+def _parse_seq(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class ResumableStreamMixin:
+    """房间消息带 stream / seq，客户端重连时带上最后收到的序号即可补收错过的消息"""
+
+    def query_last_seq(self):
+        params = parse_qs(self.scope.get('query_string', b'').decode('latin-1'))
+        return _parse_seq((params.get('last_seq') or [None])[0])
+
+    async def resume(self, stream, last_seq, ack):
+        """发送确认帧（带当前序号），随后发送 last_seq 之后错过的消息或 resync 提示"""
+        if last_seq is None:
+            seq = await sync_to_async(current_seq)(stream)
+            await self.send(text_data=json.dumps({**ack, 'stream': stream, 'seq': seq}))
+            return
+        result = await sync_to_async(replay)(stream, last_seq)
+        await self.send(text_data=json.dumps({**ack, 'stream': stream, 'seq': result.seq}))
+        if result.resync:
+            await self.send(text_data=json.dumps(resync_frame(stream, result.seq)))
+            return
+        for frame in result.frames:
+            await self.send(text_data=json.dumps(frame))
+
+
+class GroupBuyConsumer(ResumableStreamMixin, AsyncWebsocketConsumer):
     """拼单状态推送WebSocket消费者"""
     
     async def connect(self):
@@ -22,11 +56,11 @@ class GroupBuyConsumer(AsyncWebsocketConsumer):
         
         await self.accept()
         
-        # 发送连接成功消息
-        await self.send(text_data=json.dumps({
+        # 发送连接成功消息，重连时补发错过的消息
+        await self.resume(self.room_group_name, self.query_last_seq(), {
             'type': 'connection_established',
             'message': '已连接到拼单更新服务'
-        }))
+        })
     
     async def disconnect(self, close_code):
         # 离开房间组
@@ -45,7 +79,7 @@ class GroupBuyConsumer(AsyncWebsocketConsumer):
                 # 客户端要求监听特定拼单
                 groupbuy_id = text_data_json.get('groupbuy_id')
                 if groupbuy_id:
-                    await self.join_groupbuy_room(groupbuy_id)
+                    await self.join_groupbuy_room(groupbuy_id, _parse_seq(text_data_json.get('last_seq')))
             elif message_type == 'leave_groupbuy':
                 # 离开特定拼单监听
                 groupbuy_id = text_data_json.get('groupbuy_id')
@@ -58,19 +92,19 @@ class GroupBuyConsumer(AsyncWebsocketConsumer):
                 'message': '无效的JSON格式'
             }))
     
-    async def join_groupbuy_room(self, groupbuy_id):
-        """加入特定拼单房间"""
+    async def join_groupbuy_room(self, groupbuy_id, last_seq=None):
+        """加入特定拼单房间，带 last_seq 时补发其后错过的消息"""
         room_group_name = f'groupbuy_{groupbuy_id}'
         await self.channel_layer.group_add(
             room_group_name,
             self.channel_name
         )
         
-        await self.send(text_data=json.dumps({
+        await self.resume(room_group_name, last_seq, {
             'type': 'joined_groupbuy',
             'groupbuy_id': groupbuy_id,
             'message': f'已加入拼单 {groupbuy_id} 的更新推送'
-        }))
+        })
     
     async def leave_groupbuy_room(self, groupbuy_id):
         """离开特定拼单房间"""
@@ -98,9 +132,13 @@ class GroupBuyConsumer(AsyncWebsocketConsumer):
     async def new_groupbuy(self, event):
         """处理新拼单消息"""
         await self.send(text_data=json.dumps(event['data']))
+    
+    async def queue_status(self, event):
+        """处理等候室排队进度消息"""
+        await self.send(text_data=json.dumps(event['data']))
 
 
-class UserNotificationConsumer(AsyncWebsocketConsumer):
+class UserNotificationConsumer(ResumableStreamMixin, AsyncWebsocketConsumer):
     """用户个人通知WebSocket消费者"""
     
     async def connect(self):
@@ -120,11 +158,11 @@ class UserNotificationConsumer(AsyncWebsocketConsumer):
         
         await self.accept()
         
-        # 发送连接成功消息
-        await self.send(text_data=json.dumps({
+        # 发送连接成功消息，重连时补发错过的消息
+        await self.resume(self.room_group_name, self.query_last_seq(), {
             'type': 'connection_established',
             'message': '已连接到个人通知服务'
-        }))
+        })
     
     async def disconnect(self, close_code):
         if hasattr(self, 'room_group_name'):
@@ -140,10 +178,25 @@ class UserNotificationConsumer(AsyncWebsocketConsumer):
             message_type = text_data_json.get('type')
             
             if message_type == 'mark_read':
-                # 标记通知为已读
-                notification_id = text_data_json.get('notification_id')
-                if notification_id:
-                    await self.mark_notification_read(notification_id)
+                # 标记通知为已读：notification_id、notification_ids 列表或 all
+                mark_all = bool(text_data_json.get('all'))
+                if text_data_json.get('notification_id'):
+                    ids = inbox.parse_ids([text_data_json['notification_id']])
+                else:
+                    ids = inbox.parse_ids(text_data_json.get('notification_ids'))
+                if ids is None and not mark_all:
+                    await self.send(text_data=json.dumps({
+                        'type': 'error',
+                        'message': '无效的通知ID'
+                    }))
+                    return
+                updated, unread = await self.mark_notification_read(None if mark_all else ids)
+                await self.send(text_data=json.dumps({
+                    'type': 'notifications_read',
+                    'notification_ids': ids,
+                    'updated': updated,
+                    'unread_count': unread
+                }))
                     
         except json.JSONDecodeError:
             await self.send(text_data=json.dumps({
@@ -152,10 +205,10 @@ class UserNotificationConsumer(AsyncWebsocketConsumer):
             }))
     
     @database_sync_to_async
-    def mark_notification_read(self, notification_id):
-        """标记通知为已读"""
-        # 这里可以实现通知已读逻辑
-        pass
+    def mark_notification_read(self, ids):
+        """标记通知为已读（ids 为 None 时全部），返回 (标记条数, 未读数)"""
+        updated = inbox.mark_read(self.user.id, ids)
+        return updated, inbox.unread_count(self.user.id)
     
     # 接收来自房间组的消息
     async def order_update(self, event):
@@ -173,3 +226,7 @@ class UserNotificationConsumer(AsyncWebsocketConsumer):
     async def system_notification(self, event):
         """系统通知"""
         await self.send(text_data=json.dumps(event['data']))
+    
+    async def queue_status(self, event):
+        """等候室中本人的排队号与准入结果"""
+        await self.send(text_data=json.dumps(event['data']))
@@ -0,0 +1,99 @@
+"""WebSocket 消息序号与重放缓冲
+
+每个房间（拼单房间、全局拼单房间、用户个人房间）是一条独立的消息流：
+- 发出前 stamp 为每条消息分配该房间内递增的序号，写入消息的 stream / seq 字段，
+  并把消息放入缓存中的重放缓冲区；每个房间只保留最近 WS_REPLAY_BUFFER_SIZE 条，
+  最长保留 WS_REPLAY_TTL 秒；
+- 多个线程/进程向同一房间推送时消息可能乱序到达，客户端按已收到的序号集合去重，
+  重连时带上连续收到的最大序号（其后的缺口尚未补上），replay 返回其后的消息；
+  落后超出缓冲区（或缓冲区已过期）时返回 resync，客户端改为重新拉取一次列表。
+
+序号和缓冲区都存放在 settings.CACHES 中，生产环境的 Redis 由所有 Web 进程与
+WebSocket 进程共享；序号不存在时以当前毫秒时间为初值，被淘汰后重建也不会回退。
+"""
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+def _seq_key(stream):
+    return f'ws_stream:{stream}:seq'
+
+
+def _entry_key(stream, seq):
+    return f'ws_stream:{stream}:{seq}'
+
+
+def buffer_size() -> int:
+    return getattr(settings, 'WS_REPLAY_BUFFER_SIZE', 200)
+
+
+def _reserve(stream, count):
+    """为 stream 预留 count 个序号，返回其中最大的一个"""
+    key = _seq_key(stream)
+    cache.add(key, int(time.time() * 1000), timeout=None)
+    try:
+        return cache.incr(key, count)
+    except ValueError:
+        # 并发下刚被淘汰
+        seq = int(time.time() * 1000) + count
+        cache.set(key, seq, timeout=None)
+        return seq
+
+
+def current_seq(stream) -> int:
+    """stream 当前的最大序号，客户端以此为起点记录已收到的位置"""
+    key = _seq_key(stream)
+    cache.add(key, int(time.time() * 1000), timeout=None)
+    return cache.get(key) or _reserve(stream, 0)
+
+
+def stamp(messages):
+    """为 [(房间组名, 事件)] 编号并写入重放缓冲区，返回带 stream / seq 的新消息列表"""
+    if not messages:
+        return []
+    size = buffer_size()
+    next_seq = {
+        stream: _reserve(stream, count) - count + 1
+        for stream, count in Counter(group for group, _ in messages).items()
+    }
+    stamped, entries, stale = [], {}, []
+    for group, event in messages:
+        seq = next_seq[group]
+        next_seq[group] += 1
+        # 同一事件可能发往多个房间（如成团消息），每个房间单独复制一份
+        data = {**event['data'], 'stream': group, 'seq': seq}
+        stamped.append((group, {**event, 'data': data}))
+        entries[_entry_key(group, seq)] = data
+        stale.append(_entry_key(group, seq - size))
+    cache.set_many(entries, timeout=getattr(settings, 'WS_REPLAY_TTL', 600))
+    cache.delete_many(stale)
+    return stamped
+
+
+@dataclass
+class Replay:
+    seq: int  # 重放后客户端应记录的序号
+    resync: bool = False
+    frames: list = field(default_factory=list)
+
+
+def replay(stream, last_seq) -> Replay:
+    """last_seq 之后错过的消息；落后超出缓冲区或缓冲区不完整时返回 resync"""
+    seq = current_seq(stream)
+    if last_seq == seq:
+        return Replay(seq=seq)
+    if last_seq > seq or seq - last_seq > buffer_size():
+        return Replay(seq=seq, resync=True)
+    keys = [_entry_key(stream, n) for n in range(last_seq + 1, seq + 1)]
+    found = cache.get_many(keys)
+    if len(found) < len(keys):
+        return Replay(seq=seq, resync=True)
+    return Replay(seq=seq, frames=[found[key] for key in keys])
+
+
+def resync_frame(stream, seq):
+    return {'type': 'resync', 'stream': stream, 'seq': seq, 'message': '错过的消息过多，请重新加载数据'}
@@ -1,121 +1,189 @@
-"""WebSocket推送工具函数"""
+"""WebSocket推送工具函数
+
+推送以消息为单位构造，(房间组名, 事件) 的列表：
+- 异步代码直接 await send_many(messages)，所有消息在当前事件循环中并发发送；
+- 同步代码调用 push(messages) 或下面的 send_* 函数：在事务中时消息先进入当前事务
+  （或保存点）的缓冲区，提交后一次性发出，回滚则丢弃，客户端不会看到未提交的状态；
+  不在事务中时立即发出。每次发出只经过一次 async_to_sync；
+- 发给用户个人房间的通知同时批量写入站内通知收件箱（services/notifications），
+  推送的消息带 notification_id，客户端可据此标记已读；
+- 发出前由 websocket_streams.stamp 为消息编号并写入重放缓冲区，客户端重连后可补收；
+- PushStatsMiddleware 统计每个请求发出的消息数与批次数，写入 X-WS-Pushes 响应头。
+"""
+import asyncio
+import contextvars
+import logging
+import threading
+
+from asgiref.sync import async_to_sync, sync_to_async
 from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
-import json
+from django.db import transaction
+from django.utils import timezone
+
+from api.services import notifications as inbox
+from api.websocket_streams import stamp
 
+logger = logging.getLogger(__name__)
 
 channel_layer = get_channel_layer()
 
+GLOBAL_GROUPBUY_ROOM = 'groupbuy_groupbuy_updates'
 
-def send_groupbuy_update(groupbuy_id, data):
-    """发送拼单更新推送"""
-    if not channel_layer:
+# 当前请求的推送统计（由 PushStatsMiddleware 设置）
+_push_stats = contextvars.ContextVar('ws_push_stats', default=None)
+_local = threading.local()
+
+
+def _event(event_type, payload):
+    return {
+        'type': event_type,
+        'data': {'type': event_type, **payload, 'timestamp': str(timezone.now())},
+    }
+
+
+async def transmit(messages):
+    """并发发送已编号的 [(房间组名, 事件)]"""
+    if not channel_layer or not messages:
         return
-    
-    room_group_name = f'groupbuy_{groupbuy_id}'
-    
-    async_to_sync(channel_layer.group_send)(
-        room_group_name,
-        {
-            'type': 'groupbuy_update',
-            'data': {
-                'type': 'groupbuy_update',
-                'groupbuy_id': groupbuy_id,
-                'data': data,
-                'timestamp': str(timezone.now())
-            }
-        }
-    )
+    await asyncio.gather(*[channel_layer.group_send(group, event) for group, event in messages])
 
 
-def send_groupbuy_success(groupbuy_id, data):
-    """发送拼单成功推送"""
-    if not channel_layer:
+async def send_many(messages):
+    """编号后并发发送 [(房间组名, 事件)]"""
+    if not channel_layer or not messages:
         return
-    
-    # 发送到拼单房间
-    room_group_name = f'groupbuy_{groupbuy_id}'
-    async_to_sync(channel_layer.group_send)(
-        room_group_name,
-        {
-            'type': 'groupbuy_success',
-            'data': {
-                'type': 'groupbuy_success',
-                'groupbuy_id': groupbuy_id,
-                'data': data,
-                'timestamp': str(timezone.now())
-            }
-        }
-    )
-    
-    # 同时发送到全局拼单更新房间
-    global_room = 'groupbuy_groupbuy_updates'
-    async_to_sync(channel_layer.group_send)(
-        global_room,
-        {
-            'type': 'groupbuy_success',
-            'data': {
-                'type': 'groupbuy_success',
-                'groupbuy_id': groupbuy_id,
-                'data': data,
-                'timestamp': str(timezone.now())
-            }
-        }
-    )
+    await transmit(await sync_to_async(stamp)(messages))
 
 
-def send_new_groupbuy(data):
-    """发送新拼单推送"""
-    if not channel_layer:
+def _record(messages):
+    stats = _push_stats.get()
+    if stats is not None:
+        stats['messages'] += len(messages)
+        stats['batches'] += 1
+
+
+def _send_now(messages):
+    if not channel_layer or not messages:
         return
-    
-    room_group_name = 'groupbuy_groupbuy_updates'
-    
-    async_to_sync(channel_layer.group_send)(
-        room_group_name,
-        {
-            'type': 'new_groupbuy',
-            'data': {
-                'type': 'new_groupbuy',
-                'data': data,
-                'timestamp': str(timezone.now())
-            }
-        }
-    )
+    _record(messages)
+    async_to_sync(transmit)(stamp(messages))
 
 
-def send_user_notification(user_id, notification_type, data):
-    """发送用户个人通知"""
-    if not channel_layer:
+class _CommitBatch:
+    """一个事务（或保存点）内累积的消息，提交后一次性发出"""
+
+    def __init__(self, savepoint_ids):
+        self.savepoint_ids = savepoint_ids
+        self.messages = []
+
+    def flush(self):
+        messages, self.messages = self.messages, []
+        _send_now(messages)
+
+
+def _current_batch(connection):
+    savepoint_ids = tuple(connection.savepoint_ids)
+    batch = getattr(_local, 'batch', None)
+    # 上一个批次所在的事务/保存点已结束或已回滚时，其回调不在 run_on_commit 中
+    if (batch is not None and batch.savepoint_ids == savepoint_ids
+            and any(func == batch.flush for _, func, _ in connection.run_on_commit)):
+        return batch
+    batch = _CommitBatch(savepoint_ids)
+    _local.batch = batch
+    transaction.on_commit(batch.flush, robust=True)
+    return batch
+
+
+def push(messages):
+    """同步代码的推送入口：事务中延迟到提交后发送，否则立即发送"""
+    if not channel_layer or not messages:
         return
-    
-    room_group_name = f'user_{user_id}'
-    
-    async_to_sync(channel_layer.group_send)(
-        room_group_name,
-        {
-            'type': notification_type,
-            'data': {
-                'type': notification_type,
-                'data': data,
-                'timestamp': str(timezone.now())
-            }
-        }
-    )
+    connection = transaction.get_connection()
+    if connection.in_atomic_block:
+        _current_batch(connection).messages.extend(messages)
+    else:
+        _send_now(list(messages))
 
 
-def send_order_update(user_id, order_id, status, data=None):
-    """发送订单状态更新通知"""
+def groupbuy_update_message(groupbuy_id, data):
+    return (f'groupbuy_{groupbuy_id}', _event('groupbuy_update', {'groupbuy_id': groupbuy_id, 'data': data}))
+
+
+def groupbuy_success_messages(groupbuy_id, data):
+    # 同时发送到拼单房间和全局拼单更新房间
+    event = _event('groupbuy_success', {'groupbuy_id': groupbuy_id, 'data': data})
+    return [(f'groupbuy_{groupbuy_id}', event), (GLOBAL_GROUPBUY_ROOM, event)]
+
+
+def user_notification_message(user_id, notification_type, data):
+    return (f'user_{user_id}', _event(notification_type, {'data': data}))
+
+
+def order_notification_data(order_id, status, data=None):
     notification_data = {
         'order_id': order_id,
         'status': status,
         'message': f'您的订单 #{order_id} 状态已更新为 {status}'
     }
-    
     if data:
         notification_data.update(data)
-    
-    send_user_notification(user_id, 'order_update', notification_data)
+    return notification_data
+
+
+def notify_users(notifications):
+    """[(用户ID, 通知类型, 数据)]：批量写入站内通知并推送到各用户房间"""
+    push([
+        user_notification_message(row.user_id, row.notification_type, {**row.data, 'notification_id': row.id})
+        for row in inbox.record(notifications)
+    ])
+
+
+def send_groupbuy_update(groupbuy_id, data):
+    """发送拼单更新推送"""
+    push([groupbuy_update_message(groupbuy_id, data)])
+
+
+def send_groupbuy_updates(updates):
+    """批量推送多个拼单的更新，updates 为 [(groupbuy_id, data)]"""
+    push([groupbuy_update_message(groupbuy_id, data) for groupbuy_id, data in updates])
+
+
+def send_groupbuy_success(groupbuy_id, data):
+    """发送拼单成功推送"""
+    push(groupbuy_success_messages(groupbuy_id, data))
+
+
+def send_queue_status(groupbuy_id, data):
+    """推送等候室排队进度"""
+    push([(f'groupbuy_{groupbuy_id}', _event('queue_status', {'groupbuy_id': groupbuy_id, 'data': data}))])
+
+
+def send_queue_position(user_id, groupbuy_id, data):
+    """向排队用户本人推送其排队号与准入结果（不写入站内通知）"""
+    push([(f'user_{user_id}', _event('queue_status', {'groupbuy_id': groupbuy_id, 'data': data}))])
+
+
+def send_new_groupbuy(data):
+    """发送新拼单推送"""
+    push([(GLOBAL_GROUPBUY_ROOM, _event('new_groupbuy', {'data': data}))])
+
+
+def send_user_notification(user_id, notification_type, data):
+    """发送用户个人通知"""
+    notify_users([(user_id, notification_type, data)])
+
+
+def send_order_update(user_id, order_id, status, data=None):
+    """发送订单状态更新通知"""
+    notify_users([(user_id, 'order_update', order_notification_data(order_id, status, data))])
+
+
+def send_order_updates(updates):
+    """批量发送订单状态更新通知，updates 为 [(user_id, order_id, status, data)]"""
+    notify_users([
+        (user_id, 'order_update', order_notification_data(order_id, status, data))
+        for user_id, order_id, status, data in updates
+    ])
 
 
 def send_groupbuy_joined_notification(groupbuy_id, user_id, joined_user_name):
@@ -125,7 +193,7 @@ def send_groupbuy_joined_notification(groupbuy_id, user_id, joined_user_name):
         'joined_user': joined_user_name,
         'message': f'{joined_user_name} 加入了拼单'
     }
-    
+
     send_user_notification(user_id, 'groupbuy_joined', notification_data)
 
 
@@ -137,5 +205,22 @@ def send_leader_notification(leader_id, notification_type, data):
     })
 
 
-# 导入timezone
-from django.utils import timezone
+class PushStatsMiddleware:
+    """统计每个请求发出的 WebSocket 消息数，写入 X-WS-Pushes 响应头（消息数/批次数）"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = {'messages': 0, 'batches': 0}
+        token = _push_stats.set(stats)
+        try:
+            response = self.get_response(request)
+        finally:
+            _push_stats.reset(token)
+        request.ws_pushes = stats
+        if stats['batches']:
+            response['X-WS-Pushes'] = f"{stats['messages']}/{stats['batches']}"
+            logger.debug('%s %s 推送 %d 条消息，%d 批', request.method, request.path,
+                         stats['messages'], stats['batches'])
+        return response
@@ -14,6 +14,7 @@ from pathlib import Path
 import os
 from datetime import timedelta
 from dotenv import load_dotenv
+from corsheaders.defaults import default_headers
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -38,6 +39,8 @@ ALLOWED_HOSTS = ['127.0.0.1', 'localhost', 'testserver']
 # Application definition
 
 INSTALLED_APPS = [
+    # daphne 需位于首位：runserver 改为以 ASGI 方式运行，同时提供 WebSocket
+    'daphne',
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -61,6 +64,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # 每个请求的 WebSocket 推送统计（X-WS-Pushes 响应头）
+    'api.websocket_utils.PushStatsMiddleware',
 ]
 
 ROOT_URLCONF = 'core.urls'
@@ -81,6 +86,32 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'core.wsgi.application'
+ASGI_APPLICATION = 'core.asgi.application'
+
+# WebSocket 推送的 channel layer：memory 仅限单进程部署与测试，多进程/多节点部署使用 redis
+CHANNEL_LAYER_BACKEND = os.getenv('CHANNEL_LAYER_BACKEND', 'memory')
+if CHANNEL_LAYER_BACKEND == 'redis':
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {
+                'hosts': [os.getenv('CHANNEL_REDIS_URL', 'redis://127.0.0.1:6379/4')],
+                'capacity': int(os.getenv('CHANNEL_LAYER_CAPACITY', '1000')),
+                'expiry': int(os.getenv('CHANNEL_LAYER_EXPIRY', '60')),
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        },
+    }
+# 每个 WebSocket 房间保留最近多少条消息（及最长秒数）供客户端重连后补收，超出则提示重新加载
+WS_REPLAY_BUFFER_SIZE = int(os.getenv('WS_REPLAY_BUFFER_SIZE', '200'))
+WS_REPLAY_TTL = int(os.getenv('WS_REPLAY_TTL', '600'))
+# 拼单进度推送的合并窗口（毫秒），每个进程每个拼单房间每个窗口最多推送一帧；0 为不合并
+GROUPBUY_BROADCAST_WINDOW_MS = int(os.getenv('GROUPBUY_BROADCAST_WINDOW_MS', '250'))
 
 
 # Database
@@ -173,6 +204,34 @@ SIMPLE_JWT = {
     'AUTH_HEADER_TYPES': ('Bearer',),
 }
 
+# 缓存：生产环境使用 Redis；测试和单机部署使用进程内 LRU 缓存
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'locmem').lower()
+if CACHE_BACKEND == 'redis':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('CACHE_REDIS_URL', 'redis://127.0.0.1:6379/2'),
+            'KEY_PREFIX': 'cgb',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'community-group-buying',
+            'OPTIONS': {'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', '5000'))},
+        }
+    }
+
+# 各公开接口的响应缓存时间（秒），见 api/caching.py
+API_CACHE_TTLS = {
+    'groupbuy_public_list': 30,
+    'product_public_list': 60,
+    'successful_groupbuys': 300,
+    'featured_leaders': 300,
+    'membership_tiers': 3600,
+}
+
 # Celery / Redis configuration
 CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', 'redis://127.0.0.1:6379/0')
 CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND', 'redis://127.0.0.1:6379/1')
@@ -181,8 +240,44 @@ CELERY_TASK_TIME_LIMIT = 60 * 10
 CELERY_TASK_SOFT_TIME_LIMIT = 60 * 5
 CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
 
-# Celery beat schedule placeholder (will be configured later in code or admin)
-# 若使用 DatabaseScheduler，周期任务请在 Django Admin 或通过脚本创建
+# 若使用 DatabaseScheduler，周期任务也可在 Django Admin 或通过脚本创建；
+# 下列条目会在 beat 启动时同步到数据库
+# 拼单的开始/结束由生命周期调度器按精确时间点触发，全表扫描任务仅作低频兜底
+GROUPBUY_SCHEDULE_HORIZON = int(os.getenv('GROUPBUY_SCHEDULE_HORIZON', '3600'))
+# 到点却未能转换时重新投递的最小延迟（秒）
+GROUPBUY_SCHEDULE_RETRY_DELAY = int(os.getenv('GROUPBUY_SCHEDULE_RETRY_DELAY', '5'))
+# 首页统计缓存的刷新周期（秒）
+PUBLIC_STATS_REFRESH_SECONDS = int(os.getenv('PUBLIC_STATS_REFRESH_SECONDS', '60'))
+CELERY_BEAT_SCHEDULE = {
+    'refill-groupbuy-schedule': {
+        'task': 'api.tasks.refill_groupbuy_schedule',
+        'schedule': GROUPBUY_SCHEDULE_HORIZON / 2,
+    },
+    'activate-pending-groupbuys': {
+        'task': 'api.tasks.activate_pending_groupbuys',
+        'schedule': 60 * 10,
+    },
+    'finalize-groupbuys': {
+        'task': 'api.tasks.finalize_groupbuys',
+        'schedule': 60 * 10,
+    },
+    'release-expired-reservations': {
+        'task': 'api.tasks.release_expired_reservations',
+        'schedule': 60,
+    },
+    'flush-stock-counters': {
+        'task': 'api.tasks.flush_stock_counters',
+        'schedule': int(os.getenv('STOCK_COUNTER_FLUSH_SECONDS', '5')),
+    },
+    'refresh-public-stats': {
+        'task': 'api.tasks.refresh_public_stats',
+        'schedule': PUBLIC_STATS_REFRESH_SECONDS,
+    },
+    'process-payment-callbacks': {
+        'task': 'api.tasks.process_payment_callbacks',
+        'schedule': float(os.getenv('PAYMENT_INBOX_POLL_SECONDS', '2')),
+    },
+}
 
 # CORS settings (allow frontend dev server)
 CORS_ALLOWED_ORIGINS = [
@@ -190,4 +285,51 @@ CORS_ALLOWED_ORIGINS = [
     'http://127.0.0.1:8081',
 ]
 CORS_ALLOW_CREDENTIALS = True
-
+# 允许客户端携带幂等键，并读取是否为重放的响应头
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key')
+CORS_EXPOSE_HEADERS = ['Idempotent-Replayed', 'X-WS-Pushes']
+
+
+# 拼单到期结算每批处理的拼单数
+GROUPBUY_FINALIZE_CHUNK_SIZE = int(os.getenv('GROUPBUY_FINALIZE_CHUNK_SIZE', '500'))
+
+# 参团库存预留的有效期（分钟），超时未支付的订单由定时任务取消并释放库存
+STOCK_RESERVATION_TTL_MINUTES = int(os.getenv('STOCK_RESERVATION_TTL_MINUTES', '30'))
+# 每批释放的预留数
+STOCK_RESERVATION_BATCH_SIZE = int(os.getenv('STOCK_RESERVATION_BATCH_SIZE', '500'))
+
+# 购物车单次结算最多包含的拼单数
+CHECKOUT_MAX_LINES = int(os.getenv('CHECKOUT_MAX_LINES', '20'))
+
+# 幂等键：响应保存时间与处理中占用的超时时间（秒）
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv('IDEMPOTENCY_TTL_SECONDS', str(24 * 3600)))
+IDEMPOTENCY_LOCK_SECONDS = int(os.getenv('IDEMPOTENCY_LOCK_SECONDS', '60'))
+
+# 热门拼单等候室：是否启用、名额计数器与数据库的同步周期、排队准入的有效期（秒）
+WAITING_ROOM_ENABLED = os.getenv('WAITING_ROOM_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+WAITING_ROOM_SYNC_SECONDS = int(os.getenv('WAITING_ROOM_SYNC_SECONDS', '10'))
+WAITING_ROOM_ADMISSION_SECONDS = int(os.getenv('WAITING_ROOM_ADMISSION_SECONDS', '120'))
+
+# 分片库存计数器（见 api/services/stock_counters.py）：后端为 redis 或 memory（仅测试/单进程）
+STOCK_COUNTERS_ENABLED = os.getenv('STOCK_COUNTERS_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+STOCK_COUNTER_BACKEND = os.getenv('STOCK_COUNTER_BACKEND', 'redis')
+STOCK_COUNTER_REDIS_URL = os.getenv('STOCK_COUNTER_REDIS_URL', 'redis://127.0.0.1:6379/3')
+STOCK_COUNTER_SHARDS = int(os.getenv('STOCK_COUNTER_SHARDS', '8'))
+STOCK_COUNTER_FLUSH_BATCH = int(os.getenv('STOCK_COUNTER_FLUSH_BATCH', '500'))
+
+# 支付回调收件箱：每批处理的回调数（见 api/services/payment_inbox.py）
+PAYMENT_INBOX_BATCH_SIZE = int(os.getenv('PAYMENT_INBOX_BATCH_SIZE', '200'))
+
+# 会员等级重新评定（retier_users）每块处理的用户 id 区间长度
+MEMBERSHIP_RETIER_CHUNK_SIZE = int(os.getenv('MEMBERSHIP_RETIER_CHUNK_SIZE', '5000'))
+
+# 支付网关客户端（见 api/payment_gateway.py）：为空时支付视图返回演示参数
+PAYMENT_GATEWAY_URL = os.getenv('PAYMENT_GATEWAY_URL', '')
+PAYMENT_GATEWAY_CONNECT_TIMEOUT = float(os.getenv('PAYMENT_GATEWAY_CONNECT_TIMEOUT', '1'))
+PAYMENT_GATEWAY_READ_TIMEOUT = float(os.getenv('PAYMENT_GATEWAY_READ_TIMEOUT', '3'))
+PAYMENT_GATEWAY_RETRIES = int(os.getenv('PAYMENT_GATEWAY_RETRIES', '2'))
+PAYMENT_GATEWAY_BACKOFF = float(os.getenv('PAYMENT_GATEWAY_BACKOFF', '0.2'))
+PAYMENT_GATEWAY_POOL_SIZE = int(os.getenv('PAYMENT_GATEWAY_POOL_SIZE', '20'))
+# 连续失败多少次后熔断，以及熔断后多久放行探测请求（秒）
+PAYMENT_GATEWAY_BREAKER_THRESHOLD = int(os.getenv('PAYMENT_GATEWAY_BREAKER_THRESHOLD', '5'))
+PAYMENT_GATEWAY_BREAKER_RESET_SECONDS = float(os.getenv('PAYMENT_GATEWAY_BREAKER_RESET_SECONDS', '30'))
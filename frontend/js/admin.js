@@ -759,16 +759,33 @@
     
     // Try multiple endpoints for leader applications
     const endpoints = [
-      '/api/admin/leader-applications/',
+      '/api/admin/leader-applications/?page_size=100',
       '/api/admin/leaders/',
       '/api/users/?role=leader'
     ];
     
     let data = [];
+    let counts = null;
     for (const endpoint of endpoints) {
       const res = await window.api.fetchAPI(endpoint);
       if (res.ok) {
-        data = await res.json();
+        const payload = await res.json();
+        // 团长申请接口为分页结构：{ total, page, page_size, counts, results }
+        data = Array.isArray(payload) ? payload : (payload.results || []);
+        counts = Array.isArray(payload) ? null : (payload.counts || null);
+        if (!Array.isArray(payload) && payload.total) {
+          // 逐页获取，直到取满 total 条（单页最多 100 条）
+          let page = payload.page || 1;
+          while (data.length < payload.total) {
+            page += 1;
+            const sep = endpoint.includes('?') ? '&' : '?';
+            const next = await window.api.fetchAPI(`${endpoint}${sep}page=${page}`);
+            if (!next.ok) break;
+            const results = (await next.json()).results || [];
+            if (results.length === 0) break;
+            data = data.concat(results);
+          }
+        }
         break;
       }
     }
@@ -788,8 +805,9 @@
     // 添加统计概览
     const statsCard = document.createElement('div');
     statsCard.className = 'card shadow-community mb-4';
-    const pendingCount = data.filter(u => u.leader_status === 'pending' || u.status === 'pending').length;
-    const approvedCount = data.filter(u => u.leader_status === 'approved' || u.role === 'leader').length;
+    const pendingCount = counts ? counts.pending : data.filter(u => u.leader_status === 'pending' || u.status === 'pending').length;
+    const approvedCount = counts ? counts.approved : data.filter(u => u.leader_status === 'approved' || u.role === 'leader').length;
+    const totalCount = counts ? counts.all : data.length;
     
     statsCard.innerHTML = `
       <div class="card-body">
@@ -809,7 +827,7 @@
           </div>
           <div class="col-4">
             <div class="text-center">
-              <div class="fs-4 fw-bold">${data.length}</div>
+              <div class="fs-4 fw-bold">${totalCount}</div>
               <div class="text-muted small">总数</div>
             </div>
           </div>
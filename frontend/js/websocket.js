@@ -3,6 +3,15 @@ window.websocket = (function() {
     let userNotificationSocket = null;
     let reconnectAttempts = 0;
     const maxReconnectAttempts = 5;
+    // 每个房间（stream）的接收状态：floor 及之前的序号都已收到，seen 为 floor 之后已收到的序号。
+    // 多个进程向同一房间推送时消息可能乱序到达，不能只记最大序号；重连时以 floor 补收
+    const streams = {};
+    // floor 之后最多记录的序号数，超出说明缺口长期未补上，视为已丢失
+    const maxSeenPerStream = 200;
+    // 已加入的拼单房间，重连后自动重新加入
+    const joinedRooms = new Set();
+    // 个人通知房间名，由服务端的连接确认消息告知
+    let userStream = null;
     
     /**
      * 初始化WebSocket连接
@@ -30,7 +39,7 @@ window.websocket = (function() {
     function connectGroupBuyUpdates() {
         try {
             const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-            const wsUrl = `${protocol}//${window.location.host}/ws/groupbuys/`;
+            const wsUrl = `${protocol}//${window.location.host}/ws/groupbuys/${resumeQuery('groupbuy_groupbuy_updates', '?')}`;
             
             groupBuySocket = new WebSocket(wsUrl);
             
@@ -38,6 +47,9 @@ window.websocket = (function() {
                 console.log('拼单更新WebSocket连接已建立');
                 reconnectAttempts = 0;
                 
+                // 重新加入断线前关注的拼单房间
+                joinedRooms.forEach(groupbuyId => sendJoin(groupbuyId));
+                
                 // 显示连接状态（可选）
                 showConnectionStatus('connected');
             };
@@ -45,7 +57,9 @@ window.websocket = (function() {
             groupBuySocket.onmessage = function(e) {
                 try {
                     const data = JSON.parse(e.data);
-                    handleGroupBuyMessage(data);
+                    if (acceptFrame(data)) {
+                        handleGroupBuyMessage(data);
+                    }
                 } catch (error) {
                     console.error('解析WebSocket消息失败:', error);
                 }
@@ -80,7 +94,9 @@ window.websocket = (function() {
     function connectUserNotifications() {
         try {
             const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-            const wsUrl = `${protocol}//${window.location.host}/ws/notifications/`;
+            // 浏览器 WebSocket 不能携带 Authorization 头，access token 通过查询参数传递
+            const token = encodeURIComponent(window.api.getTokens().access || '');
+            const wsUrl = `${protocol}//${window.location.host}/ws/notifications/?token=${token}${resumeQuery(userStream, '&')}`;
             
             userNotificationSocket = new WebSocket(wsUrl);
             
@@ -91,7 +107,12 @@ window.websocket = (function() {
             userNotificationSocket.onmessage = function(e) {
                 try {
                     const data = JSON.parse(e.data);
-                    handleUserNotification(data);
+                    if (data.type === 'connection_established') {
+                        userStream = data.stream;
+                    }
+                    if (acceptFrame(data)) {
+                        handleUserNotification(data);
+                    }
                 } catch (error) {
                     console.error('解析用户通知消息失败:', error);
                 }
@@ -120,6 +141,79 @@ window.websocket = (function() {
         }
     }
     
+    /**
+     * 重连查询参数：带上该房间最后收到的序号
+     */
+    function resumeQuery(stream, separator) {
+        return stream && streams[stream] ? `${separator}last_seq=${streams[stream].floor}` : '';
+    }
+    
+    /**
+     * 记录收到的序号，返回是否为首次收到
+     */
+    function markSeen(state, seq) {
+        if (seq <= state.floor || state.seen.has(seq)) {
+            return false;
+        }
+        state.seen.add(seq);
+        if (state.seen.size > maxSeenPerStream) {
+            // 放弃最早的缺口，从已收到的最小序号继续
+            state.floor = Math.min(...state.seen) - 1;
+        }
+        while (state.seen.has(state.floor + 1)) {
+            state.floor += 1;
+            state.seen.delete(state.floor);
+        }
+        return true;
+    }
+    
+    /**
+     * 按序号过滤消息：重复的消息返回 false；resync 时重新拉取数据
+     */
+    function acceptFrame(data) {
+        const stream = data.stream;
+        if (!stream || typeof data.seq !== 'number') {
+            return true;
+        }
+        
+        // 连接/加入确认携带当前序号，首次连接时以此为起点
+        if (data.type === 'connection_established' || data.type === 'joined_groupbuy') {
+            if (!streams[stream]) {
+                streams[stream] = { floor: data.seq, seen: new Set() };
+            }
+            return true;
+        }
+        
+        if (data.type === 'resync') {
+            streams[stream] = { floor: data.seq, seen: new Set() };
+            handleResync(stream);
+            return false;
+        }
+        
+        if (!streams[stream]) {
+            streams[stream] = { floor: data.seq - 1, seen: new Set() };
+        }
+        return markSeen(streams[stream], data.seq);
+    }
+    
+    /**
+     * 断线过久、错过的消息已不在服务端缓冲区中：重新拉取一次相关列表
+     */
+    function handleResync(stream) {
+        console.log('WebSocket消息需要重新同步:', stream);
+        
+        if (stream.startsWith('user_')) {
+            if (window.location.pathname === '/orders.html' && typeof window.loadMyOrders === 'function') {
+                window.loadMyOrders();
+            }
+        } else if (typeof window.loadActiveGroupBuys === 'function') {
+            window.loadActiveGroupBuys();
+        }
+        
+        // 页面可监听该事件自行刷新
+        document.dispatchEvent(new CustomEvent('websocket:resync', { detail: { stream } }));
+    }
+    
     /**
      * 处理拼单更新消息
      */
@@ -175,6 +269,16 @@ window.websocket = (function() {
                 handleSystemNotification(data);
                 break;
                 
+            case 'queue_status':
+                // 等候室中本人的排队号与准入结果，参团页面可监听该事件显示排队进度
+                document.dispatchEvent(new CustomEvent('waitingroom:position', { detail: data }));
+                break;
+                
+            case 'notifications_read':
+                // 已读回执携带最新未读数，页面可监听该事件更新角标
+                document.dispatchEvent(new CustomEvent('notifications:unread', { detail: { count: data.unread_count } }));
+                break;
+                
             default:
                 console.log('未知的用户通知类型:', data.type);
         }
@@ -384,11 +488,21 @@ window.websocket = (function() {
      * 加入拼单房间
      */
     function joinGroupBuyRoom(groupbuyId) {
+        joinedRooms.add(groupbuyId);
+        sendJoin(groupbuyId);
+    }
+    
+    function sendJoin(groupbuyId) {
         if (groupBuySocket && groupBuySocket.readyState === WebSocket.OPEN) {
-            groupBuySocket.send(JSON.stringify({
+            const message = {
                 type: 'join_groupbuy',
                 groupbuy_id: groupbuyId
-            }));
+            };
+            const state = streams[`groupbuy_${groupbuyId}`];
+            if (state) {
+                message.last_seq = state.floor;
+            }
+            groupBuySocket.send(JSON.stringify(message));
         }
     }
     
@@ -396,6 +510,8 @@ window.websocket = (function() {
      * 离开拼单房间
      */
     function leaveGroupBuyRoom(groupbuyId) {
+        joinedRooms.delete(groupbuyId);
+        delete streams[`groupbuy_${groupbuyId}`];
         if (groupBuySocket && groupBuySocket.readyState === WebSocket.OPEN) {
             groupBuySocket.send(JSON.stringify({
                 type: 'leave_groupbuy',
@@ -404,6 +520,21 @@ window.websocket = (function() {
         }
     }
     
+    /**
+     * 标记通知为已读：传入通知ID数组，不传则全部标记
+     */
+    function markNotificationsRead(notificationIds) {
+        if (userNotificationSocket && userNotificationSocket.readyState === WebSocket.OPEN) {
+            const message = { type: 'mark_read' };
+            if (Array.isArray(notificationIds)) {
+                message.notification_ids = notificationIds;
+            } else {
+                message.all = true;
+            }
+            userNotificationSocket.send(JSON.stringify(message));
+        }
+    }
+    
     /**
      * 断开WebSocket连接
      */
@@ -426,6 +557,7 @@ window.websocket = (function() {
         init,
         joinGroupBuyRoom,
         leaveGroupBuyRoom,
+        markNotificationsRead,
         disconnect,
         showNotificationToast
     };